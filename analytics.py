@@ -0,0 +1,273 @@
+# analytics.py
+# Columnar analytics engine for the ledgers. A ledger is parsed once into typed columns (dates as day numbers, amounts, money as integer cents and products as integer codes) and totals, date-range sums and group-bys run as vectorized NumPy operations. Without NumPy the same functions fall back to plain loops over the columns.
+# Besides 'bought' and 'sold' it reads the lot allocations of lots.py ('allocations.csv', whatever the storage backend), which serve the cost of goods sold when that file is not in date order and the cost of goods sold per product of 'top --by margin'.
+# Run 'python analytics.py [rows]' to benchmark the engine against the per-row dict loops on synthetic data.
+import csv
+import os
+from array import array
+from datetime import date
+from ledgercache import get_cached_columns
+from lots import allocations_link
+from storage import bought_link, get_storage, sold_link
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ledger_columns = {
+    'bought': (bought_link, ('purchase_date', 'amount', 'total_cost', 'product_name')),
+    'sold': (sold_link, ('sell_date', 'amount', 'total_earnings', 'product_name')),
+    'allocations': (allocations_link, ('sell_date', 'amount', 'cost', 'product_name')),
+}
+_cache = {}
+
+
+# Typed columns of one ledger. 'dates' holds day numbers (date.toordinal), 'money' holds cents and 'products' holds indexes into product_names.
+class LedgerColumns:
+    __slots__ = ('dates', 'amounts', 'money', 'products',
+                 'product_names', 'is_sorted')
+
+    def __init__(self, dates, amounts, money, products, product_names):
+        if np is not None:
+            dates = np.asarray(dates, dtype=np.int32)
+            amounts = np.asarray(amounts, dtype=np.int64)
+            money = np.asarray(money, dtype=np.int64)
+            products = np.asarray(products, dtype=np.int32)
+            self.is_sorted = bool(np.all(dates[1:] >= dates[:-1]))
+        else:
+            self.is_sorted = all(a <= b for a, b in zip(dates, dates[1:]))
+        self.dates = dates
+        self.amounts = amounts
+        self.money = money
+        self.products = products
+        self.product_names = product_names
+
+    def __len__(self):
+        return len(self.dates)
+
+
+# Converts a YYYY-MM-DD date to its day number.
+def day_number(text):
+    try:
+        return date.fromisoformat(text).toordinal()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date {text!r}, expected YYYY-MM-DD")
+
+
+# Parses (date, amount, money, product) string tuples into LedgerColumns, converting every distinct date and product only once.
+def build_columns(rows):
+    day_numbers = {}
+    product_codes = {}
+    dates, amounts, money, products = array('i'), array('q'), array('q'), array('i')
+    for day, amount, total, product in rows:
+        number = day_numbers.get(day)
+        if number is None:
+            number = day_numbers[day] = day_number(day)
+        code = product_codes.get(product)
+        if code is None:
+            code = product_codes[product] = len(product_codes)
+        dates.append(number)
+        amounts.append(int(amount))
+        money.append(round(float(total) * 100))
+        products.append(code)
+    return LedgerColumns(dates, amounts, money, products, list(product_codes))
+
+
+# Builds LedgerColumns from the binary ledger cache, converting each distinct value once and expanding them with the row codes. Returns None when there is no usable cache.
+def columns_from_cache(kind):
+    file_path, names = ledger_columns[kind]
+    cached = get_cached_columns(file_path, names)
+    if cached is None:
+        return None
+
+    def expand(name, convert, dtype):
+        codes, values = cached[name]
+        if values is None:
+            numbers, codes = np.unique(codes, return_inverse=True)
+            values = [str(number) for number in numbers.tolist()]
+        return np.array([convert(value) for value in values], dtype=dtype)[codes]
+
+    products, product_names = cached[names[3]]
+    if product_names is None:
+        return None
+    return LedgerColumns(expand(names[0], day_number, np.int32),
+                         expand(names[1], int, np.int64),
+                         expand(names[2], lambda total: round(float(total) * 100), np.int64),
+                         products, product_names)
+
+
+# Returns the name of the backend a ledger is read from: the selected storage backend, or 'csv' for the allocations.
+def ledger_backend(kind):
+    return 'csv' if kind == 'allocations' else get_storage().name
+
+
+# Yields the (date, amount, money, product) values of every row of a ledger in the selected storage backend: strings read from a CSV file, typed values from other backends.
+def read_ledger_rows(kind):
+    file_path, names = ledger_columns[kind]
+    storage = get_storage()
+    if ledger_backend(kind) != 'csv':
+        if kind == 'bought':
+            for item in storage.get_bought_items():
+                yield item.purchase_date, item.amount, item.cost_cents / 100, item.product_name
+        else:
+            for item in storage.get_sold_items():
+                yield item.sell_date, item.amount, item.earnings_cents / 100, item.product_name
+        return
+    if not os.path.isfile(file_path):
+        return
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file, delimiter='|')
+        header = next(reader, [])
+        positions = [header.index(name) for name in names]
+        for row in reader:
+            if row:
+                yield tuple(row[position] for position in positions)
+
+
+# Returns what the cached columns of a ledger depend on: the file size and modification time for CSV, the last ID for SQLite.
+def ledger_signature(kind):
+    backend = ledger_backend(kind)
+    if backend != 'csv':
+        storage = get_storage()
+        last_id = storage.next_bought_id() if kind == 'bought' else storage.next_sold_id()
+        return backend, last_id
+    try:
+        status = os.stat(ledger_columns[kind][0])
+    except FileNotFoundError:
+        return backend, None
+    return backend, status.st_size, status.st_mtime_ns
+
+
+# Returns the columns of the 'bought', 'sold' or 'allocations' ledger, parsing it only when it changed since the last call in this process. CSV ledgers are loaded from the binary ledger cache when possible.
+def load_columns(kind):
+    signature = ledger_signature(kind)
+    cached = _cache.get(kind)
+    if cached and cached[0] == signature:
+        return cached[1]
+    columns = None
+    if np is not None and signature[0] == 'csv' and signature[1] is not None:
+        columns = columns_from_cache(kind)
+    if columns is None:
+        columns = build_columns(read_ledger_rows(kind))
+    _cache[kind] = (signature, columns)
+    return columns
+
+
+# Returns the positions of the rows dated between start_date and end_date (inclusive): a slice when the dates are sorted, otherwise a mask (NumPy) or a list of positions. Bounds outside the dates Python supports, like '0000-00-00' and '9999-99-99', select from the first or up to the last row.
+def select_between(columns, start_date, end_date):
+    first, last = day_number(max(start_date, '0001-01-01')), day_number(min(end_date, '9999-12-31'))
+    dates = columns.dates
+    if np is not None:
+        if columns.is_sorted:
+            return slice(int(np.searchsorted(dates, first, 'left')), int(np.searchsorted(dates, last, 'right')))
+        return (dates >= first) & (dates <= last)
+    return [position for position, day in enumerate(dates) if first <= day <= last]
+
+
+# Sums a column ('money' or 'amounts') over the rows dated between start_date and end_date (inclusive).
+def sum_between(columns, start_date, end_date, field='money'):
+    values = getattr(columns, field)
+    selection = select_between(columns, start_date, end_date)
+    if np is not None:
+        return int(values[selection].sum())
+    return sum(values[position] for position in selection)
+
+
+# Sums a column over the whole ledger.
+def total(columns, field='money'):
+    values = getattr(columns, field)
+    return int(values.sum()) if np is not None else sum(values)
+
+
+# Groups the rows dated between start_date and end_date (inclusive) by product and returns {product: (units, cents)}.
+def group_by_product(columns, start_date, end_date):
+    selection = select_between(columns, start_date, end_date)
+    size = len(columns.product_names)
+    if np is not None:
+        products = columns.products[selection]
+        units = np.bincount(
+            products, weights=columns.amounts[selection], minlength=size)
+        money = np.bincount(
+            products, weights=columns.money[selection], minlength=size)
+        return {name: (int(units[code]), int(money[code]))
+                for code, name in enumerate(columns.product_names) if units[code] or money[code]}
+    groups = {}
+    for position in selection:
+        name = columns.product_names[columns.products[position]]
+        units, money = groups.get(name, (0, 0))
+        groups[name] = (units + columns.amounts[position],
+                        money + columns.money[position])
+    return groups
+
+
+# Groups the rows dated between start_date and end_date (inclusive) by day and returns {day number: (units, cents)} in date order.
+def group_by_day(columns, start_date, end_date):
+    selection = select_between(columns, start_date, end_date)
+    if np is not None:
+        days, inverse = np.unique(columns.dates[selection], return_inverse=True)
+        units = np.bincount(inverse, weights=columns.amounts[selection])
+        money = np.bincount(inverse, weights=columns.money[selection])
+        return {int(day): (int(units[i]), int(money[i])) for i, day in enumerate(days)}
+    groups = {}
+    for position in selection:
+        units, money = groups.get(columns.dates[position], (0, 0))
+        groups[columns.dates[position]] = (units + columns.amounts[position],
+                                           money + columns.money[position])
+    return dict(sorted(groups.items()))
+
+
+# Benchmarks the engine against the per-row dict loops of the old metrics.py on synthetic rows.
+def benchmark(rows=1_000_000):
+    import random
+    import time
+    from datetime import timedelta
+
+    random.seed(1)
+    first_day = date(2020, 1, 1)
+    products = [f'product{number}' for number in range(500)]
+    days = sorted(random.randrange(5 * 365) for _ in range(rows))
+    items = [{'id': str(number), 'product_name': random.choice(products), 'amount': str(amount),
+              'sell_date': (first_day + timedelta(days=day)).isoformat(), 'price': '1.25',
+              'total_earnings': str(round(amount * 1.25, 2))}
+             for number, (day, amount) in enumerate(((day, random.randint(1, 20)) for day in days), start=1)]
+    start_date, end_date = '2021-03-01', '2023-08-31'
+
+    def measure(function):
+        started = time.perf_counter()
+        result = function()
+        return time.perf_counter() - started, result
+
+    load_time, columns = measure(lambda: build_columns(
+        (item['sell_date'], item['amount'], item['total_earnings'], item['product_name']) for item in items))
+
+    def dict_range_sum():
+        total_revenue = 0
+        for item in items:
+            if start_date <= item['sell_date'] <= end_date:
+                total_revenue += float(item['total_earnings'])
+        return round(total_revenue * 100)
+
+    def dict_group_by():
+        groups = {}
+        for item in items:
+            if start_date <= item['sell_date'] <= end_date:
+                units, money = groups.get(item['product_name'], (0, 0.0))
+                groups[item['product_name']] = (
+                    units + int(item['amount']), money + float(item['total_earnings']))
+        return groups
+
+    print(f"{rows} rows, NumPy {'enabled' if np is not None else 'not installed'}")
+    print(f"  parse into columns (once):   {load_time:8.3f}s")
+    for label, old, new in (('date-range revenue', dict_range_sum, lambda: sum_between(columns, start_date, end_date)),
+                            ('revenue per product', dict_group_by, lambda: group_by_product(columns, start_date, end_date))):
+        old_time, old_result = measure(old)
+        new_time, new_result = measure(new)
+        if label == 'date-range revenue':
+            assert abs(old_result - new_result) <= 1, (old_result, new_result)
+        print(f"  {label:28} dict loop {old_time:8.3f}s   engine {new_time:8.4f}s   speedup {old_time / max(new_time, 1e-9):7.1f}x")
+
+
+if __name__ == '__main__':
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,254 @@
+# api.py
+# Local HTTP/JSON service for several checkout terminals at once. Requests are handled concurrently on an asyncio event loop. All purchases and sales of the API go through a single writer task: it takes every job waiting in the queue, registers each run of purchases or sales as one batch in a worker thread, and then swaps in a new read snapshot. Reads are answered from the current snapshot without any locking, so they never wait for a write.
+# Other processes, like the regular commands or the shell, may write to the same ledgers. Under the ledger lock, before every group of jobs and at least every refresh_interval seconds while idle, the writer rereads the stored inventory and totals and applies the ledger rows added since (see LedgerState.refresh), so their changes are kept and show up in the reads.
+#
+# GET  /today                        current date
+# GET  /inventory                    current stock per product
+# GET  /totals                       total cost, revenue and profit
+# GET  /metrics?start=...&end=...    cost, revenue and profit for a date or date range
+# POST /buy                          one purchase record or a list of them (same fields as 'buy --from')
+# POST /sell                         one sale record or a list of them (same fields as 'sell --from')
+import asyncio
+import copy
+import json
+from urllib.parse import parse_qs, urlsplit
+from buy import parse_purchase_record
+from date import get_date
+from locking import ledger_lock
+from sell import parse_sale_record
+from rollup import days_between
+from shell import LedgerState
+from storage import bought_headers, sold_headers
+
+default_host = '127.0.0.1'
+default_port = 8765
+max_body_size = 10 * 1024 * 1024
+refresh_interval = 1.0
+
+status_texts = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+# Read-only view of the in-memory ledger state that the reads are served from. The writer builds a new snapshot after every commit and swaps it in; a snapshot is never changed after it is built.
+class Snapshot:
+    def __init__(self, inventory, total_cost, total_revenue, days):
+        self.inventory = inventory
+        self.total_cost = total_cost
+        self.total_revenue = total_revenue
+        self.days = days
+
+    # Sums one rollup field over a date range (inclusive).
+    def sum_between(self, name, start_date, end_date=None):
+        return round(sum(day[name] for _, day in days_between({'days': self.days}, start_date, end_date or start_date)), 2)
+
+
+# Serves the HTTP API on top of one in-memory ledger state, only touched by the writer task, and the read snapshot it publishes.
+class ApiServer:
+    def __init__(self):
+        self.state = LedgerState()
+        self.snapshot = self.take_snapshot(None, self.state.rollup['days'])
+        self.writes = None
+
+    # Returns a snapshot of the ledger state. The per-day totals are shared with the previous snapshot, except for the changed days, which are copied.
+    def take_snapshot(self, previous, changed_days):
+        days = dict(previous.days) if previous else {}
+        for day in changed_days:
+            days[day] = copy.deepcopy(self.state.rollup['days'][day])
+        return Snapshot(dict(self.state.inventory), self.state.total_cost, self.state.total_revenue, days)
+
+    # Applies queued purchases and sales: waits for a job, takes every other job already queued, registers them in a worker thread and swaps in the new snapshot, so writers that arrive together share one group commit. When no job arrives for refresh_interval seconds it only catches up with the other writers.
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                jobs = [await asyncio.wait_for(self.writes.get(), refresh_interval)]
+            except asyncio.TimeoutError:
+                jobs = []
+            while not self.writes.empty():
+                jobs.append(self.writes.get_nowait())
+            try:
+                results, self.snapshot = await loop.run_in_executor(
+                    None, self.apply_writes, [(kind, records) for kind, records, _ in jobs])
+            except Exception as e:
+                results = [e] * len(jobs)
+            for (_, _, future), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    # Catches up with the other writers and registers jobs of validated records in order, each run of consecutive purchase jobs or sale jobs as one batch, all under the ledger lock. Returns the result (or exception) of every job and the new snapshot.
+    def apply_writes(self, jobs):
+        results = []
+        position = 0
+        with ledger_lock():
+            changed_days = self.state.refresh()
+            while position < len(jobs):
+                kind = jobs[position][0]
+                end = position
+                while end < len(jobs) and jobs[end][0] == kind:
+                    end += 1
+                batch = [records for _, records in jobs[position:end]]
+                try:
+                    run_results, rows = self.apply_purchases(batch) if kind == 'buy' else self.apply_sales(batch)
+                except Exception as e:
+                    run_results, rows = [e] * len(batch), []
+                results += run_results
+                changed_days.update(row[3] for row in rows)
+                position = end
+        return results, self.take_snapshot(self.snapshot, changed_days)
+
+    # Registers the purchases of several jobs in one batch and returns the result of every job and the new rows.
+    def apply_purchases(self, batch):
+        rows = self.state.buy([record for records in batch for record in records])
+        results = []
+        position = 0
+        for records in batch:
+            results.append((200, {'purchases': [dict(zip(bought_headers, row))
+                                                for row in rows[position:position + len(records)]]}))
+            position += len(records)
+        return results, rows
+
+    # Registers the sales of several jobs in one batch and returns the result of every job and the new rows. A job is rejected as a whole when any of its lines exceeds the stock left after the jobs before it.
+    def apply_sales(self, batch):
+        inventory = dict(self.state.inventory)
+        results = []
+        accepted = []
+        for records in batch:
+            taken = {}
+            for product_name, amount, _ in records:
+                available_stock = inventory.get(product_name, 0) - taken.get(product_name, 0)
+                if available_stock < amount:
+                    results.append((409, {'error': f"Not enough stock for {product_name}. Available stock: {available_stock}"}))
+                    break
+                taken[product_name] = taken.get(product_name, 0) + amount
+            else:
+                for product_name, amount in taken.items():
+                    inventory[product_name] -= amount
+                results.append(None)
+                accepted.append(records)
+        rows = self.state.sell([record for records in accepted for record in records]) if accepted else []
+        sizes = iter(len(records) for records in accepted)
+        position = 0
+        for number, result in enumerate(results):
+            if result is None:
+                size = next(sizes)
+                results[number] = (200, {'sales': [dict(zip(sold_headers, row))
+                                                   for row in rows[position:position + size]]})
+                position += size
+        return results, rows
+
+    # Validates the records of a POST body and hands them to the writer task.
+    async def queue_write(self, kind, body):
+        try:
+            data = json.loads(body or b'null')
+        except json.JSONDecodeError:
+            return 400, {'error': 'Request body is not valid JSON.'}
+        records = data if isinstance(data, list) else [data]
+        parse_record = parse_purchase_record if kind == 'buy' else parse_sale_record
+        parsed = []
+        for number, record in enumerate(records):
+            value, error = parse_record(record)
+            if error:
+                return 400, {'error': f"Record {number}: {error}"}
+            parsed.append(value)
+        if not parsed:
+            return 400, {'error': 'No records given.'}
+
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((kind, parsed, future))
+        return await future
+
+    # Routes one request and returns its status and JSON payload.
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if method == 'POST' and path in ('/buy', '/sell'):
+            return await self.queue_write(path[1:], body)
+        if method != 'GET':
+            return 404, {'error': f"No route for {method} {path}"}
+        if path == '/today':
+            return 200, {'today': get_date()}
+        snapshot = self.snapshot
+        if path == '/inventory':
+            return 200, {'inventory': snapshot.inventory}
+        if path == '/totals':
+            return 200, {'total_cost': snapshot.total_cost, 'total_revenue': snapshot.total_revenue,
+                         'total_profit': round(snapshot.total_revenue - snapshot.total_cost, 2)}
+        if path == '/metrics':
+            start_date = query.get('start')
+            if not start_date:
+                return 400, {'error': 'Please provide a start date.'}
+            end_date = query.get('end') or start_date
+            cost = snapshot.sum_between('cost', start_date, end_date)
+            revenue = snapshot.sum_between('revenue', start_date, end_date)
+            return 200, {'start': start_date, 'end': end_date, 'cost': cost,
+                         'revenue': revenue, 'profit': round(revenue - cost, 2)}
+        return 404, {'error': f"No route for {method} {path}"}
+
+    # Reads requests from one connection (keep-alive is supported) and writes the JSON responses.
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                length = int(headers.get('content-length') or 0)
+                if len(parts) != 3:
+                    status, payload, keep_alive = 400, {
+                        'error': 'Malformed request line.'}, False
+                elif length > max_body_size:
+                    status, payload, keep_alive = 413, {
+                        'error': 'Request body too large.'}, False
+                else:
+                    method, target, version = parts
+                    body = await reader.readexactly(length) if length else b''
+                    keep_alive = version == 'HTTP/1.1' and headers.get(
+                        'connection', '').lower() != 'close'
+                    try:
+                        status, payload = await self.dispatch(method, target, body)
+                    except Exception as e:
+                        status, payload = 500, {'error': str(e)}
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write((f"HTTP/1.1 {status} {status_texts[status]}\r\n"
+                              f"Content-Type: application/json\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.writes = asyncio.Queue()
+        writer_task = asyncio.create_task(self.writer())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving the superpy API on http://{host}:{port}. Press Ctrl+C to stop.")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+
+
+# Starts the HTTP API and runs it until interrupted.
+def run_api(host=default_host, port=default_port):
+    try:
+        asyncio.run(ApiServer().serve(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,206 @@
+# archive.py
+# Archiving of closed periods. 'archive --before DATE' moves the ledger rows dated before DATE into gzip-compressed files in a new directory under './files/archive', together with their lot allocations and the cost/revenue/profit logs, and rewrites the live ledgers with the remaining rows unchanged. What the moved rows contribute is carried forward in './files/archive/summary.json':
+#   days          per-day and per-product cost, revenue and units, in the shape of the daily rollup
+#   cogs          cost of goods sold per day, in cents
+#   product_cogs  cost of goods sold per product, in cents
+#   daily_product_cogs  cost of goods sold per day and product, in cents
+#   lots          the lots still open at the cutoff, in the shape of the lot state
+#   inventory     the closing stock per product
+# plus the last archived IDs, so new IDs keep counting up. The storage layer, the rollup, the lots and the point-in-time inventory start from the summary, so every metric covers archived and live rows. Listings and exports of the ledgers only show the live rows.
+# An archive run first writes everything new next to what it replaces: the gzip files in a '<name>.partial' directory, the rewritten ledgers as '<ledger>.archiving' and then './files/archive/pending.json' with the new summary. Only then does it move them into place, rebuild the lots and the rollup and remove the marker. Every step can be redone, so a run that stopped after writing the marker is finished by the next process that opens the CSV backend, and the leftovers of one that stopped before are removed by the next 'archive'.
+# Only the CSV backend can be archived.
+import copy
+import csv
+import gzip
+import json
+import os
+import shutil
+from datetime import date
+from date import get_date
+from locking import atomic_write, ledger_lock
+from profiling import timed
+from storage import archive_link, bought_link, get_storage, pending_link, sold_link, summary_link
+
+log_links = ['./files/cost.txt', './files/revenue.txt', './files/profit.txt']
+
+
+# Returns an empty archive summary.
+def empty_summary():
+    return {'cutoff': '', 'last_bought_id': 0, 'last_sold_id': 0, 'days': {}, 'cogs': {}, 'product_cogs': {},
+            'daily_product_cogs': {}, 'lots': {'products': {}, 'expiry': []}, 'inventory': {}, 'archives': []}
+
+
+# Returns the default cutoff: the first day of the current month, so every earlier month is archived.
+def default_cutoff():
+    return get_date()[:8] + '01'
+
+
+# Returns the path of a new directory for one archive run, named after the cutoff, and creates it with the '.partial' suffix it keeps until the run is finished.
+def new_archive_directory(cutoff):
+    name, number = cutoff, 1
+    while os.path.exists(os.path.join(archive_link, name)):
+        number += 1
+        name = f'{cutoff}-{number}'
+    directory = os.path.join(archive_link, name)
+    os.makedirs(directory + '.partial')
+    return directory
+
+
+# Copies the rows of a ledger dated before the cutoff into a gzip-compressed file and the other rows into a new ledger at live_path, leaving the ledger itself as it is. Lines are copied as they are. Returns the number of rows moved.
+def split_ledger(file_path, date_column, cutoff, archive_path, live_path):
+    moved = 0
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as source:
+        header = source.readline()
+        position = next(csv.reader([header], delimiter='|')).index(date_column)
+        current = [None]
+
+        def lines():
+            for line in source:
+                current[0] = line
+                yield line
+
+        with gzip.open(archive_path, 'wt', encoding='utf-8', newline='') as archived, \
+                atomic_write(live_path, newline='', encoding='utf-8') as live:
+            archived.write(header)
+            live.write(header)
+            for row in csv.reader(lines(), delimiter='|'):
+                if row and row[position] < cutoff:
+                    archived.write(current[0])
+                    moved += 1
+                else:
+                    live.write(current[0])
+    return moved
+
+
+# Moves the contents of the cost/revenue/profit logs into the archive directory and empties them.
+def archive_logs(directory):
+    for log_link in log_links:
+        if not os.path.isfile(log_link) or os.path.getsize(log_link) == 0:
+            continue
+        with open(log_link, 'rb') as log, gzip.open(
+                os.path.join(directory, os.path.basename(log_link) + '.gz'), 'wb') as archived:
+            shutil.copyfileobj(log, archived)
+        with open(log_link, 'w'):
+            pass
+
+
+# Returns the archived cost of goods sold per day and product as {day: {product: cents}}. Summaries written before it was kept get it from the allocations in their archive directories.
+def get_daily_product_cogs(summary):
+    daily_product_cogs = summary.get('daily_product_cogs')
+    if daily_product_cogs is not None:
+        return daily_product_cogs
+    daily_product_cogs = {}
+    for archived in summary['archives']:
+        file_path = os.path.join(archive_link, archived['directory'], 'allocations.csv.gz')
+        if not os.path.isfile(file_path):
+            continue
+        with gzip.open(file_path, 'rt', encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file, delimiter='|'):
+                day_cogs = daily_product_cogs.setdefault(row['sell_date'], {})
+                day_cogs[row['product_name']] = day_cogs.get(row['product_name'], 0) + round(float(row['cost']) * 100)
+    return daily_product_cogs
+
+
+# Adds the moved purchase and sale records to a copy of the summary and returns it, with the allocations of the moved sales.
+def summarize(summary, purchases, sales):
+    from lots import replay_lots
+    from rollup import apply_purchases, apply_sales
+    summary = copy.deepcopy(summary)
+    apply_purchases(summary, (item.to_row() for item in purchases))
+    apply_sales(summary, (item.to_row() for item in sales))
+
+    lots = dict(summary['lots'], last_bought_id=0, last_sold_id=0)
+    allocations = replay_lots(lots, purchases, sales)
+    summary['lots'] = {'products': lots['products'], 'expiry': lots['expiry']}
+    product_cogs = summary.setdefault('product_cogs', {})
+    daily_product_cogs = summary['daily_product_cogs'] = get_daily_product_cogs(summary)
+    for allocation in allocations:
+        cents = round(allocation[5] * 100)
+        summary['cogs'][allocation[1]] = summary['cogs'].get(allocation[1], 0) + cents
+        product_cogs[allocation[3]] = product_cogs.get(allocation[3], 0) + cents
+        day_cogs = daily_product_cogs.setdefault(allocation[1], {})
+        day_cogs[allocation[3]] = day_cogs.get(allocation[3], 0) + cents
+
+    inventory = summary['inventory']
+    for item in purchases:
+        inventory[item.product_name] = inventory.get(item.product_name, 0) + item.amount
+    for item in sales:
+        inventory[item.product_name] = inventory.get(item.product_name, 0) - item.amount
+    summary['inventory'] = {product: stock for product, stock in sorted(inventory.items()) if stock}
+    return summary, allocations
+
+
+# Finishes an archive run that stopped after writing its pending marker: moves its directory and ledgers into place, installs its summary, rebuilds the lots and the rollup and removes the marker. Without a marker it removes the partial directories and ledgers of a run that stopped before. Returns True when a run was finished.
+def recover_archive():
+    from lots import rebuild_lots
+    from rollup import rebuild_rollup
+    with ledger_lock():
+        try:
+            with open(pending_link, 'r') as jsonfile:
+                pending = json.load(jsonfile)
+        except FileNotFoundError:
+            for name in os.listdir(archive_link) if os.path.isdir(archive_link) else ():
+                if name.endswith('.partial'):
+                    shutil.rmtree(os.path.join(archive_link, name))
+            for ledger_link in (bought_link, sold_link):
+                if os.path.exists(ledger_link + '.archiving'):
+                    os.remove(ledger_link + '.archiving')
+            return False
+        if os.path.isdir(pending['directory'] + '.partial'):
+            os.replace(pending['directory'] + '.partial', pending['directory'])
+        for ledger_link in pending['ledgers']:
+            if os.path.exists(ledger_link + '.archiving'):
+                os.replace(ledger_link + '.archiving', ledger_link)
+        with atomic_write(summary_link) as jsonfile:
+            json.dump(pending['summary'], jsonfile)
+        rebuild_lots()
+        rebuild_rollup()
+        os.remove(pending_link)
+    return True
+
+
+# Archives the ledger rows dated before the cutoff (YYYY-MM-DD) and returns {'directory', 'bought_rows', 'sold_rows'}, or None when there is nothing to archive. Raises ValueError for another backend than CSV, an invalid date or a cutoff after today.
+@timed('archive')
+def archive_before(cutoff):
+    storage = get_storage()
+    if storage.name != 'csv':
+        raise ValueError("Archiving is only available for the CSV backend.")
+    cutoff_day = date.fromisoformat(cutoff).toordinal()
+    today = get_date()
+    if cutoff > today:
+        raise ValueError(f"Only closed periods can be archived, {cutoff} is after today ({today}).")
+
+    from lots import allocation_headers
+    with ledger_lock():
+        recover_archive()
+        purchases = [item for item in storage.get_bought_items() if item.purchase_day < cutoff_day]
+        sales = [item for item in storage.get_sold_items() if item.sell_day < cutoff_day]
+        if not purchases and not sales:
+            return None
+        summary, allocations = summarize(storage.get_archive_summary() or empty_summary(), purchases, sales)
+
+        directory = new_archive_directory(cutoff)
+        partial = directory + '.partial'
+        ledgers = []
+        bought_rows = sold_rows = 0
+        if purchases:
+            bought_rows = split_ledger(bought_link, 'purchase_date', cutoff,
+                                       os.path.join(partial, 'bought.csv.gz'), bought_link + '.archiving')
+            ledgers.append(bought_link)
+        if sales:
+            sold_rows = split_ledger(sold_link, 'sell_date', cutoff,
+                                     os.path.join(partial, 'sold.csv.gz'), sold_link + '.archiving')
+            ledgers.append(sold_link)
+        with gzip.open(os.path.join(partial, 'allocations.csv.gz'), 'wt', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter='|')
+            writer.writerow(allocation_headers)
+            writer.writerows(allocations)
+
+        summary['cutoff'] = max(summary['cutoff'], cutoff)
+        summary['archives'].append({'directory': os.path.basename(directory), 'cutoff': cutoff,
+                                    'bought_rows': bought_rows, 'sold_rows': sold_rows, 'archived_on': today})
+        with atomic_write(pending_link) as jsonfile:
+            json.dump({'directory': directory, 'ledgers': ledgers, 'summary': summary}, jsonfile)
+        recover_archive()
+        archive_logs(directory)
+    return {'directory': directory, 'bought_rows': bought_rows, 'sold_rows': sold_rows}
@@ -0,0 +1,293 @@
+# benchmark.py
+# Synthetic data generator and benchmark suite for the command paths.
+#   python benchmark.py generate DIR --rows 100000      writes a realistic './files' ledger set into DIR
+#   python benchmark.py run --rows 10000 --rows 100000  times every command path on generated data and saves the results as JSON
+#   python benchmark.py compare OLD.json NEW.json       shows how the timings changed between two result files
+# Every case runs in a fresh process inside the generated directory. The first call ('cold') includes building the sidecar indexes and caches, the later calls ('warm') reuse them; 'peak_kb' is the peak Python allocation of one warm call and 'max_rss_kb' the peak resident size of the whole process. Cases that register purchases or sales run last, so they do not change the data the read paths are timed on.
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+repository_link = os.path.dirname(os.path.abspath(__file__))
+bought_fields = ['id', 'amount', 'product_name',
+                 'purchase_date', 'price', 'expiration_date', 'total_cost']
+sold_fields = ['id', 'product_name', 'amount',
+               'sell_date', 'price', 'total_earnings']
+case_names = ['get_inventory', 'calculate_total_cost', 'calculate_total_revenue', 'calculate_total_profit',
+              'calculate_total_gross_profit', 'calculate_revenue_by_date', 'calculate_cost_by_date',
+              'calculate_profit_by_date', 'calculate_revenue_between_dates', 'calculate_profit_between_dates',
+              'calculate_cogs_between_dates', 'calculate_gross_profit_between_dates', 'get_expired_products',
+              'display_inventory', 'display_sales_last_day', 'display_sales_plain', 'display_purchases_plain',
+              'display_expired', 'buy_item', 'sell_item']
+
+
+# Writes bought.csv, sold.csv, inventory.csv and the running totals into DIR/files. Sales are spread evenly over the days and only sell stock that was bought earlier, with about one purchase per four sales; product popularity follows a skewed distribution. Returns a description of the data set.
+def generate_dataset(directory, rows=10000, products=500, days=730, start_date=None, seed=1):
+    randomizer = random.Random(seed)
+    first_day = date.fromisoformat(start_date) if start_date else date.today() - timedelta(days=days)
+    names = [f'product{number:05d}' for number in range(products)]
+    weights = [1 / (rank + 1) for rank in range(products)]
+    cost_prices = {name: round(randomizer.uniform(0.2, 15), 2) for name in names}
+    purchases = max(rows // 4, 1)
+    stock = {}
+    stocked = []
+    bought_id = sold_id = 0
+    total_cost = total_revenue = 0.0
+
+    os.makedirs(os.path.join(directory, 'files'), exist_ok=True)
+    with open(os.path.join(directory, 'files', 'bought.csv'), 'w', newline='') as bought_file, \
+            open(os.path.join(directory, 'files', 'sold.csv'), 'w', newline='') as sold_file:
+        bought = csv.writer(bought_file, delimiter='|')
+        sold = csv.writer(sold_file, delimiter='|')
+        bought.writerow(bought_fields)
+        sold.writerow(sold_fields)
+
+        def buy(product_name, day):
+            nonlocal bought_id, total_cost
+            bought_id += 1
+            amount = randomizer.randint(20, 100)
+            price = cost_prices[product_name]
+            cost = round(amount * price, 2)
+            expiration = day + timedelta(days=randomizer.randint(7, 60))
+            bought.writerow([bought_id, amount, product_name, day.isoformat(),
+                             price, expiration.isoformat(), cost])
+            total_cost += cost
+            if not stock.get(product_name):
+                stocked.append(product_name)
+            stock[product_name] = stock.get(product_name, 0) + amount
+
+        for number in range(days):
+            day = first_day + timedelta(days=number)
+            for product_name in randomizer.choices(names, weights, k=purchases * (number + 1) // days - purchases * number // days):
+                buy(product_name, day)
+            for _ in range(rows * (number + 1) // days - rows * number // days):
+                if not stocked:
+                    buy(randomizer.choices(names, weights)[0], day)
+                position = randomizer.randrange(len(stocked))
+                product_name = stocked[position]
+                amount = min(randomizer.randint(1, 10), stock[product_name])
+                price = round(cost_prices[product_name] * randomizer.uniform(1.1, 1.8), 2)
+                earnings = round(amount * price, 2)
+                sold_id += 1
+                sold.writerow([sold_id, product_name, amount, day.isoformat(), price, earnings])
+                total_revenue += earnings
+                stock[product_name] -= amount
+                if not stock[product_name]:
+                    stocked[position] = stocked[-1]
+                    stocked.pop()
+
+    with open(os.path.join(directory, 'files', 'inventory.csv'), 'w', newline='', encoding='utf-8') as inventory_file:
+        writer = csv.writer(inventory_file, delimiter='|')
+        writer.writerow(['Product', 'Current stock'])
+        writer.writerows(sorted(stock.items()))
+    with open(os.path.join(directory, 'files', 'total_cost.txt'), 'w') as cost_file:
+        cost_file.write(str(round(total_cost, 2)))
+    with open(os.path.join(directory, 'files', 'total_revenue.txt'), 'w') as revenue_file:
+        revenue_file.write(str(round(total_revenue, 2)))
+
+    last_day = first_day + timedelta(days=days - 1)
+    return {'rows': rows, 'purchases': bought_id, 'products': products, 'days': days,
+            'first_date': first_day.isoformat(), 'last_date': last_day.isoformat(),
+            'top_product': names[0]}
+
+
+# Returns the benchmark cases as {name: function}, for a data set spanning first_date to last_date.
+def benchmark_cases(first_date, last_date, product_name):
+    import builtins
+    import inventory
+    import metrics
+    from buy import buy_item
+    from sell import sell_item
+
+    middle = (date.fromisoformat(first_date) + (date.fromisoformat(last_date) - date.fromisoformat(first_date)) / 2).isoformat()
+    month_start = (date.fromisoformat(last_date) - timedelta(days=30)).isoformat()
+
+    def answering(answers, function):
+        def run():
+            replies = iter(answers)
+            builtins.input = lambda prompt='': next(replies)
+            function()
+        return run
+
+    return {
+        'get_inventory': inventory.get_inventory,
+        'calculate_total_cost': metrics.calculate_total_cost,
+        'calculate_total_revenue': metrics.calculate_total_revenue,
+        'calculate_total_profit': metrics.calculate_total_profit,
+        'calculate_total_gross_profit': metrics.calculate_total_gross_profit,
+        'calculate_revenue_by_date': lambda: metrics.calculate_revenue_by_date(middle),
+        'calculate_cost_by_date': lambda: metrics.calculate_cost_by_date(month_start, last_date),
+        'calculate_profit_by_date': lambda: metrics.calculate_profit_by_date(middle),
+        'calculate_revenue_between_dates': lambda: metrics.calculate_revenue_between_dates(month_start, last_date),
+        'calculate_profit_between_dates': lambda: metrics.calculate_profit_between_dates(month_start, last_date),
+        'calculate_cogs_between_dates': lambda: metrics.calculate_cogs_between_dates(month_start, last_date),
+        'calculate_gross_profit_between_dates': lambda: metrics.calculate_gross_profit_between_dates(month_start, last_date),
+        'get_expired_products': lambda: inventory.get_expired_products(middle),
+        'display_inventory': inventory.display_inventory,
+        'display_sales_last_day': lambda: inventory.display_sales(first_date=last_date),
+        'display_sales_plain': lambda: inventory.display_sales(plain=True),
+        'display_purchases_plain': lambda: inventory.display_purchases(plain=True),
+        'display_expired': lambda: inventory.display_expired(middle),
+        'buy_item': answering(['benchmark-product', '5', '1.25', '30'], buy_item),
+        'sell_item': answering([product_name, '1', '9.99'], sell_item),
+    }
+
+
+# Runs one case inside the current directory (called in a child process) and prints its timings as JSON.
+def run_case(name, repeat, first_date, last_date, product_name):
+    import resource
+    import tracemalloc
+    sys.path.insert(0, repository_link)
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            function = benchmark_cases(first_date, last_date, product_name)[name]
+            timings = []
+            for _ in range(repeat + 1):
+                started = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - started)
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            sys.stdout = stdout
+    print(json.dumps({'cold': timings[0], 'warm': statistics.median(timings[1:]), 'peak_kb': peak // 1024,
+                      'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+# Times full command-line invocations, which includes interpreter startup and imports.
+def time_startup(directory, arguments, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(repository_link, 'main.py')] + arguments, cwd=directory,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - started)
+    return {'warm': statistics.median(timings), 'cold': timings[0]}
+
+
+# Returns the commit the benchmark runs on, when the repository is a git checkout.
+def current_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository_link, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Generates a data set per size, runs every case on it and returns the results.
+def run_suite(sizes, products=500, days=730, repeat=3, cases=None, seed=1):
+    results = {'version': current_version(), 'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'datasets': []}
+    try:
+        import numpy
+        results['numpy'] = numpy.__version__
+    except ImportError:
+        results['numpy'] = None
+
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            dataset = generate_dataset(directory, rows, products, days, seed=seed)
+            dataset['generate_seconds'] = time.perf_counter() - started
+            print(f"{rows} rows, {dataset['purchases']} purchases, {products} products, {days} days "
+                  f"(generated in {dataset['generate_seconds']:.1f}s)")
+            timings = {'startup_today': time_startup(directory, ['today'], repeat),
+                       'startup_totalcost': time_startup(directory, ['totalcost'], repeat)}
+            for name in ('startup_today', 'startup_totalcost'):
+                print(f"  {name:38} cold {timings[name]['cold']:9.4f}s  warm {timings[name]['warm']:9.4f}s")
+            for name in cases or case_names:
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), 'case', name, '--repeat', str(repeat),
+                     '--first', dataset['first_date'], '--last', dataset['last_date'],
+                     '--product', dataset['top_product']],
+                    cwd=directory, capture_output=True, text=True)
+                if completed.returncode:
+                    timings[name] = {'error': completed.stderr.strip().splitlines()[-1]}
+                    print(f"  {name:38} failed: {timings[name]['error']}")
+                    continue
+                timings[name] = json.loads(completed.stdout)
+                print(f"  {name:38} cold {timings[name]['cold']:9.4f}s  warm {timings[name]['warm']:9.4f}s"
+                      f"  peak {timings[name]['peak_kb']:8d} KB  rss {timings[name]['max_rss_kb']:8d} KB")
+            dataset['results'] = timings
+            results['datasets'].append(dataset)
+    return results
+
+
+# Prints the warm timings of two result files side by side, matched by data set size.
+def compare_results(old_results, new_results):
+    old_sets = {dataset['rows']: dataset for dataset in old_results['datasets']}
+    print(f"{old_results.get('version')} -> {new_results.get('version')}")
+    for dataset in new_results['datasets']:
+        old = old_sets.get(dataset['rows'])
+        if old is None:
+            continue
+        print(f"{dataset['rows']} rows")
+        for name, result in dataset['results'].items():
+            before = old['results'].get(name, {})
+            if 'warm' not in result or 'warm' not in before:
+                continue
+            ratio = result['warm'] / max(before['warm'], 1e-9)
+            print(f"  {name:38} {before['warm']:9.4f}s -> {result['warm']:9.4f}s  ({ratio:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic ledgers and benchmark the superpy command paths")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="Write a synthetic ledger set into a directory")
+    generate_parser.add_argument('directory', help="Directory to create the 'files' folder in")
+    run_parser = subparsers.add_parser('run', help="Benchmark every command path on generated data")
+    for data_parser in (generate_parser, run_parser):
+        data_parser.add_argument('--products', type=int, default=500, help="Number of distinct products (default: 500)")
+        data_parser.add_argument('--days', type=int, default=730, help="Number of days the ledgers span (default: 730)")
+        data_parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1)")
+    generate_parser.add_argument('--rows', type=int, default=10000, help="Number of sales (default: 10000)")
+    generate_parser.add_argument('--start', help="First date (YYYY-MM-DD, default: --days before today)")
+    run_parser.add_argument('--rows', type=int, action='append',
+                            help="Number of sales per data set, repeat for several sizes (default: 10000)")
+    run_parser.add_argument('--repeat', type=int, default=3, help="Warm calls per case (default: 3)")
+    run_parser.add_argument('--case', action='append', choices=case_names, help="Only run these cases")
+    run_parser.add_argument('--output', default='benchmark_results.json',
+                            help="File to save the results in (default: benchmark_results.json)")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    case_parser = subparsers.add_parser('case')
+    case_parser.add_argument('name', choices=case_names)
+    case_parser.add_argument('--repeat', type=int, default=3)
+    case_parser.add_argument('--first', required=True)
+    case_parser.add_argument('--last', required=True)
+    case_parser.add_argument('--product', required=True)
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        dataset = generate_dataset(args.directory, args.rows, args.products, args.days, args.start, args.seed)
+        print(json.dumps(dataset, indent=4))
+    elif args.command == 'run':
+        results = run_suite(args.rows or [10000], args.products, args.days, args.repeat, args.case, args.seed)
+        with open(args.output, 'w') as jsonfile:
+            json.dump(results, jsonfile, indent=4)
+        print(f"Results saved to {args.output}")
+    elif args.command == 'compare':
+        with open(args.old) as old_file, open(args.new) as new_file:
+            compare_results(json.load(old_file), json.load(new_file))
+    elif args.command == 'case':
+        run_case(args.name, args.repeat, args.first, args.last, args.product)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,32 @@
 # buy.py
-import csv
 from datetime import datetime, timedelta
-import os
-from rich import print
-from inventory import get_inventory, update_inventory
-
-bought_link = './files/bought.csv'
-inventory_link = './files/inventory.csv'
-total_cost_file = './files/total_cost.txt'
-
-headers = ['id', 'amount', 'product_name',
-           'purchase_date', 'price', 'expiration_date', 'total_cost']
-
-
-# Ensures the existence of the CSV file header, creating one if it doesn't exist, ensuring proper structure for data storage.
-def create_csv_header():
-    if not os.path.exists(bought_link) or os.path.getsize(bought_link) == 0:
-        with open(bought_link, 'w', newline='') as file:
-            writer = csv.writer(file, delimiter='|')
-            writer.writerow(headers)
-
-
-# This function reads the existing CSV file, extracts the last used ID, and ensures the new ID is unique for the next item. It handles file I/O intricacies and guarantees the integrity of item IDs, making it a complex operation.-->
-def get_new_id(file_path):
-    if not os.path.exists(file_path):
-        return 1
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        if not lines:
-            return 1
-        for line in reversed(lines):
-            line = line.strip()
-            if line and not line.startswith('id|'):
-                last_id = int(line.split('|')[0])
-                return last_id + 1
-    return 1
+from date import get_date, get_today
+from output import print
+from inventory import get_inventory, read_records, update_inventory
+from lots import record_purchase_lots
+from locking import ledger_lock
+from rollup import record_purchases
+from profiling import timed
+from storage import get_storage
 
 
 # Computes the expiration date based on the current date and a specified number of days, ensuring consistency in date format for items.
 def get_expiration_date(days):
-    today = datetime.today()
+    today = get_today()
     new_date = today + timedelta(days=days)
     return new_date.strftime('%Y-%m-%d')
 
 
-#  Retrieves the total cost value from a file, handling potential file not found or invalid data errors, and returning the total cost.
+#  Retrieves the total cost value from the storage backend, returning 0.0 when none was stored yet.
 def get_total_cost():
-    try:
-        with open(total_cost_file, 'r') as cost_file:
-            total_cost = float(cost_file.readline().strip())
-    except (FileNotFoundError, ValueError):
-        total_cost = 0.0
-
-    return total_cost
+    total_cost = get_storage().get_total('cost')
+    return 0.0 if total_cost is None else total_cost
 
 
-# This function manages the updating of the total cost value in a file, ensuring accurate financial data. It handles file operations and data consistency, making it crucial for maintaining financial records and calculations within the inventory system-->
+# This function manages the updating of the total cost value in the storage backend, ensuring accurate financial data. It handles file operations and data consistency, making it crucial for maintaining financial records and calculations within the inventory system-->
 def update_total_cost(total_cost):
     try:
-        with open(total_cost_file, 'w') as cost_file:
-            cost_file.write(str(total_cost))
+        get_storage().save_total('cost', total_cost)
     except Exception as e:
         print(f"Error updating total cost: {str(e)}")
 
@@ -87,29 +54,95 @@ def buy_item():
         except ValueError:
             print('Please try again and enter the number of days, example: 5')
 
-    total_cost = round(amount * buy_price, 2)
-    current_total_cost = get_total_cost()
-    updated_total_cost = current_total_cost + total_cost
-    update_total_cost(updated_total_cost)
+    register_purchases([(product_name, amount, buy_price, expiration_days)])
     expiration = get_expiration_date(expiration_days)
-    create_csv_header()
-    id = get_new_id(bought_link)
-    today = datetime.today().strftime('%Y-%m-%d')
-    with open(bought_link, 'a', newline='') as file:
-        csv_writer = csv.writer(file, delimiter='|')
-        csv_writer.writerow(
-            [id, amount, product_name, today, buy_price, expiration, total_cost])
 
     formatted_text = f"You have purchased [bold light_green]{amount}[/bold light_green] {product_name} at a cost price of [bold light_green]${buy_price:.2f}[/bold light_green] each. They will expire on [bold light_green]{expiration}[/bold light_green]. Total Cost = [bold light_green]${amount * buy_price:.2f}[/bold light_green]"
     print(formatted_text)
 
-    inventory = get_inventory()
-    if product_name in inventory:
-        inventory[product_name] += amount
-    else:
-        inventory[product_name] = amount
 
-    update_inventory(inventory)
+# Writes a batch of validated purchases (product name, amount, price, expiration days) to the bought ledger in a single buffered append, then applies the running total cost and the stored inventory, reread under the ledger lock so changes by other processes are kept, once for the whole batch.
+@timed('register purchases')
+def register_purchases(purchases):
+    if not purchases:
+        return []
+
+    with ledger_lock():
+        inventory = get_inventory()
+        storage = get_storage()
+        id = storage.next_bought_id()
+        today = get_date()
+        rows = []
+        batch_cost = 0.0
+        for product_name, amount, buy_price, expiration_days in purchases:
+            total_cost = round(amount * buy_price, 2)
+            expiration = get_expiration_date(expiration_days)
+            rows.append([id, amount, product_name, today,
+                        buy_price, expiration, total_cost])
+            batch_cost += total_cost
+            inventory[product_name] = inventory.get(product_name, 0) + amount
+            id += 1
+
+        storage.append_bought(rows)
+        record_purchases(rows)
+        record_purchase_lots(rows)
+
+        update_total_cost(round(get_total_cost() + batch_cost, 2))
+        update_inventory(inventory)
+        return rows
+
+
+# Validates a single bulk record and returns it as a purchase tuple, or an error message when a field is missing or malformed.
+def parse_purchase_record(record):
+    if not isinstance(record, dict):
+        return None, 'not a valid record'
+    product_name = str(record.get('product_name') or record.get('product') or '').strip()
+    if not product_name:
+        return None, 'missing product_name'
+    try:
+        amount = int(record.get('amount'))
+        if amount <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, f"invalid amount {record.get('amount')!r}"
+    try:
+        buy_price = float(record.get('price'))
+        if buy_price < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, f"invalid price {record.get('price')!r}"
+    try:
+        if record.get('expiration_date'):
+            expiration = datetime.strptime(
+                str(record['expiration_date']), '%Y-%m-%d')
+            expiration_days = (expiration.date() - get_today()).days
+        else:
+            expiration_days = int(record.get('expiration_days'))
+    except (TypeError, ValueError):
+        return None, 'invalid expiration_date/expiration_days'
+    return (product_name, amount, buy_price, expiration_days), None
+
+
+# Registers purchases in bulk from a CSV or JSON Lines file (or stdin with '-'). Invalid lines are reported and skipped, all valid lines are written in one batch.
+def buy_items_from_file(source):
+    purchases = []
+    skipped = 0
+    try:
+        for line_number, record in read_records(source):
+            purchase, error = parse_purchase_record(record)
+            if error:
+                skipped += 1
+                print(f"Skipping line {line_number}: {error}")
+            else:
+                purchases.append(purchase)
+    except OSError as e:
+        print(f"Error reading {source}: {str(e)}")
+        return
+
+    rows = register_purchases(purchases)
+    batch_cost = sum(row[6] for row in rows)
+    print(
+        f"Registered [bold light_green]{len(rows)}[/bold light_green] purchases, skipped {skipped}. Total Cost = [bold light_green]${batch_cost:.2f}[/bold light_green]")
 
 
 if __name__ == '__main__':
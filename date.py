@@ -1,23 +1,68 @@
 # date.py
+# The application's "today". It follows the wall clock until 'advancedate' or 'setdate' moves it; the chosen date is then persisted in './files/today.txt' and used by every command (purchases, sales, expiry reports) until 'resetdate' removes it.
 import datetime
+import os
+from locking import atomic_write
+
+today_link = './files/today.txt'
+
+
+# Returns the persisted virtual date, or None when the wall clock is used.
+def get_virtual_date():
+    try:
+        with open(today_link, 'r') as today_file:
+            return datetime.date.fromisoformat(today_file.readline().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# Returns today's date as a datetime.date, honoring the virtual date.
+def get_today():
+    return get_virtual_date() or datetime.datetime.now().date()
 
 
 def get_date():
-    current_date = datetime.datetime.now().date()
+    current_date = get_today()
     return current_date.strftime('%Y-%m-%d')
 
 
 def print_date():
     current_date = get_date()
-    print(f'The current system date is: {current_date}')
+    label = ' (virtual)' if get_virtual_date() else ''
+    print(f'The current system date is: {current_date}{label}')
+
 
+# Persists a new virtual date.
+def set_date(new_date):
+    with atomic_write(today_link) as today_file:
+        today_file.write(new_date.isoformat())
 
-# This function allows users to advance the current date by the specified number of days. It validates the input to ensure it's a valid number, calculates the new date, and provides clear error messages, ensuring accurate date manipulations in the application.-->
+
+# This function allows users to advance the current date by the specified number of days. It validates the input to ensure it's a valid number, calculates the new date from the current (possibly virtual) date and persists it, and provides clear error messages, ensuring accurate date manipulations in the application.-->
 def advance_date(days):
     try:
         days = int(days)
-        today = datetime.datetime.now().date()
+        today = get_today()
         new_date = today + datetime.timedelta(days=days)
+        set_date(new_date)
         print(f'The new date is now {new_date}.')
     except ValueError:
         print('Error: Please try again and enter a valid number.')
+
+
+# Sets the virtual date to a given YYYY-MM-DD date.
+def change_date(text):
+    try:
+        new_date = datetime.date.fromisoformat(text)
+    except ValueError:
+        print('Error: Please try again and enter a valid date, example: 2024-01-31')
+        return
+    set_date(new_date)
+    print(f'The new date is now {new_date}.')
+
+
+# Goes back to the wall clock.
+def reset_date():
+    if os.path.exists(today_link):
+        os.remove(today_link)
+    print(f'The date follows the system clock again: {get_date()}.')
@@ -0,0 +1,88 @@
+# dateindex.py
+# Sidecar date index for the append-only CSV ledgers. For every distinct date it keeps the byte offset of its first row and the cumulative total (in cents) up to and including that date, so a range total is two binary searches and a subtraction. The index keeps a checkpoint (see ledgertail.py) and only parses the bytes appended since it was last saved.
+import json
+import os
+from bisect import bisect_left, bisect_right
+from ledgertail import empty_checkpoint, is_extension, read_appended
+from locking import atomic_write
+from profiling import timed
+
+
+# Returns the file path of the sidecar index for a ledger.
+def index_link(ledger_link):
+    return ledger_link + '.idx'
+
+
+# Returns an empty index for a ledger with the given header line.
+def empty_index(header, inode=0):
+    return {'checkpoint': empty_checkpoint(header, inode), 'sorted': True, 'dates': [], 'offsets': [], 'sums': []}
+
+
+# Loads the sidecar index, returning None when it is missing or unreadable.
+def load_index(ledger_link):
+    try:
+        with open(index_link(ledger_link), 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Writes the sidecar index.
+def save_index(ledger_link, index):
+    with atomic_write(index_link(ledger_link)) as jsonfile:
+        json.dump(index, jsonfile)
+
+
+# Adds the complete lines appended to the ledger since the index checkpoint. Rows are expected in date order; a row dated before the last indexed date marks the index as unsorted so callers fall back to a scan.
+def extend_index(ledger, index, date_column, total_column):
+    dates, offsets, sums = index['dates'], index['offsets'], index['sums']
+    positions = None
+    for offset, fieldnames, row in read_appended(ledger, index['checkpoint']):
+        if positions is None:
+            positions = fieldnames.index(date_column), fieldnames.index(total_column)
+        row_date = row[positions[0]]
+        cents = round(float(row[positions[1]]) * 100)
+        if dates and row_date == dates[-1]:
+            sums[-1] += cents
+        elif not dates or row_date > dates[-1]:
+            dates.append(row_date)
+            offsets.append(offset)
+            sums.append((sums[-1] if sums else 0) + cents)
+        else:
+            index['sorted'] = False
+
+
+# Returns the up-to-date date index for a ledger, catching up on appended rows and rebuilding it when the ledger was replaced, rewritten or truncated.
+@timed('date index')
+def get_date_index(ledger_link, date_column, total_column):
+    if not os.path.isfile(ledger_link):
+        return empty_index('')
+    with open(ledger_link, 'rb') as ledger:
+        header = ledger.readline().decode('utf-8-sig').strip()
+        size = os.fstat(ledger.fileno()).st_size
+        index = load_index(ledger_link)
+        if index is None or not is_extension(index.get('checkpoint'), ledger, header):
+            index = empty_index(header, os.fstat(ledger.fileno()).st_ino)
+        elif index['checkpoint']['size'] == size:
+            return index
+        extend_index(ledger, index, date_column, total_column)
+    save_index(ledger_link, index)
+    return index
+
+
+# Sums the indexed totals of all rows dated between start_date and end_date (inclusive), in cents.
+def range_sum(index, start_date, end_date):
+    dates, sums = index['dates'], index['sums']
+    first = bisect_left(dates, start_date)
+    last = bisect_right(dates, end_date)
+    if last <= first:
+        return 0
+    return sums[last - 1] - (sums[first - 1] if first else 0)
+
+
+# Returns the byte offset of the first row dated on or after start_date, or None when there is no such row.
+def range_offset(index, start_date):
+    first = bisect_left(index['dates'], start_date)
+    if first == len(index['dates']):
+        return None
+    return index['offsets'][first]
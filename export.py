@@ -0,0 +1,134 @@
+# export.py
+# Streaming export of the ledgers, the inventory, the open purchase lots and the daily metrics to JSON Lines, CSV or a compact columnar format. Rows are written as they are read (the columnar format buffers one block of rows at a time), so memory stays bounded whatever the size of the ledgers. Output goes to a file or to stdout and can be gzip-compressed.
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from storage import bought_headers, get_storage, sold_headers
+
+export_formats = ('jsonl', 'csv', 'columnar')
+datasets = ('bought', 'sold', 'inventory', 'lots', 'daily')
+block_rows = 10000
+
+inventory_fields = ['product_name', 'stock']
+lot_fields = ['bought_id', 'product_name', 'expiration_date', 'remaining', 'price']
+daily_fields = ['date', 'cost', 'revenue', 'profit', 'units_bought', 'units_sold']
+
+
+# Yields the inventory as rows.
+def inventory_rows(product_name=None):
+    for product, stock in get_storage().get_inventory().items():
+        if product_name is None or product == product_name:
+            yield {'product_name': product, 'stock': stock}
+
+
+# Yields the open purchase lots as rows.
+def lot_rows(product_name=None, first_date=None, last_date=None):
+    from lots import get_open_lots
+    for lot in get_open_lots():
+        if product_name is not None and lot['product_name'] != product_name:
+            continue
+        if (first_date and lot['expiration_date'] < first_date) or (last_date and lot['expiration_date'] > last_date):
+            continue
+        yield {name: lot[name] for name in lot_fields}
+
+
+# Yields the cost, revenue, profit and units per day from the daily rollup, or for one product when product_name is given.
+def daily_rows(product_name=None, first_date=None, last_date=None):
+    from rollup import days_between, get_rollup
+    for day, totals in days_between(get_rollup(), first_date or '', last_date or '9999-12-31'):
+        if product_name is None:
+            cost, revenue, units_bought, units_sold = (totals['cost'], totals['revenue'],
+                                                       totals['units_bought'], totals['units_sold'])
+        elif product_name in totals['products']:
+            cost, revenue, units_bought, units_sold = totals['products'][product_name]
+        else:
+            continue
+        yield {'date': day, 'cost': cost, 'revenue': revenue, 'profit': round(revenue - cost, 2),
+               'units_bought': units_bought, 'units_sold': units_sold}
+
+
+# Returns the field names and a row iterator of a dataset. Ledger dates filter on the purchase or sell date, lot dates on the expiration date.
+def dataset_rows(dataset, product_name=None, first_date=None, last_date=None):
+    storage = get_storage()
+    if dataset == 'bought':
+        return bought_headers, storage.iter_bought_items(product_name, first_date, last_date)
+    if dataset == 'sold':
+        return sold_headers, storage.iter_sold_items(product_name, first_date, last_date)
+    if dataset == 'inventory':
+        return inventory_fields, inventory_rows(product_name)
+    if dataset == 'lots':
+        return lot_fields, lot_rows(product_name, first_date, last_date)
+    if dataset == 'daily':
+        return daily_fields, daily_rows(product_name, first_date, last_date)
+    raise ValueError(f"Unknown dataset {dataset!r}, choose one of: {', '.join(datasets)}")
+
+
+# Opens the export target as a text stream: stdout for None or '-', otherwise a file. Compresses with gzip when asked or when the file name ends in '.gz'.
+@contextmanager
+def open_output(file_path, compress=False):
+    to_stdout = file_path in (None, '-')
+    if not to_stdout and file_path.endswith('.gz'):
+        compress = True
+    if to_stdout and not compress:
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    if to_stdout:
+        binary = gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb', compresslevel=6)
+    else:
+        binary = gzip.open(file_path, 'wb', compresslevel=6) if compress else open(file_path, 'wb')
+    with io.TextIOWrapper(binary, encoding='utf-8', newline='') as text:
+        yield text
+
+
+# Writes rows as one JSON object per line.
+def write_jsonl(output, fields, rows):
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row) + '\n')
+        count += 1
+    return count
+
+
+# Writes rows as pipe-delimited CSV with a header line, like the ledgers.
+def write_csv(output, fields, rows):
+    writer = csv.DictWriter(output, fieldnames=fields, delimiter='|', lineterminator='\n')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+# Writes rows in blocks: a first line {"columns": [...]} and then one line {"rows": n, "data": [[values of column 1], ...]} per block of up to block_rows rows, so repeated keys are written once per block instead of once per row.
+def write_columnar(output, fields, rows):
+    output.write(json.dumps({'columns': fields}) + '\n')
+    count = 0
+    block = [[] for _ in fields]
+    for row in rows:
+        for column, name in zip(block, fields):
+            column.append(row[name])
+        count += 1
+        if len(block[0]) == block_rows:
+            output.write(json.dumps({'rows': block_rows, 'data': block}, separators=(',', ':')) + '\n')
+            block = [[] for _ in fields]
+    if block[0]:
+        output.write(json.dumps({'rows': len(block[0]), 'data': block}, separators=(',', ':')) + '\n')
+    return count
+
+
+writers = {'jsonl': write_jsonl, 'csv': write_csv, 'columnar': write_columnar}
+
+
+# Exports a dataset in the given format to a file (or stdout) and returns the number of rows written.
+def export(dataset, export_format='jsonl', file_path=None, compress=False, product_name=None, first_date=None, last_date=None):
+    if export_format not in writers:
+        raise ValueError(
+            f"Unknown export format {export_format!r}, choose one of: {', '.join(export_formats)}")
+    fields, rows = dataset_rows(dataset, product_name, first_date, last_date)
+    with open_output(file_path, compress) as output:
+        return writers[export_format](output, fields, rows)
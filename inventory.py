@@ -1,20 +1,19 @@
 # inventory.py
 import csv
 import os
+import sys
 from date import get_date
-from rich.console import Console
-from rich.table import Table
+from datetime import date
+from storage import bought_headers, get_storage, sold_headers
+from lots import allocations_link, get_expired_lots, get_expiring_lots, refresh_lots
+from output import get_console
+from profiling import phase
 import json
+from itertools import chain
 
-purchases_link = './files/purchases.csv'
 bought_link = './files/bought.csv'
 sold_link = './files/sold.csv'
 inventory_link = './files/inventory.csv'
-json_inventory = './files/inventory.json'
-json_sales = './files/sales.json'
-json_purchases = './files/purchases.json'
-
-console = Console()
 
 
 # Loads or creates a JSON file with given default value.
@@ -41,90 +40,89 @@ def file_exists(file_path):
     return os.path.isfile(file_path)
 
 
+# Streams records from a CSV or JSON Lines file (or stdin when the source is '-'), yielding (line number, record) pairs. The format is detected from the first non-empty line, and CSV files may use either '|' or ',' as delimiter.
+def read_records(source):
+    handle = sys.stdin if source == '-' else open(
+        source, 'r', encoding='utf-8-sig', newline='')
+    try:
+        first_line = ''
+        line_number = 0
+        for first_line in handle:
+            line_number += 1
+            if first_line.strip():
+                break
+        if not first_line.strip():
+            return
+
+        if first_line.lstrip().startswith('{'):
+            for number, line in enumerate(chain([first_line], handle), start=line_number):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield number, None
+        else:
+            delimiter = '|' if '|' in first_line else ','
+            header = next(csv.reader([first_line], delimiter=delimiter))
+            reader = csv.DictReader(handle, fieldnames=[
+                                    name.strip() for name in header], delimiter=delimiter)
+            for row in reader:
+                if any(value for value in row.values() if value):
+                    yield line_number + reader.line_num, row
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
 # This function searches for a specific item in the list of bought items, necessitating knowledge of dictionary manipulation and iteration. It enables the identification of unique items based on their name and quantity, providing a key reference for other parts of the system.-->
 def get_bought_id(product_name, amount):
-    bought_items = get_bought_items()
-    for item in bought_items:
-        if item['product_name'] == product_name and int(item['amount']) == amount:
-            return item['id']
-    return None
+    return get_storage().find_bought_id(product_name, amount)
 
 
 # This function retrieves a list of bought items from a CSV file, requiring an understanding of file I/O operations and CSV parsing. It organizes the data into a list of dictionaries, providing a foundation for other functions that depend on this initial data retrieval.--->
 def get_bought_items():
     bought_items = []
     try:
-        if file_exists(bought_link):
-            with open(bought_link, 'r', encoding='utf-8-sig') as bought_object:
-                reader = csv.DictReader(bought_object, delimiter='|')
-                for row in reader:
-                    bought_items.append(row)
-        else:
-            print(f"File not found: {bought_link}")
+        bought_items = get_storage().get_bought_items()
     except Exception as e:
         print(f"Error reading {bought_link}: {str(e)}")
     return bought_items
 
 
-# Retrieves a list of sold item IDs from the 'sold.csv' file.
+# Retrieves the set of bought IDs that sales have drawn stock from, using the lot allocations in 'allocations.csv'.
 def get_sold_ids():
-    sold_ids = []
+    sold_ids = set()
     try:
-        if file_exists(sold_link):
-            with open(sold_link, 'r', encoding='utf-8-sig') as sold_object:
-                reader = csv.DictReader(sold_object)
-                for row in reader:
-                    sold_ids.append(row['bought_id'])
-        else:
-            print(f"File not found: {sold_link}")
+        refresh_lots()
+        with open(allocations_link, 'r', encoding='utf-8-sig') as allocations_object:
+            reader = csv.DictReader(allocations_object, delimiter='|')
+            for row in reader:
+                sold_ids.add(row['bought_id'])
     except Exception as e:
-        print(f"Error reading {sold_link}: {str(e)}")
+        print(f"Error reading {allocations_link}: {str(e)}")
     return sold_ids
 
 
 # Retrieves a list of sold items from the 'sold.csv' file.
 def get_sold_items():
-    sold_items = []
-    with open(sold_link, 'r', encoding='utf-8-sig') as sold_object:
-        reader = csv.DictReader(sold_object, delimiter='|')
-        for row in reader:
-            sold_items.append(row)
-    return sold_items
-
-
-# This function identifies products that have expired based on their expiration date and whether they have been sold, showcasing conditional logic and date comparison. It plays a crucial role in managing inventory by ensuring expired items are properly tracked and managed.-->
-def get_expired_products():
-    bought_items = get_bought_items()
-    sold_ids = get_sold_ids()
-    expired_products = []
-    today = get_date()
-    for item in bought_items:
-        if item['id'] not in sold_ids and item['expiration_date'] < today:
-            expired_products.append(item)
-    return expired_products
+    return get_storage().get_sold_items()
+
+
+# This function identifies the purchase lots that have expired (before today, or before the given date) with stock left, read from the expiry index so it only touches the expired lots. It plays a crucial role in managing inventory by ensuring expired items are properly tracked and managed.-->
+def get_expired_products(as_of=None):
+    return get_expired_lots(as_of or get_date())
 
 
 # Retrieves a list of sold items between specified dates from the 'sold.csv' file.
 def get_sold_between_dates(first_date, second_date):
-    sold_items = get_sold_items()
-    items = []
-    for item in sold_items:
-        if item['sell_date'] >= first_date and item['sell_date'] <= second_date:
-            items.append(item)
-    return items
+    return get_storage().get_sold_between_dates(first_date, second_date)
 
 
-# Retrieves the current inventory from the 'inventory.csv' file.
+# Retrieves the current inventory from the selected storage backend.
 def get_inventory():
-    inventory = {}
-    if os.path.exists(inventory_link):
-        with open(inventory_link, 'r', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter='|')
-            for row in reader:
-                product = row['Product']
-                stock = int(row['Current stock'])
-                inventory[product] = stock
-    return inventory
+    return get_storage().get_inventory()
 
 
 # This function updates the inventory by decreasing the stock of a specific product, involving dictionary manipulation and conditional statements. It ensures accurate tracking of product quantities after sales, requiring an understanding of data structures and control flow.-->
@@ -132,60 +130,86 @@ def decrease_inventory(product_name, sold_amount):
     inventory = get_inventory()
 
     if product_name not in inventory:
-        console.print(f"Error: {product_name} not found in inventory.")
+        get_console().print(f"Error: {product_name} not found in inventory.")
         return
 
     current_stock = inventory[product_name]
 
     if current_stock >= sold_amount:
         inventory[product_name] -= sold_amount
-        console.print(f"Inventory updated: {product_name} -{sold_amount}")
+        get_console().print(f"Inventory updated: {product_name} -{sold_amount}")
         update_inventory(inventory)
     else:
-        console.print(
+        get_console().print(
             f"Error: Not enough stock for {product_name} to sell {sold_amount}")
 
     return inventory
 
 
-# This function displays the current inventory in a well-organized table format, enhancing user experience through structured data presentation.
-def display_inventory():
-    inventory = {}
-    if os.path.exists(inventory_link):
-        with open(inventory_link, 'r', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter='|')
-            for row in reader:
-                product = row['Product']
-                stock = int(row['Current stock'])
-                inventory[product] = stock
+# This function displays the current inventory in a well-organized table format, enhancing user experience through structured data presentation. With as_of it shows the stock at the end of that date instead, rebuilt from the inventory snapshots and the ledger rows since.
+def display_inventory(as_of=None):
+    title = None
+    if as_of:
+        if not valid_date_range(as_of, None):
+            return
+        from snapshots import get_inventory_as_of
+        inventory = get_inventory_as_of(as_of)
+        title = f"Inventory at the end of {as_of}"
+    else:
+        inventory = get_inventory()
 
-    table = Table(show_header=True, header_style="bold magenta")
+    from rich.table import Table
+    table = Table(title=title, show_header=True, header_style="bold magenta")
     table.add_column('Product', style='dim', width=12)
     table.add_column('Current stock')
 
     for product, stock in inventory.items():
         table.add_row(product, str(stock))
-    console.print(table)
+    with phase('render'):
+        get_console().print(table)
 
 
-# Updates the 'inventory.csv' and 'inventory.json' files with the updated inventory data.
+# Saves the updated inventory in the selected storage backend. Use 'export inventory' for a JSON copy.
 def update_inventory(inventory):
-    with open(inventory_link, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['Product', 'Current stock']
-        writer = csv.DictWriter(
-            csvfile, fieldnames=fieldnames, delimiter='|')
-        writer.writeheader()
-        for product, stock in inventory.items():
-            writer.writerow({'Product': product, 'Current stock': stock})
+    get_storage().save_inventory(inventory)
+
 
-    with open(json_inventory, 'w') as jsonfile:
-        json.dump(inventory, jsonfile)
+# Checks that the optional --from/--to dates of a listing are valid dates, printing an error when they are not.
+def valid_date_range(first_date, last_date):
+    try:
+        for value in (first_date, last_date):
+            if value is not None:
+                date.fromisoformat(value)
+    except ValueError:
+        print('Error: Please try again and enter a valid date, example: 2024-01-31')
+        return False
+    return True
 
 
-# Displays the list of sold items using a formatted table.
-def display_sales():
-    sales = get_sold_items()
+# Writes ledger rows to stdout as tab-separated lines, one row at a time as they are read, so long listings start immediately and use constant memory.
+def write_plain(items, headers):
+    try:
+        sys.stdout.write('\t'.join(headers) + '\n')
+        for item in items:
+            sys.stdout.write('\t'.join(item[name] for name in headers) + '\n')
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader (like 'head') stopped early; point stdout at devnull so the exit flush does not fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+# Displays the sold items using a formatted table, or as tab-separated lines with plain=True. The rows are streamed from the ledger and can be filtered by product and sell date (inclusive) and paged with limit and offset.
+def display_sales(limit=None, offset=0, product_name=None, first_date=None, last_date=None, plain=False):
+    if not valid_date_range(first_date, last_date):
+        return
+    sales = get_storage().iter_sold_items(
+        product_name, first_date, last_date, limit, offset)
+    if plain:
+        with phase('render'):
+            write_plain(sales, sold_headers)
+        return
 
+    from rich.table import Table
     table = Table(show_header=True, header_style="bold magenta")
     table.add_column('ID', style='dim', width=4)
     table.add_column('Product', style='dim', width=12)
@@ -205,15 +229,22 @@ def display_sales():
         table.add_row(id_value, product_name, amount,
                       sell_date, price, total_earnings)
 
-    console.print(table)
+    with phase('render'):
+        get_console().print(table)
 
-    with open(json_sales, 'w') as jsonfile:
-        json.dump(sales, jsonfile, indent=4)
 
+# Displays the purchased items using a formatted table, or as tab-separated lines with plain=True. The rows are streamed from the ledger and can be filtered by product and purchase date (inclusive) and paged with limit and offset.
+def display_purchases(limit=None, offset=0, product_name=None, first_date=None, last_date=None, plain=False):
+    if not valid_date_range(first_date, last_date):
+        return
+    bought_items = get_storage().iter_bought_items(
+        product_name, first_date, last_date, limit, offset)
+    if plain:
+        with phase('render'):
+            write_plain(bought_items, bought_headers)
+        return
 
-# Displays the list of purchased items using a formatted table and updates 'purchases.csv' and 'purchases.json' files.
-def display_purchases():
-    bought_items = get_bought_items()
+    from rich.table import Table
     table = Table(show_header=True, header_style="bold magenta")
     table.add_column('ID', style='dim', width=4)
     table.add_column('Amount', style='dim', width=8)
@@ -235,25 +266,115 @@ def display_purchases():
         table.add_row(id_value, amount, product_name,
                       purchase_date, price, expiration_date, total_cost)
 
-    with open(purchases_link, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['ID', 'Amount', 'Product', 'Date of purchase',
-                      'Price', 'Expiration date', 'Total Cost']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter='|')
+    with phase('render'):
+        get_console().print(table)
+
+
+# Returns what happened to one product: its purchases and sales as dicts of strings, read through the product index, its stock, and its units, cost, revenue and cost of goods sold in cents over all rows, archived ones included.
+def get_product_history(product_name):
+    storage = get_storage()
+    refresh_lots()
+    from productindex import iter_product_rows
+    history = {'purchases': list(storage.iter_bought_items(product_name)),
+               'sales': list(storage.iter_sold_items(product_name)),
+               'stock': storage.get_inventory().get(product_name, 0)}
+    history['units_bought'] = sum(int(item['amount']) for item in history['purchases'])
+    history['units_sold'] = sum(int(item['amount']) for item in history['sales'])
+    history['cost'] = sum(round(float(item['total_cost']) * 100) for item in history['purchases'])
+    history['revenue'] = sum(round(float(item['total_earnings']) * 100) for item in history['sales'])
+    history['cogs'] = sum(round(float(row['cost']) * 100) for row in iter_product_rows(allocations_link, product_name))
+
+    summary = storage.get_archive_summary()
+    if summary:
+        for day in summary['days'].values():
+            totals = day['products'].get(product_name)
+            if totals:
+                history['cost'] += round(totals[0] * 100)
+                history['revenue'] += round(totals[1] * 100)
+                history['units_bought'] += totals[2]
+                history['units_sold'] += totals[3]
+        history['cogs'] += summary.get('product_cogs', {}).get(product_name, 0)
+    return history
+
+
+# Displays the purchases and sales of one product (the most recent limit of each when given), its stock and its margin: revenue minus the cost of the goods sold.
+def display_product(product_name, limit=None):
+    history = get_product_history(product_name)
+    if not history['purchases'] and not history['sales'] and not history['units_bought']:
+        get_console().print(f"Error: {product_name} was never bought or sold.")
+        return
+
+    from rich.table import Table
+    purchases = Table(title=f"Purchases of {product_name}", show_header=True, header_style="bold magenta")
+    for column in ('ID', 'Date of purchase', 'Amount', 'Price', 'Expiration date', 'Total Cost'):
+        purchases.add_column(column)
+    for item in history['purchases'][-limit if limit else 0:]:
+        purchases.add_row(item['id'], item['purchase_date'], item['amount'], item['price'],
+                          item['expiration_date'], item['total_cost'])
+
+    sales = Table(title=f"Sales of {product_name}", show_header=True, header_style="bold magenta")
+    for column in ('ID', 'Date of sale', 'Amount', 'Price', 'Total Earnings'):
+        sales.add_column(column)
+    for item in history['sales'][-limit if limit else 0:]:
+        sales.add_row(item['id'], item['sell_date'], item['amount'], item['price'], item['total_earnings'])
+
+    margin = history['revenue'] - history['cogs']
+    totals = Table(show_header=True, header_style="bold magenta")
+    totals.add_column('Stock')
+    totals.add_column('Bought')
+    totals.add_column('Cost')
+    totals.add_column('Sold')
+    totals.add_column('Revenue')
+    totals.add_column('Cost of goods sold')
+    totals.add_column('Margin')
+    totals.add_row(str(history['stock']), str(history['units_bought']), f"${history['cost'] / 100:.2f}",
+                   str(history['units_sold']), f"${history['revenue'] / 100:.2f}", f"${history['cogs'] / 100:.2f}",
+                   f"${margin / 100:.2f}" + (f" ({margin / history['revenue']:.1%})" if history['revenue'] else ''))
+
+    with phase('render'):
+        console = get_console()
+        console.print(purchases)
+        console.print(sales)
+        console.print(totals)
+
+
+# Displays the purchase lots with stock left that expired before the given date (default: today).
+def display_expired(as_of=None):
+    as_of = as_of or get_date()
+    try:
+        date.fromisoformat(as_of)
+    except ValueError:
+        print('Error: Please try again and enter a valid date, example: 2024-01-31')
+        return
+    display_lots(get_expired_products(as_of),
+                 f"Expired before {as_of}")
 
-        writer.writeheader()
 
-        for item in bought_items:
-            writer.writerow({
-                'ID': item['id'],
-                'Amount': item['amount'],
-                'Product': item['product_name'],
-                'Date of purchase': item['purchase_date'],
-                'Price': item['price'],
-                'Expiration date': item['expiration_date'],
-                'Total Cost': item['total_cost']
-            })
+# Displays the purchase lots with stock left that expire within the given number of days from today (or from first_date).
+def display_expiring(days, first_date=None):
+    first_date = first_date or get_date()
+    try:
+        lots = get_expiring_lots(first_date, days)
+    except ValueError:
+        print('Error: Please try again and enter a valid date, example: 2024-01-31')
+        return
+    except OverflowError:
+        print(f"Error: {days} days from {first_date} is past the last date that can be used, 9999-12-31.")
+        return
+    display_lots(lots, f"Expiring within {days} days of {first_date}")
 
-    with open(json_purchases, 'w') as jsonfile:
-        json.dump(bought_items, jsonfile, indent=4)
 
-    console.print(table)
+# Displays a list of purchase lots using a formatted table.
+def display_lots(lots, title):
+    from rich.table import Table
+    table = Table(title=title, show_header=True, header_style="bold magenta")
+    table.add_column('Bought ID', style='dim', width=9)
+    table.add_column('Product', style='dim', width=12)
+    table.add_column('Expiration date', style='dim', width=15)
+    table.add_column('Stock left')
+
+    for lot in lots:
+        table.add_row(str(lot['bought_id']), lot['product_name'],
+                      lot['expiration_date'], str(lot['remaining']))
+    with phase('render'):
+        get_console().print(table)
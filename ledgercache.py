@@ -0,0 +1,199 @@
+# ledgercache.py
+# Binary cache of a parsed CSV ledger, kept in a '<ledger>.cache' directory next to it. Every column is a memory-mappable .npy file: columns that only hold plain integers (like the IDs) are stored as int64 values, all others are dictionary-encoded with the distinct values in 'meta.json' and each row's value index in the .npy file. The cache is valid while the ledger's size, modification time and header hash match 'meta.json'. When the ledger was only appended to, just the new rows are parsed and added to the columns (see ledgertail.py), otherwise the cache is rebuilt.
+# The cache needs NumPy; without it readers parse the CSV file as before.
+import csv
+import hashlib
+import json
+import os
+import uuid
+from ledgertail import empty_checkpoint, is_extension, read_appended
+from locking import atomic_write
+from profiling import timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Returns the cache directory of a ledger.
+def cache_link(ledger_link):
+    return ledger_link + '.cache'
+
+
+# Returns what the cache of a ledger must match: its size, modification time and a hash of its header line.
+def ledger_signature(ledger_link):
+    with open(ledger_link, 'rb') as ledger:
+        header = ledger.readline()
+        status = os.fstat(ledger.fileno())
+    return {'size': status.st_size, 'mtime': status.st_mtime_ns, 'header': hashlib.sha1(header).hexdigest()}
+
+
+# Loads the cache metadata, returning None when it is missing or unreadable.
+def load_meta(ledger_link):
+    try:
+        with open(os.path.join(cache_link(ledger_link), 'meta.json'), 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Checks whether every value of a column is a plain integer that converts back to the same text.
+def is_integer_column(values):
+    try:
+        return all(str(int(value)) == value for value in values)
+    except ValueError:
+        return False
+
+
+# Opens the column files of a cache build as memory-mapped arrays.
+def open_columns(ledger_link, meta):
+    directory = cache_link(ledger_link)
+    return {name: np.load(os.path.join(directory, f"{meta['build']}-{name}.npy"), mmap_mode='r')
+            for name in meta['header']}
+
+
+# Writes a cache build: the column files first under a new build id, then 'meta.json', so readers only ever see a complete build. Files of older builds are removed afterwards. Without arrays only 'meta.json' of the current build is rewritten.
+def save_cache(ledger_link, meta, arrays=None):
+    directory = cache_link(ledger_link)
+    os.makedirs(directory, exist_ok=True)
+    if arrays is not None:
+        meta['build'] = uuid.uuid4().hex
+        for name, data in zip(meta['header'], arrays):
+            np.save(os.path.join(directory, f"{meta['build']}-{name}.npy"), data)
+    with atomic_write(os.path.join(directory, 'meta.json')) as jsonfile:
+        json.dump(meta, jsonfile)
+
+    for name in os.listdir(directory):
+        if name.endswith('.npy') and not name.startswith(meta['build']):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return meta
+
+
+# Parses the rows of a ledger after the checkpoint into per-column value codes, extending the lookups of distinct values.
+def encode_appended(ledger, checkpoint, lookups):
+    codes = None
+    for _, fieldnames, row in read_appended(ledger, checkpoint):
+        if codes is None:
+            codes = [[] for _ in fieldnames]
+            lookups.extend({} for _ in fieldnames[len(lookups):])
+        for position, value in enumerate(row[:len(fieldnames)]):
+            code = lookups[position].get(value)
+            if code is None:
+                code = lookups[position][value] = len(lookups[position])
+            codes[position].append(code)
+    return codes
+
+
+# Parses the whole ledger and writes a new cache build.
+@timed('cache build')
+def build_cache(ledger_link, signature):
+    with open(ledger_link, 'rb') as ledger:
+        header = ledger.readline().decode('utf-8-sig').strip()
+        checkpoint = empty_checkpoint(header, os.fstat(ledger.fileno()).st_ino)
+        lookups = []
+        codes = encode_appended(ledger, checkpoint, lookups) or []
+    names = next(csv.reader([header], delimiter='|'), [])
+
+    arrays, values = [], []
+    for position, name in enumerate(names):
+        column = codes[position] if position < len(codes) else []
+        distinct = list(lookups[position]) if position < len(lookups) else []
+        if is_integer_column(distinct):
+            numbers = np.array([int(value) for value in distinct], dtype=np.int64)
+            data = numbers[np.array(column, dtype=np.int32)] if column else numbers
+            distinct = None
+        else:
+            data = np.array(column, dtype=np.int32)
+        arrays.append(data)
+        values.append(distinct)
+    meta = {'signature': signature, 'rows': checkpoint['rows'], 'header': names,
+            'values': values, 'checkpoint': checkpoint}
+    return save_cache(ledger_link, meta, arrays)
+
+
+# Brings a cache build up to date with the rows appended to the ledger since it was written, parsing only those rows. Returns None when the ledger was rewritten or a new value does not fit an integer column, so the caller rebuilds the cache instead.
+@timed('cache extend')
+def extend_cache(ledger_link, meta, signature):
+    with open(ledger_link, 'rb') as ledger:
+        header = ledger.readline().decode('utf-8-sig').strip()
+        checkpoint = meta.get('checkpoint')
+        if not is_extension(checkpoint, ledger, header):
+            return None
+        lookups = [{value: code for code, value in enumerate(values or [])} for values in meta['values']]
+        codes = encode_appended(ledger, checkpoint, lookups)
+    meta.update(signature=signature, rows=checkpoint['rows'], checkpoint=checkpoint)
+    if codes is None:
+        return save_cache(ledger_link, meta)
+
+    arrays = []
+    for position, column in enumerate(open_columns(ledger_link, meta).values()):
+        distinct = list(lookups[position])
+        if meta['values'][position] is None:
+            if not is_integer_column(distinct):
+                return None
+            numbers = np.array([int(value) for value in distinct], dtype=np.int64)
+            data = numbers[np.array(codes[position], dtype=np.int32)]
+        else:
+            data = np.array(codes[position], dtype=np.int32)
+            meta['values'][position] = distinct
+        arrays.append(np.concatenate((column, data)))
+    return save_cache(ledger_link, meta, arrays)
+
+
+# Returns the valid cache of a ledger as (meta, {column: memory-mapped codes}), extending or rebuilding it when stale. Returns None when NumPy is missing or the ledger does not exist.
+def load_cache(ledger_link):
+    if np is None or not os.path.isfile(ledger_link):
+        return None
+    signature = ledger_signature(ledger_link)
+    meta = load_meta(ledger_link)
+    if meta is not None and meta.get('signature') != signature:
+        try:
+            meta = extend_cache(ledger_link, meta, signature)
+        except (FileNotFoundError, KeyError):
+            meta = None
+    if meta is None or meta.get('signature') != signature:
+        meta = build_cache(ledger_link, signature)
+    try:
+        return meta, open_columns(ledger_link, meta)
+    except FileNotFoundError:
+        meta = build_cache(ledger_link, signature)
+        return meta, open_columns(ledger_link, meta)
+
+
+# Returns the rows of a ledger as typed records (see records.py), taking the record fields from the named columns. Every distinct value of a column is converted once and shared by the rows that hold it. Returns None when there is no usable cache or a column is missing.
+@timed('cache decode')
+def get_cached_records(ledger_link, record_type, names):
+    cache = load_cache(ledger_link)
+    if cache is None:
+        return None
+    meta, columns = cache
+    if not set(names) <= set(meta['header']):
+        return None
+    decoded = []
+    for name, convert in zip(names, record_type.converters):
+        values = meta['values'][meta['header'].index(name)]
+        decoded.append(decode_column(columns[name], values, convert))
+    return record_type.from_columns(decoded)
+
+
+# Turns one cached column into a list of converted values.
+def decode_column(column, values, convert):
+    if values is None:
+        if convert is int:
+            return column.tolist()
+        numbers, column = np.unique(column, return_inverse=True)
+        values = [str(number) for number in numbers.tolist()]
+    return np.array([convert(value) for value in values], dtype=object)[column].tolist()
+
+
+# Returns the requested columns of a ledger from the cache as {name: (codes, distinct values)}, where integer columns come back as (values, None). Returns None when there is no usable cache.
+def get_cached_columns(ledger_link, names):
+    cache = load_cache(ledger_link)
+    if cache is None:
+        return None
+    meta, columns = cache
+    return {name: (columns[name], meta['values'][meta['header'].index(name)]) for name in names}
@@ -0,0 +1,109 @@
+# ledgertail.py
+# Incremental reading of the append-only CSV ledgers. A checkpoint, stored by the date index and the binary ledger cache, records how far a ledger was parsed (byte offset and row count) together with the ledger's inode, header and the bytes just before the offset, so the next run can tell the ledger was only appended to and parse just the new bytes. The last ID is found by reading the file backwards from the end.
+import csv
+import os
+from profiling import count
+
+block_size = 4096
+marker_size = 64
+
+
+# Returns the last non-empty line of a file as text, reading blocks backwards from the end so the cost does not depend on the file size. Returns None for an empty file.
+def read_last_line(file_path):
+    with open(file_path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+            lines = data.rstrip().split(b'\n')
+            if len(lines) > 1 or position == 0:
+                return lines[-1].strip().decode('utf-8-sig') or None
+    return None
+
+
+# Returns the ID of the last row of a ledger, or 0 when it has no rows.
+def last_id(file_path):
+    if not os.path.isfile(file_path):
+        return 0
+    line = read_last_line(file_path)
+    if not line or line.startswith('id|'):
+        return 0
+    return int(line.split('|')[0])
+
+
+# Returns the rows (lists of strings) that come after the row with the given ID, reading blocks backwards from the end of the ledger so the cost depends on the number of newer rows and not on the ledger size.
+def read_rows_after(file_path, after_id):
+    rows = []
+    if not os.path.isfile(file_path):
+        return rows
+    with open(file_path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        remainder = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            lines = (file.read(step) + remainder).split(b'\n')
+            remainder = lines.pop(0) if position else b''
+            for line in reversed(lines):
+                text = line.decode('utf-8-sig').strip()
+                if not text:
+                    continue
+                row = next(csv.reader([text], delimiter='|'))
+                if not row[0].isdigit() or int(row[0]) <= after_id:
+                    return rows[::-1]
+                rows.append(row)
+    return rows[::-1]
+
+
+# Returns the bytes just before the given offset as text, used to check that the parsed part of a ledger was not rewritten.
+def read_marker(ledger, offset):
+    start = max(0, offset - marker_size)
+    ledger.seek(start)
+    return ledger.read(offset - start).hex()
+
+
+# Returns a checkpoint at the start of a ledger with the given header line and inode.
+def empty_checkpoint(header, inode):
+    return {'header': header, 'inode': inode, 'size': 0, 'rows': 0, 'marker': ''}
+
+
+# Checks whether a ledger, opened in binary mode, is the one a checkpoint was taken of, with at most new rows appended after it.
+def is_extension(checkpoint, ledger, header):
+    status = os.fstat(ledger.fileno())
+    return (checkpoint is not None and checkpoint.get('header') == header
+            and checkpoint.get('inode') == status.st_ino and checkpoint['size'] <= status.st_size
+            and read_marker(ledger, checkpoint['size']) == checkpoint['marker'])
+
+
+# Yields (byte offset, field names, row) for every complete line of a ledger, opened in binary mode, after the checkpoint and moves the checkpoint past it. A checkpoint at offset 0 starts after the header line.
+def read_appended(ledger, checkpoint):
+    ledger.seek(0)
+    header_line = ledger.readline()
+    fieldnames = next(csv.reader([header_line.decode('utf-8-sig').strip()], delimiter='|'), [])
+    if not checkpoint['size']:
+        checkpoint['size'] = ledger.tell()
+    bounds = [checkpoint['size'], checkpoint['size']]
+
+    def complete_lines():
+        ledger.seek(bounds[1])
+        for line in ledger:
+            if not line.endswith(b'\n'):
+                break
+            bounds[0], bounds[1] = bounds[1], bounds[1] + len(line)
+            yield line.decode('utf-8')
+
+    first_offset, first_rows = checkpoint['size'], checkpoint['rows']
+    for row in csv.reader(complete_lines(), delimiter='|'):
+        if not row:
+            continue
+        checkpoint['rows'] += 1
+        checkpoint['size'] = bounds[1]
+        yield bounds[0], fieldnames, row
+    checkpoint['marker'] = read_marker(ledger, checkpoint['size'])
+    count('rows parsed', checkpoint['rows'] - first_rows)
+    count('bytes read', checkpoint['size'] - first_offset)
+
@@ -0,0 +1,129 @@
+# locking.py
+# Advisory file locking around ledger and state mutations, atomic replacement of state files, and the fsync modes for appended ledger rows:
+#   none    leave flushing to the operating system (default)
+#   always  fsync the ledger after every write, while holding the lock
+#   group   fsync after releasing the lock; a writer whose rows were already covered by another writer's fsync skips its own, so concurrent writers share one fsync
+# Select the mode with the --sync flag or the SUPERPY_SYNC environment variable.
+import json
+import os
+import threading
+from contextlib import contextmanager
+from profiling import count, phase
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+lock_link = './files/superpy.lock'
+sync_lock_link = './files/superpy.sync.lock'
+synced_link = './files/superpy.synced'
+
+sync_modes = ('none', 'always', 'group')
+selected_sync_mode = os.environ.get('SUPERPY_SYNC', 'none')
+_local = threading.local()
+
+
+# Selects the fsync mode for the rest of the process.
+def set_sync_mode(name):
+    global selected_sync_mode
+    if name not in sync_modes:
+        raise ValueError(
+            f"Unknown sync mode {name!r}, choose one of: {', '.join(sync_modes)}")
+    selected_sync_mode = name
+
+
+# Holds an exclusive advisory lock on a lock file for the duration of the block.
+@contextmanager
+def file_lock(file_path):
+    with open(file_path, 'a+') as handle:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Serializes ledger and state mutations across processes and threads. Nested use in the same thread only takes the lock once. Ledger appends noted inside the block are made durable according to the sync mode when the outermost block ends.
+@contextmanager
+def ledger_lock():
+    if getattr(_local, 'depth', 0):
+        _local.depth += 1
+        try:
+            yield
+        finally:
+            _local.depth -= 1
+        return
+
+    _local.depth = 1
+    _local.appended = {}
+    try:
+        with file_lock(lock_link):
+            yield
+            if selected_sync_mode == 'always':
+                for file_path in _local.appended:
+                    fsync_file(file_path)
+    finally:
+        _local.depth = 0
+        appended, _local.appended = _local.appended, {}
+    if selected_sync_mode == 'group' and appended:
+        group_commit(appended)
+
+
+# Records that a ledger was appended up to the given size inside the current ledger_lock block.
+def note_append(file_path, size):
+    if getattr(_local, 'depth', 0):
+        _local.appended[file_path] = size
+
+
+# Flushes a file's data to disk.
+def fsync_file(file_path):
+    with open(file_path, 'rb') as handle:
+        os.fsync(handle.fileno())
+
+
+# Makes appended ledger data durable, sharing the fsync with concurrent writers: whoever holds the sync lock fsyncs everything written so far and records how far each file is synced, later writers that are already covered skip the fsync.
+def group_commit(appended):
+    with file_lock(sync_lock_link):
+        try:
+            with open(synced_link, 'r') as jsonfile:
+                synced = json.load(jsonfile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            synced = {}
+        changed = False
+        for file_path, size in appended.items():
+            inode = os.stat(file_path).st_ino
+            synced_inode, synced_size = synced.get(file_path, (None, 0))
+            if synced_inode == inode and synced_size >= size:
+                continue
+            synced_size = os.path.getsize(file_path)
+            fsync_file(file_path)
+            synced[file_path] = (inode, synced_size)
+            changed = True
+        if changed:
+            with atomic_write(synced_link) as jsonfile:
+                json.dump(synced, jsonfile)
+
+
+# Writes a file through a temporary file that replaces the original at the end, so readers never see a half-written file.
+@contextmanager
+def atomic_write(file_path, newline=None, encoding=None):
+    temporary_link = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with phase('file write'):
+            with open(temporary_link, 'w', newline=newline, encoding=encoding) as file:
+                yield file
+            count('bytes written', os.path.getsize(temporary_link))
+            os.replace(temporary_link, file_path)
+    finally:
+        if os.path.exists(temporary_link):
+            os.remove(temporary_link)
@@ -0,0 +1,260 @@
+# lots.py
+# Lot-level stock. Every purchase is a lot, and a sale takes from the soonest-expiring lots of its product first; every lot it draws from is written to 'allocations.csv' with its cost, which gives the exact cost of goods sold per sale.
+# The lots with stock left are kept in an indexed SQLite table, './files/lots.db', with one row per lot, an index on (product, expiration date) for the sales and one on the expiration date for the expiry reports. A purchase inserts its lots and a sale updates or deletes only the lots it draws from, so registering costs a few index lookups however many lots are open. A rebuild replays the ledgers in memory, with each product's lots in a priority queue (heap) ordered by expiration date and all open lots in one list sorted by expiration date (the expiry index), the shape the archive summary keeps them in, and then writes the table at once.
+import copy
+import csv
+import heapq
+import threading
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+import os
+from dateindex import get_date_index, range_sum
+from locking import atomic_write, ledger_lock, note_append
+from profiling import timed
+from storage import get_storage
+
+lots_link = './files/lots.db'
+allocations_link = './files/allocations.csv'
+
+allocation_headers = ['sold_id', 'sell_date', 'bought_id',
+                      'product_name', 'amount', 'cost']
+
+schema = '''
+    CREATE TABLE IF NOT EXISTS lots (
+        bought_id INTEGER PRIMARY KEY,
+        product_name TEXT NOT NULL,
+        expiration_date TEXT NOT NULL,
+        remaining INTEGER NOT NULL,
+        price REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS state (
+        backend TEXT NOT NULL,
+        last_bought_id INTEGER NOT NULL,
+        last_sold_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS lots_product_expiration ON lots (product_name, expiration_date, bought_id);
+    CREATE INDEX IF NOT EXISTS lots_expiration ON lots (expiration_date, bought_id);
+'''
+_local = threading.local()
+
+
+# Returns this thread's connection to the lot table, opening it on first use. The table can always be rebuilt from the ledgers, so it uses write-ahead logging without an fsync per commit.
+def get_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        import sqlite3
+        connection = _local.connection = sqlite3.connect(lots_link)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.executescript(schema)
+    return connection
+
+
+# Returns the lot state before the first live ledger row, tied to the selected storage backend: empty, or the lots still open when the older rows were archived. Each product maps to a heap of [expiration date, bought id, remaining, unit price] lots, and 'expiry' holds [expiration date, bought id, product, remaining] for every open lot in sorted order.
+def empty_lots():
+    lots = {'backend': get_storage().name, 'last_bought_id': 0, 'last_sold_id': 0, 'products': {}, 'expiry': []}
+    summary = get_storage().get_archive_summary()
+    if summary:
+        lots.update(copy.deepcopy(summary['lots']), last_bought_id=summary['last_bought_id'],
+                    last_sold_id=summary['last_sold_id'])
+    return lots
+
+
+# Replaces the lot table with the open lots of an in-memory lot state.
+def save_lots(lots):
+    connection = get_connection()
+    with connection:
+        connection.execute('DELETE FROM lots')
+        connection.executemany('INSERT INTO lots VALUES (?, ?, ?, ?, ?)',
+                               ((lot[1], product, lot[0], lot[2], lot[3])
+                                for product, heap in lots['products'].items() for lot in heap))
+        set_state(connection, lots['last_bought_id'], lots['last_sold_id'])
+
+
+# Records the backend and the last ledger IDs the lot table covers.
+def set_state(connection, last_bought_id, last_sold_id):
+    connection.execute('DELETE FROM state')
+    connection.execute('INSERT INTO state VALUES (?, ?, ?)', (get_storage().name, last_bought_id, last_sold_id))
+
+
+# Checks whether the lot table covers exactly the ledgers of the selected backend up to the given last IDs.
+def lots_cover(connection, last_bought_id, last_sold_id):
+    return connection.execute('SELECT backend, last_bought_id, last_sold_id FROM state').fetchone() == (
+        get_storage().name, last_bought_id, last_sold_id)
+
+
+# Adds purchase rows (id, amount, product, purchase date, price, expiration date, total cost) as new lots.
+def add_lots(lots, rows):
+    for row in rows:
+        heap = lots['products'].setdefault(row[2], [])
+        heapq.heappush(heap, [row[5], int(row[0]), int(row[1]), float(row[4])])
+        insort(lots['expiry'], [row[5], int(row[0]), row[2], int(row[1])])
+        lots['last_bought_id'] = max(lots['last_bought_id'], int(row[0]))
+
+
+# Takes sale rows (id, product, amount, sell date, price, total earnings) from the soonest-expiring lots and returns the allocation rows (sold id, sell date, bought id, product, amount, cost).
+def consume_lots(lots, rows):
+    allocations = []
+    for row in rows:
+        heap = lots['products'].get(row[1], [])
+        needed = int(row[2])
+        while needed and heap:
+            lot = heap[0]
+            taken = min(needed, lot[2])
+            allocations.append([int(row[0]), row[3], lot[1], row[1],
+                               taken, round(taken * lot[3], 2)])
+            lot[2] -= taken
+            needed -= taken
+            position = bisect_left(lots['expiry'], lot[:2])
+            if not lot[2]:
+                heapq.heappop(heap)
+                del lots['expiry'][position]
+            else:
+                lots['expiry'][position][3] = lot[2]
+        if not heap:
+            lots['products'].pop(row[1], None)
+        lots['last_sold_id'] = max(lots['last_sold_id'], int(row[0]))
+    return allocations
+
+
+# Appends allocation rows to 'allocations.csv', writing the header first when the file is new.
+def append_allocations(allocations):
+    if not os.path.exists(allocations_link) or os.path.getsize(allocations_link) == 0:
+        write_allocations(allocations)
+        return
+    with open(allocations_link, 'a', newline='') as file:
+        csv.writer(file, delimiter='|').writerows(allocations)
+    note_append(allocations_link, os.path.getsize(allocations_link))
+
+
+# Replaces 'allocations.csv' with the given allocation rows.
+def write_allocations(allocations):
+    with atomic_write(allocations_link, newline='') as file:
+        writer = csv.writer(file, delimiter='|')
+        writer.writerow(allocation_headers)
+        writer.writerows(allocations)
+
+
+# Replays purchase and sale records on the lot state in date order, purchases before sales on the same date, and returns the allocation rows.
+def replay_lots(lots, purchases, sales):
+    events = [(item.purchase_day, 0, item.id, item.to_row()) for item in purchases]
+    events += [(item.sell_day, 1, item.id, item.to_row()) for item in sales]
+    events.sort(key=lambda event: event[:3])
+
+    allocations = []
+    for _, kind, _, row in events:
+        if kind == 0:
+            add_lots(lots, [row])
+        else:
+            allocations += consume_lots(lots, [row])
+    return allocations
+
+
+# Rebuilds the lots and 'allocations.csv' by replaying the ledgers.
+@timed('lots rebuild')
+def rebuild_lots():
+    storage = get_storage()
+    lots = empty_lots()
+    allocations = replay_lots(lots, storage.get_bought_items(), storage.get_sold_items())
+    write_allocations(allocations)
+    save_lots(lots)
+    return lots
+
+
+# Takes sale rows (id, product, amount, sell date, price, total earnings) from the soonest-expiring lots in the lot table, like consume_lots, and returns the allocation rows.
+def take_lots(connection, rows):
+    allocations = []
+    for row in rows:
+        needed = int(row[2])
+        while needed:
+            lot = connection.execute(
+                'SELECT bought_id, remaining, price FROM lots WHERE product_name = ? '
+                'ORDER BY expiration_date, bought_id LIMIT 1', (row[1],)).fetchone()
+            if lot is None:
+                break
+            taken = min(needed, lot[1])
+            allocations.append([int(row[0]), row[3], lot[0], row[1], taken, round(taken * lot[2], 2)])
+            needed -= taken
+            if taken == lot[1]:
+                connection.execute('DELETE FROM lots WHERE bought_id = ?', (lot[0],))
+            else:
+                connection.execute('UPDATE lots SET remaining = ? WHERE bought_id = ?', (lot[1] - taken, lot[0]))
+    return allocations
+
+
+# Adds freshly appended purchase rows as lots. A lot table that missed earlier rows is rebuilt from the ledgers instead.
+def record_purchase_lots(rows):
+    connection = get_connection()
+    last_sold_id = get_storage().next_sold_id() - 1
+    if not lots_cover(connection, int(rows[0][0]) - 1, last_sold_id):
+        rebuild_lots()
+        return
+    with connection:
+        connection.executemany('INSERT INTO lots VALUES (?, ?, ?, ?, ?)',
+                               ((int(row[0]), row[2], row[5], int(row[1]), float(row[4])) for row in rows))
+        set_state(connection, int(rows[-1][0]), last_sold_id)
+
+
+# Allocates freshly appended sale rows to lots and records the allocations. The allocations are appended before the lot changes are committed, so a crash in between leaves a lot table that no longer matches the ledgers and is rebuilt. A lot table that missed earlier rows is rebuilt from the ledgers instead.
+def record_sale_lots(rows):
+    connection = get_connection()
+    last_bought_id = get_storage().next_bought_id() - 1
+    if not lots_cover(connection, last_bought_id, int(rows[0][0]) - 1):
+        rebuild_lots()
+        return
+    with connection:
+        append_allocations(take_lots(connection, rows))
+        set_state(connection, last_bought_id, int(rows[-1][0]))
+
+
+# Makes sure the lots and allocations cover every ledger row, rebuilding them when they do not.
+def refresh_lots():
+    with ledger_lock():
+        storage = get_storage()
+        if not lots_cover(get_connection(), storage.next_bought_id() - 1, storage.next_sold_id() - 1):
+            rebuild_lots()
+
+
+# Returns the lots with stock left, as dicts sorted by product and expiration date.
+def get_open_lots():
+    refresh_lots()
+    return [{'bought_id': bought_id, 'product_name': product, 'expiration_date': expiration,
+             'remaining': remaining, 'price': price}
+            for bought_id, product, expiration, remaining, price in get_connection().execute(
+                'SELECT bought_id, product_name, expiration_date, remaining, price FROM lots '
+                'ORDER BY product_name, expiration_date, bought_id')]
+
+
+# Sums the cost of goods sold for the sales dated between start_date and end_date (inclusive), using the date index of 'allocations.csv' (or the columns of analytics.py when it is not in date order) and the archived cost per day.
+def sum_cogs(start_date, end_date):
+    refresh_lots()
+    summary = get_storage().get_archive_summary()
+    archived = 0
+    if summary:
+        archived = sum(cents for day, cents in summary['cogs'].items() if start_date <= day <= end_date) / 100
+    index = get_date_index(allocations_link, 'sell_date', 'cost')
+    if index['sorted']:
+        return archived + range_sum(index, start_date, end_date) / 100
+    from analytics import load_columns, sum_between
+    return archived + sum_between(load_columns('allocations'), start_date, end_date) / 100
+
+
+# Returns the open lots with an expiration date between first_date (inclusive) and end_date (exclusive), as dicts, from the expiration date index of the lot table.
+def get_lots_expiring_between(first_date, end_date):
+    refresh_lots()
+    return [{'bought_id': bought_id, 'product_name': product, 'expiration_date': expiration, 'remaining': remaining}
+            for bought_id, product, expiration, remaining in get_connection().execute(
+                'SELECT bought_id, product_name, expiration_date, remaining FROM lots '
+                'WHERE expiration_date >= ? AND expiration_date < ? ORDER BY expiration_date, bought_id',
+                (first_date, end_date))]
+
+
+# Returns the open lots that expired before the given date (YYYY-MM-DD).
+def get_expired_lots(as_of):
+    return get_lots_expiring_between('', as_of)
+
+
+# Returns the open lots that expire within the given number of days from first_date (YYYY-MM-DD), first_date included.
+def get_expiring_lots(first_date, days):
+    end_date = date.fromisoformat(first_date) + timedelta(days=days + 1)
+    return get_lots_expiring_between(first_date, end_date.isoformat())
@@ -1,12 +1,11 @@
 # main.py
 # Imports
+# Only argparse, the profiling switches and the storage settings are imported up front. Every command imports the modules it needs inside its branch of main(), so trivial commands like 'today' and 'totalcost' do not pay for rich or for parsing the ledgers.
+import profiling
 import argparse
-from rich import print
-from date import advance_date, get_date, print_date
-from inventory import display_sales, display_purchases, display_inventory, get_sold_items, get_bought_items
-from sell import sell_item
-from buy import buy_item
-from metrics import calculate_total_cost, calculate_total_revenue, calculate_total_profit, calculate_revenue_by_date, calculate_revenue_between_dates, calculate_cost_by_date, calculate_profit_between_dates, get_sold_items, write_profit_to_file, write_cost_to_file, write_revenue_to_file
+import sys
+from locking import selected_sync_mode, set_sync_mode, sync_modes
+from storage import backends, selected_backend, set_backend
 
 
 # Do not change these lines.
@@ -14,33 +13,71 @@ __winc_id__ = "a2bc36ea784242e4989deb157d527ba0"
 __human_name__ = "superpy"
 
 # Your code below this line.
+# Argument type for counts like --limit and --offset: a whole number of zero or more.
+def non_negative_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {text!r}")
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {value}")
+    return value
+
+
+# Argument type for how many items to show: a whole number of one or more.
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be 1 or more, got {value}")
+    return value
+
+
 parser = argparse.ArgumentParser(description="Supermarket Supply Administer")
+parser.add_argument('--backend', choices=backends, default=selected_backend,
+                    help="Storage backend for ledgers and inventory (default: csv, or $SUPERPY_BACKEND)")
+parser.add_argument('--sync', choices=sync_modes, default=selected_sync_mode,
+                    help="When to fsync ledger appends: none, always, or group (concurrent writers share one fsync); default: none, or $SUPERPY_SYNC")
+parser.add_argument('--stats', action='store_true',
+                    help="Print per-phase timings and row/byte counters to stderr after the command")
+parser.add_argument('--stats-json', metavar='FILE',
+                    help="Write the per-phase timings and counters as JSON to FILE ('-' for stderr)")
+parser.add_argument('--profile', action='store_true',
+                    help="Run the command under cProfile and print the top functions and the phase timings to stderr")
+parser.add_argument('--profile-output', metavar='FILE',
+                    help="With --profile, save the cProfile data to FILE (for pstats or snakeviz) instead of printing it")
 subparsers = parser.add_subparsers(dest="command", required=True)
 
 # dateparsers
 advance_date_parser = subparsers.add_parser(
-    "advancedate", help="Advance the date by the number of days")
+    "advancedate", help="Advance the date by the number of days (remembered until resetdate)")
 advance_date_parser.add_argument(
     'days', type=int, help="Number of days to advance")
-advance_date_parser.set_defaults(func=advance_date)
 
 today_parser = subparsers.add_parser('today', help="Show the current date")
-today_parser.set_defaults(func=get_date)
+
+setdate_parser = subparsers.add_parser(
+    'setdate', help="Set the current date to a given date")
+setdate_parser.add_argument('date', help="New current date (YYYY-MM-DD)")
+
+resetdate_parser = subparsers.add_parser(
+    'resetdate', help="Follow the system clock again")
 
 # totalcost parser
 totalcost_parser = subparsers.add_parser(
     'totalcost', help="Calculate total cost of all items bought")
-totalcost_parser.set_defaults(func=calculate_total_cost)
 
 # revenueparsers
 totalrevenue_parser = subparsers.add_parser(
     'totalrevenue', help="Calculate total revenue from sales")
-totalrevenue_parser.set_defaults(func=calculate_total_revenue)
 
 # totalprofit parser
 totalprofit_parser = subparsers.add_parser(
     'totalprofit', help="Calculate total profit (total revenue - total cost)")
-totalprofit_parser.set_defaults(func=calculate_total_profit)
+totalprofit_parser.add_argument(
+    '--cogs', action='store_true', help="Subtract the exact cost of the goods sold instead of all purchases")
 
 
 # datecost parser
@@ -50,7 +87,6 @@ datecost_parser.add_argument(
     'start_date', help="Start date (YYYY-MM-DD)")
 datecost_parser.add_argument(
     'end_date', nargs='?', help="End date (YYYY-MM-DD)")
-datecost_parser.set_defaults(func=calculate_cost_by_date)
 
 
 # daterevenue parser
@@ -60,7 +96,6 @@ date_revenue_parser.add_argument(
     'start_date', nargs='?', help="Start date (YYYY-MM-DD)")
 date_revenue_parser.add_argument(
     'end_date', nargs='?', help="End date (YYYY-MM-DD)")
-date_revenue_parser.set_defaults(func=calculate_revenue_between_dates)
 
 # dateprofit parser
 dateprofit_parser = subparsers.add_parser(
@@ -69,81 +104,267 @@ dateprofit_parser.add_argument(
     'start_date', help="Start date (YYYY-MM-DD) to calculate total profit")
 dateprofit_parser.add_argument(
     'end_date', nargs='?', help="End date (YYYY-MM-DD) to calculate total profit")
-dateprofit_parser.set_defaults(func=calculate_profit_between_dates)
+dateprofit_parser.add_argument(
+    '--cogs', action='store_true', help="Subtract the exact cost of the goods sold instead of the purchases in the period")
+
+
+# expiryparsers
+expired_parser = subparsers.add_parser(
+    'expired', help="Display the purchase lots with stock left that have expired")
+expired_parser.add_argument(
+    'date', nargs='?', help="Show lots expired before this date (YYYY-MM-DD, default: today)")
+
+expiring_parser = subparsers.add_parser(
+    'expiring', help="Display the purchase lots with stock left that expire within a number of days")
+expiring_parser.add_argument(
+    'days', type=int, help="Number of days to look ahead")
+expiring_parser.add_argument(
+    '--from', dest='first_date', help="Start counting from this date (YYYY-MM-DD, default: today)")
 
 
 # buyparsers
 buy_parser = subparsers.add_parser(
     'buy', help="Register a purchase of a product")
-buy_parser.set_defaults(func=buy_item)
+buy_parser.add_argument(
+    '--from', dest='source', help="Register purchases in bulk from a CSV or JSON Lines file ('-' for stdin)")
 
 # sellparsers
 sell_parser = subparsers.add_parser(
     'sell', help="Register a sale of a product")
-sell_parser.set_defaults(func=sell_item)
+sell_parser.add_argument(
+    '--from', dest='source', help="Register sales in bulk from a CSV or JSON Lines file ('-' for stdin)")
 
 # inventoryparsers
 inventory_parser = subparsers.add_parser(
     'inventory', help="Display the current inventory")
-inventory_parser.set_defaults(func=display_inventory)
+inventory_parser.add_argument(
+    '--as-of', dest='as_of', help="Show the stock at the end of this date instead (YYYY-MM-DD)")
 
 
+# productparser
+product_parser = subparsers.add_parser(
+    'product', help="Show the purchases, sales, stock and margin of one product")
+product_parser.add_argument('product_name', help="The product to show")
+product_parser.add_argument('--limit', type=positive_int,
+                            help="Only show the most recent purchases and sales, this many of each")
+
+# topparser
+top_parser = subparsers.add_parser(
+    'top', help="Rank the products by revenue, units sold, net (revenue - purchases), margin (revenue - cost of goods sold) or sell-through over a date range")
+top_parser.add_argument('number', type=positive_int, nargs='?', default=10,
+                        help="How many products to show (default: 10)")
+top_parser.add_argument('--by', dest='measure', choices=('revenue', 'units', 'net', 'margin', 'sellthrough'),
+                        default='revenue', help="What to rank by (default: revenue); net is revenue minus the purchases in the range, margin is revenue minus the cost of the goods sold")
+top_parser.add_argument('--from', dest='first_date',
+                        help="Only count the days on or after this date (YYYY-MM-DD)")
+top_parser.add_argument('--to', dest='last_date',
+                        help="Only count the days on or before this date (YYYY-MM-DD)")
+
+# seriesparser
+series_parser = subparsers.add_parser(
+    'series', help="Show cost, revenue, profit and units per day, ISO week or month over a date range")
+series_parser.add_argument('period', nargs='?', choices=('day', 'week', 'month'), default='day',
+                           help="Bucket size (default: day)")
+series_parser.add_argument('--from', dest='first_date',
+                           help="First date of the series (YYYY-MM-DD, default: the first recorded day)")
+series_parser.add_argument('--to', dest='last_date',
+                           help="Last date of the series (YYYY-MM-DD, default: the last recorded day)")
+series_parser.add_argument('--product', dest='product_name',
+                           help="Only count this product")
+series_parser.add_argument('--format', dest='series_format', choices=('table', 'csv', 'json'), default='table',
+                           help="Output format (default: table)")
+series_parser.add_argument('--output', '-o', dest='file_path',
+                           help="With csv or json, the file to write (default: stdout)")
+
 # sales_historyparser
 sales_parser = subparsers.add_parser('sales', help="Display sales history")
-sales_parser.set_defaults(func=display_sales)
 
 # purchase_historyparser
 purchases_parser = subparsers.add_parser(
     'purchases', help="Display purchase history")
-purchases_parser.set_defaults(func=display_purchases)
 
-# Parse the command-line arguments
-args = parser.parse_args()
+for listing_parser in (sales_parser, purchases_parser):
+    listing_parser.add_argument('--limit', type=non_negative_int,
+                                help="Show at most this many rows")
+    listing_parser.add_argument('--offset', type=non_negative_int, default=0,
+                                help="Skip this many matching rows first")
+    listing_parser.add_argument('--product', dest='product_name',
+                                help="Only show rows for this product")
+    listing_parser.add_argument('--from', dest='first_date',
+                                help="Only show rows dated on or after this date (YYYY-MM-DD)")
+    listing_parser.add_argument('--to', dest='last_date',
+                                help="Only show rows dated on or before this date (YYYY-MM-DD)")
+    listing_parser.add_argument('--plain', action='store_true',
+                                help="Write tab-separated rows as they are read instead of a table")
+
+# exportparser
+export_parser = subparsers.add_parser(
+    'export', help="Stream a ledger, the inventory, the open lots or the daily metrics to JSON Lines, CSV or columnar")
+export_parser.add_argument(
+    'dataset', choices=('bought', 'sold', 'inventory', 'lots', 'daily'), help="What to export")
+export_parser.add_argument('--format', dest='export_format', choices=('jsonl', 'csv', 'columnar'), default='jsonl',
+                           help="Output format (default: jsonl)")
+export_parser.add_argument('--output', '-o', dest='file_path',
+                           help="File to write (default: stdout); a name ending in .gz is compressed")
+export_parser.add_argument('--gzip', action='store_true',
+                           help="Compress the output with gzip")
+export_parser.add_argument('--product', dest='product_name',
+                           help="Only export rows for this product")
+export_parser.add_argument('--from', dest='first_date',
+                           help="Only export rows dated on or after this date (YYYY-MM-DD; expiration date for lots)")
+export_parser.add_argument('--to', dest='last_date',
+                           help="Only export rows dated on or before this date (YYYY-MM-DD; expiration date for lots)")
+
+# migrateparser
+migrate_parser = subparsers.add_parser(
+    'migrate', help="Copy the CSV ledgers and inventory into the SQLite database")
+
+# archiveparser
+archive_parser = subparsers.add_parser(
+    'archive', help="Move the ledger rows of closed periods into compressed archive files")
+archive_parser.add_argument('--before', dest='cutoff',
+                            help="Archive the rows dated before this date (YYYY-MM-DD, default: the first day of the current month)")
+
+# verifyparser
+verify_parser = subparsers.add_parser(
+    'verify', help="Check the running totals and the inventory against the ledgers")
+verify_parser.add_argument('--repair', action='store_true',
+                           help="Rewrite the totals and the inventory from the ledgers when they differ")
+
+# rebuildrollupparser
+rebuild_rollup_parser = subparsers.add_parser(
+    'rebuildrollup', help="Rebuild the daily cost/revenue rollup from the ledgers")
+
+# shellparser
+shell_parser = subparsers.add_parser(
+    'shell', help="Start an interactive shell that keeps the ledgers in memory")
+shell_mode = shell_parser.add_mutually_exclusive_group()
+shell_mode.add_argument('--serve', action='store_true',
+                        help="Run the shell as a daemon on a local Unix socket")
+shell_mode.add_argument('--connect', action='store_true',
+                        help="Connect to a running shell daemon")
+
+# apiparser
+api_parser = subparsers.add_parser(
+    'api', help="Serve buy, sell, inventory and metrics as a local HTTP/JSON API")
+api_parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on (default: 127.0.0.1)")
+api_parser.add_argument('--port', type=int, default=8765,
+                        help="Port to listen on (default: 8765)")
 
 
 def main():
+    # Parse the command-line arguments
+    parse_started = profiling.time.perf_counter()
+    args = parser.parse_args()
+    set_backend(args.backend)
+    set_sync_mode(args.sync)
+
+    if not (args.stats or args.stats_json or args.profile):
+        run_command(args)
+        return
+
+    profiling.enable()
+    profiling.add_time('import', parse_started - profiling.started)
+    profiling.add_time('argument parsing', profiling.time.perf_counter() - parse_started)
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(run_command, args)
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+        else:
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    else:
+        run_command(args)
 
-    sales_data = [
-        {"date": "2023-01-01", "price": 10.0, "quantity": 5},
-        {"date": "2023-01-02", "price": 15.0, "quantity": 3},
-    ]
-    sold_items = get_sold_items()
-    bought_items = get_bought_items()
+    if args.stats or args.profile:
+        profiling.write_summary(sys.stderr)
+    if args.stats_json == '-':
+        profiling.write_summary(sys.stderr, as_json=True)
+    elif args.stats_json:
+        with open(args.stats_json, 'w') as jsonfile:
+            profiling.write_summary(jsonfile, as_json=True)
 
+
+# Runs the selected command.
+def run_command(args):
     if args.command == "today":
+        from date import print_date
         print_date()
     elif args.command == "advancedate":
+        from date import advance_date
         if args.days is not None:
             advance_date(args.days)
         else:
             print("Please provide the number of days to advance.")
+    elif args.command == "setdate":
+        from date import change_date
+        change_date(args.date)
+    elif args.command == "resetdate":
+        from date import reset_date
+        reset_date()
     elif args.command == "sales":
-        display_sales()
+        from inventory import display_sales
+        display_sales(args.limit, args.offset, args.product_name,
+                      args.first_date, args.last_date, args.plain)
     elif args.command == "inventory":
-        display_inventory()
+        from inventory import display_inventory
+        display_inventory(args.as_of)
+    elif args.command == "product":
+        from inventory import display_product
+        display_product(args.product_name, args.limit)
+    elif args.command == "top":
+        from inventory import valid_date_range
+        from rankings import display_top
+        if valid_date_range(args.first_date, args.last_date):
+            display_top(args.number, args.measure, args.first_date, args.last_date)
+    elif args.command == "series":
+        from inventory import valid_date_range
+        from series import display_series
+        if valid_date_range(args.first_date, args.last_date):
+            display_series(args.period, args.first_date, args.last_date, args.product_name,
+                           args.series_format, args.file_path)
+    elif args.command == "expired":
+        from inventory import display_expired
+        display_expired(args.date)
+    elif args.command == "expiring":
+        from inventory import display_expiring
+        display_expiring(args.days, args.first_date)
     elif args.command == "sell":
-        sell_item()
+        from sell import sell_item, sell_items_from_file
+        if args.source:
+            sell_items_from_file(args.source)
+        else:
+            sell_item()
     elif args.command == "totalcost":
+        from metrics import calculate_total_cost
         total_cost = calculate_total_cost()
         if total_cost is not None:
             print(f"Total cost of all items bought: ${total_cost:.2f}")
         else:
             print("Error calculating total cost.")
     elif args.command == "totalrevenue":
+        from metrics import calculate_total_revenue
         total_revenue = calculate_total_revenue()
         if total_revenue is not None:
             print(f"Total revenue from sales: ${total_revenue:.2f}")
         else:
             print("Error calculating total revenue.")
     elif args.command == "totalprofit":
-        total_profit = calculate_total_profit()
+        from metrics import calculate_total_gross_profit, calculate_total_profit
+        total_profit = calculate_total_gross_profit() if args.cogs else calculate_total_profit()
         if total_profit is not None:
-            print(f"Total profit: ${total_profit:.2f}")
+            print(f"Total {'gross ' if args.cogs else ''}profit: ${total_profit:.2f}")
         else:
             print("Error calculating total profit.")
     elif args.command == "purchases":
-        display_purchases()
+        from inventory import display_purchases
+        display_purchases(args.limit, args.offset, args.product_name,
+                          args.first_date, args.last_date, args.plain)
     elif args.command == "datecost":
+        from metrics import calculate_cost_by_date, write_cost_to_file
         if args.start_date:
             total_cost = calculate_cost_by_date(args.start_date, args.end_date)
             write_cost_to_file(args.start_date, args.end_date, total_cost)
@@ -151,6 +372,7 @@ def main():
             print("Invalid command. Please provide a start_date.")
 
     elif args.command == "daterevenue":
+        from metrics import calculate_revenue_by_date, calculate_revenue_between_dates, write_revenue_to_file
         if args.start_date:
             if args.end_date:
                 total_revenue = calculate_revenue_between_dates(
@@ -163,15 +385,77 @@ def main():
             print("Invalid command. Please provide a start_date.")
 
     elif args.command == "dateprofit":
+        from metrics import calculate_gross_profit_between_dates, calculate_profit_between_dates, write_profit_to_file
         if args.start_date:
             start_date = args.start_date
             end_date = args.end_date
-            total_profit = calculate_profit_between_dates(start_date, end_date)
+            if args.cogs:
+                total_profit = calculate_gross_profit_between_dates(
+                    start_date, end_date)
+            else:
+                total_profit = calculate_profit_between_dates(
+                    start_date, end_date)
             write_profit_to_file(start_date, end_date, total_profit)
         else:
             print("Invalid command. Please provide a start_date.")
     elif args.command == "buy":
-        buy_item()
+        from buy import buy_item, buy_items_from_file
+        if args.source:
+            buy_items_from_file(args.source)
+        else:
+            buy_item()
+
+    elif args.command == "export":
+        from export import export
+        from inventory import valid_date_range
+        if valid_date_range(args.first_date, args.last_date):
+            count = export(args.dataset, args.export_format, args.file_path, args.gzip,
+                           args.product_name, args.first_date, args.last_date)
+            if args.file_path not in (None, '-'):
+                print(f"Exported {count} rows to {args.file_path}.")
+    elif args.command == "migrate":
+        from storage import CsvStorage, migrate_csv_to_sqlite
+        bought_count, sold_count = migrate_csv_to_sqlite()
+        print(
+            f"Migrated {bought_count} purchases and {sold_count} sales to the SQLite database.")
+        if CsvStorage().get_archive_summary():
+            print("Note: the rows moved out with 'archive' are not part of the CSV ledgers and were not migrated.")
+
+    elif args.command == "archive":
+        from archive import archive_before, default_cutoff
+        cutoff = args.cutoff or default_cutoff()
+        try:
+            archived = archive_before(cutoff)
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+        else:
+            if archived is None:
+                print(f"There are no rows dated before {cutoff} to archive.")
+            else:
+                print(f"Archived {archived['bought_rows']} purchases and {archived['sold_rows']} sales "
+                      f"dated before {cutoff} to {archived['directory']}.")
+
+    elif args.command == "verify":
+        from verify import display_verify
+        display_verify(args.repair)
+
+    elif args.command == "rebuildrollup":
+        from rollup import rebuild_rollup
+        rollup = rebuild_rollup()
+        print(f"Rebuilt the daily rollup for {len(rollup['days'])} days.")
+
+    elif args.command == "shell":
+        from shell import connect, run_shell, serve
+        if args.serve:
+            serve()
+        elif args.connect:
+            connect()
+        else:
+            run_shell()
+
+    elif args.command == "api":
+        from api import run_api
+        run_api(args.host, args.port)
 
     else:
         print("Invalid command. Please choose a valid command: today, advancedate, sales, inventory, sell, purchases, buy, totalcost")
@@ -1,46 +1,30 @@
 # Here you will find all the financial - analysis
 # metrics.py
-from inventory import get_bought_items, get_sold_items
-from rich import print
+from lots import sum_cogs
+from storage import get_storage
+from output import print
+from profiling import timed
 
 
-total_cost_file = './files/total_cost.txt'
-total_revenue_file = './files/total_revenue.txt'
 cost_data = './files/cost.txt'
 revenue_data = './files/revenue.txt'
 profit_data = './files/profit.txt'
 
 
 #  basic logic functions -->
+@timed('aggregate')
 def calculate_total_cost():
-    try:
-        with open(total_cost_file, 'r') as cost_file:
-            return float(cost_file.readline().strip())
-    except FileNotFoundError:
-        print("Total cost file not found. Creating a new file.")
-        with open(total_cost_file, 'w') as cost_file:
-            cost_file.write("0.0")
-        return 0.0
-    except ValueError:
-        print("Invalid total cost value in the file. Resetting total cost to 0.0.")
-        with open(total_cost_file, 'w') as cost_file:
-            cost_file.write("0.0")
-        return 0.0
+    total_cost = get_storage().get_total('cost')
+    return 0.0 if total_cost is None else total_cost
 
 
+@timed('aggregate')
 def calculate_total_revenue():
-    try:
-        with open(total_revenue_file, 'r') as revenue_file:
-            total_revenue = revenue_file.readline().strip()
-            if total_revenue:
-                return float(total_revenue)
-            else:
-                return 0.0
-    except (FileNotFoundError, ValueError):
-        print("Error: Total revenue file not found or contains invalid data.")
-        return 0.0
+    total_revenue = get_storage().get_total('revenue')
+    return 0.0 if total_revenue is None else total_revenue
 
 
+@timed('aggregate')
 def calculate_total_profit():
     total_cost = calculate_total_cost()
     total_revenue = calculate_total_revenue()
@@ -50,20 +34,10 @@ def calculate_total_profit():
 # _____________________________________________________
 
 
-# Computes total revenue on a specific date by iterating through sales data, identifying matching dates, and summing up earnings of sold items.
+# Computes total revenue on a specific date from the date index of the sold ledger.
+@timed('aggregate')
 def calculate_revenue_by_date(target_date):
-    sales_data = get_sold_items()
-    total_revenue = 0
-
-    for sale in sales_data:
-        sale_date = sale.get('sell_date')
-        amount = int(sale.get('amount'))
-        earnings = float(sale.get('total_earnings'))
-
-        if sale_date and sale_date == target_date:
-            total_revenue += earnings
-
-    return total_revenue
+    return get_storage().sum_revenue(target_date, target_date)
 
 
 #  this one may not be used, but i spend hours and hours debugging, so i leave this "display revenue" code , also as a reference->
@@ -86,18 +60,10 @@ def write_revenue_to_file(start_date, end_date, total_revenue):
         print(f"An error occurred: {e}")
 
 
-# Calculates total cost within a specified date range or on a specific date by summing the costs of items bought within that period.
+# Calculates total cost within a specified date range or on a specific date from the prefix sums of the bought ledger's date index.
+@timed('aggregate')
 def calculate_cost_by_date(start_date, end_date=None):
-    bought_items = get_bought_items()
-
-    if end_date:
-        total_cost = sum(float(item['total_cost'])
-                         for item in bought_items if start_date <= item['purchase_date'] <= end_date)
-    else:
-        total_cost = sum(float(item['total_cost'])
-                         for item in bought_items if item['purchase_date'] == start_date)
-
-    return total_cost
+    return get_storage().sum_cost(start_date, end_date or start_date)
 
 
 # Writes total cost information to a file for a specific date range
@@ -109,57 +75,51 @@ def write_cost_to_file(start_date, end_date, total_cost):
     print(cost_info)
 
 
-# Calculates total profit on a specific date by subtracting the total cost of items bought from the total revenue earned from sales on that date.
+# Calculates total profit on a specific date by subtracting the total cost of items bought from the total revenue earned from sales on that date, using the range sums of the storage backend.
+@timed('aggregate')
 def calculate_profit_by_date(date):
-    try:
-        sold_items = get_sold_items()
-        bought_items = get_bought_items()
-
-        total_cost = sum(float(item['total_cost']) for item in bought_items
-                         if item['expiration_date'] == date)
-        total_revenue = sum(float(item['total_earnings']) for item in sold_items
-                            if item['sell_date'] == date)
-
-        total_profit = total_revenue - total_cost
+    storage = get_storage()
+    return round(storage.sum_revenue(date, date) - storage.sum_cost(date, date), 2)
 
-        return total_profit
-    except FileNotFoundError:
-        print("File not found.")
-        return 0.0
 
-
-# Calculates total revenue between specified start and end dates by iterating through sold items' data.
+# Calculates total revenue between specified start and end dates from the prefix sums of the sold ledger's date index.
+@timed('aggregate')
 def calculate_revenue_between_dates(start_date, end_date):
-    sold_items = get_sold_items()
-    total_revenue = 0
-    for item in sold_items:
-        sell_date = item.get('sell_date')
-        if start_date <= sell_date <= end_date:
-            total_revenue += float(item.get('total_earnings', 0))
-    return total_revenue
+    return get_storage().sum_revenue(start_date, end_date)
 
 
 # Determines total profit within a date range or on a specific date by subtracting total cost from total revenue, considering both items bought and items sold during that period.
+@timed('aggregate')
 def calculate_profit_between_dates(start_date, end_date=None):
-    sold_items = get_sold_items()
-    bought_items = get_bought_items()
-
-    if end_date:
-        total_revenue = sum(float(item.get('total_earnings', 0))
-                            for item in sold_items if start_date <= item.get('sell_date', '') <= end_date)
-        total_cost = sum(float(item['total_cost'])
-                         for item in bought_items if start_date <= item['purchase_date'] <= end_date)
-    else:
-        total_revenue = sum(float(item.get('total_earnings', 0))
-                            for item in sold_items if item.get('sell_date', '') == start_date)
-
-        total_cost = sum(float(item['total_cost'])
-                         for item in bought_items if item['purchase_date'] == start_date)
+    storage = get_storage()
+    end_date = end_date or start_date
+    total_revenue = storage.sum_revenue(start_date, end_date)
+    total_cost = storage.sum_cost(start_date, end_date)
 
     total_profit = total_revenue - total_cost
     return total_profit
 
 
+# Calculates the exact cost of goods sold within a date range or on a specific date, from the purchase lots each sale was taken from.
+@timed('aggregate')
+def calculate_cogs_between_dates(start_date, end_date=None):
+    return sum_cogs(start_date, end_date or start_date)
+
+
+# Determines the gross profit within a date range or on a specific date: revenue minus the exact cost of the goods sold in that period, instead of minus all purchases.
+@timed('aggregate')
+def calculate_gross_profit_between_dates(start_date, end_date=None):
+    end_date = end_date or start_date
+    total_revenue = get_storage().sum_revenue(start_date, end_date)
+    return total_revenue - calculate_cogs_between_dates(start_date, end_date)
+
+
+# Calculates the total gross profit: total revenue minus the cost of all goods sold so far.
+@timed('aggregate')
+def calculate_total_gross_profit():
+    return calculate_total_revenue() - sum_cogs('0000-00-00', '9999-99-99')
+
+
 # Writes total profit information to a file for a specific date range.
 def write_profit_to_file(start_date, end_date, total_profit):
     date_label = f" for {start_date}" if not end_date else f" between {start_date} and {end_date}"
@@ -0,0 +1,18 @@
+# output.py
+# Lazy access to rich, so commands only pay for importing it when they actually print styled output.
+_console = None
+
+
+# Returns the shared rich console, creating it on first use.
+def get_console():
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+
+# Drop-in replacement for rich's print that imports rich on the first call.
+def print(*objects, **kwargs):
+    from rich import print as rich_print
+    rich_print(*objects, **kwargs)
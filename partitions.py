@@ -0,0 +1,153 @@
+# partitions.py
+# Monthly partitions of the append-only CSV ledgers. A ledger stays one file; the manifest '<ledger>.parts' splits it into partitions, each a contiguous byte range of rows dated in one calendar month, with its first and last date, row count and totals (cents of the total column, units of the amount column). A row dated in another month than the row before it starts a new partition, so a ledger in date order has one partition per month and back-dated rows get small partitions of their own.
+# A range query skips the partitions outside the range, takes the totals of the partitions inside it from the manifest and scans only the partitions that straddle a range boundary. Large scans are split into chunks and summed in a process pool. The manifest keeps a checkpoint (see ledgertail.py) and only parses the bytes appended since it was last saved.
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from ledgertail import empty_checkpoint, is_extension, read_appended
+from locking import atomic_write
+from profiling import count, phase, timed
+
+chunk_size = 4 * 1024 * 1024
+parallel_threshold = 8 * 1024 * 1024
+
+
+# Returns the file path of the partition manifest of a ledger.
+def manifest_link(ledger_link):
+    return ledger_link + '.parts'
+
+
+# Returns an empty manifest for a ledger with the given header line.
+def empty_manifest(header, inode=0):
+    return {'checkpoint': empty_checkpoint(header, inode), 'partitions': []}
+
+
+# Loads the partition manifest, returning None when it is missing or unreadable.
+def load_manifest(ledger_link):
+    try:
+        with open(manifest_link(ledger_link), 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Writes the partition manifest.
+def save_manifest(ledger_link, manifest):
+    with atomic_write(manifest_link(ledger_link)) as jsonfile:
+        json.dump(manifest, jsonfile)
+
+
+# Adds the complete lines appended to the ledger since the manifest checkpoint to its partitions.
+def extend_manifest(ledger, manifest, date_column, total_column):
+    partitions = manifest['partitions']
+    positions = None
+    for offset, fieldnames, row in read_appended(ledger, manifest['checkpoint']):
+        if positions is None:
+            positions = fieldnames.index(date_column), fieldnames.index(total_column), fieldnames.index('amount')
+        row_date = row[positions[0]]
+        partition = partitions[-1] if partitions else None
+        if partition is None or partition['month'] != row_date[:7]:
+            if partition is not None:
+                partition['end'] = offset
+            partition = {'month': row_date[:7], 'start': offset, 'end': offset, 'rows': 0,
+                         'first_date': row_date, 'last_date': row_date, 'total': 0, 'units': 0}
+            partitions.append(partition)
+        partition['rows'] += 1
+        partition['first_date'] = min(partition['first_date'], row_date)
+        partition['last_date'] = max(partition['last_date'], row_date)
+        partition['total'] += round(float(row[positions[1]]) * 100)
+        partition['units'] += int(row[positions[2]])
+    if partitions:
+        partitions[-1]['end'] = manifest['checkpoint']['size']
+
+
+# Returns the up-to-date partition manifest for a ledger, catching up on appended rows and rebuilding it when the ledger was replaced, rewritten or truncated.
+@timed('partition manifest')
+def get_manifest(ledger_link, date_column, total_column):
+    if not os.path.isfile(ledger_link):
+        return empty_manifest('')
+    with open(ledger_link, 'rb') as ledger:
+        header = ledger.readline().decode('utf-8-sig').strip()
+        size = os.fstat(ledger.fileno()).st_size
+        manifest = load_manifest(ledger_link)
+        if manifest is None or not is_extension(manifest.get('checkpoint'), ledger, header):
+            manifest = empty_manifest(header, os.fstat(ledger.fileno()).st_ino)
+        elif manifest['checkpoint']['size'] == size:
+            return manifest
+        extend_manifest(ledger, manifest, date_column, total_column)
+    save_manifest(ledger_link, manifest)
+    return manifest
+
+
+# Yields the complete lines that start in the byte range [start, end) of a ledger opened in binary mode, as text. A range may start in the middle of a line; that line belongs to the range before it.
+def read_lines(ledger, start, end):
+    ledger.seek(start - 1)
+    ledger.readline()
+    while ledger.tell() < end:
+        line = ledger.readline()
+        if not line.endswith(b'\n'):
+            return
+        yield line.decode('utf-8')
+
+
+# Splits the byte range [start, end) of a ledger into chunks of at most chunk_size bytes.
+def split_range(start, end):
+    return [(offset, min(offset + chunk_size, end)) for offset in range(start, end, chunk_size)]
+
+
+# Sums (cents, units, rows) of the rows dated between start_date and end_date among the lines that start in the byte range [start, end) of a ledger. Runs in the worker processes, so it only takes plain arguments.
+def scan_range(ledger_link, fieldnames, date_column, total_column, start, end, start_date, end_date):
+    date_position = fieldnames.index(date_column)
+    total_position = fieldnames.index(total_column)
+    amount_position = fieldnames.index('amount')
+    cents = units = rows = 0
+    with open(ledger_link, 'rb') as ledger:
+        for row in csv.reader(read_lines(ledger, start, end), delimiter='|'):
+            if row and start_date <= row[date_position] <= end_date:
+                cents += round(float(row[total_position]) * 100)
+                units += int(row[amount_position])
+                rows += 1
+    return cents, units, rows
+
+
+# Calls a module-level function with each tuple of arguments and returns the results in order. The calls run in a process pool with one worker per core when there are several and they read at least parallel_threshold bytes together.
+def run_tasks(function, tasks, size):
+    workers = min(len(tasks), os.cpu_count() or 1)
+    if workers > 1 and size >= parallel_threshold:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(function, *zip(*tasks)))
+    return [function(*task) for task in tasks]
+
+
+# Sums the rows of a ledger dated between start_date and end_date (inclusive) from its partitions and returns {'total': cents, 'units': units, 'rows': rows}. Straddling partitions are scanned, in a process pool with one worker per core when there is enough to scan.
+@timed('partition aggregate')
+def range_totals(ledger_link, date_column, total_column, start_date, end_date):
+    manifest = get_manifest(ledger_link, date_column, total_column)
+    totals = {'total': 0, 'units': 0, 'rows': 0}
+    straddling = []
+    for partition in manifest['partitions']:
+        if partition['last_date'] < start_date or partition['first_date'] > end_date:
+            count('partitions pruned')
+        elif start_date <= partition['first_date'] and partition['last_date'] <= end_date:
+            count('partitions summed')
+            for name in totals:
+                totals[name] += partition[name]
+        else:
+            straddling.append(partition)
+    if not straddling:
+        return totals
+
+    count('partitions scanned', len(straddling))
+    fieldnames = next(csv.reader([manifest['checkpoint']['header']], delimiter='|'))
+    tasks = [(ledger_link, fieldnames, date_column, total_column, start, end, start_date, end_date)
+             for partition in straddling for start, end in split_range(partition['start'], partition['end'])]
+    scanned = sum(partition['end'] - partition['start'] for partition in straddling)
+    with phase('partition scan'):
+        results = run_tasks(scan_range, tasks, scanned)
+    count('bytes read', scanned)
+    for cents, units, rows in results:
+        totals['total'] += cents
+        totals['units'] += units
+        totals['rows'] += rows
+    return totals
@@ -0,0 +1,104 @@
+# productindex.py
+# Sidecar product index for the append-only CSV ledgers. It keeps the byte offset of every row in an SQLite table keyed by (product, offset), '<ledger>.products.db', so everything about one product is read by looking up that product's offsets alone and seeking to its rows, instead of loading an index of the whole ledger or scanning it. The index keeps a checkpoint (see ledgertail.py) and only parses the bytes appended since it was last updated, so it follows every append; a ledger that was replaced or rewritten is indexed again.
+import csv
+import json
+import os
+from contextlib import closing
+from ledgertail import empty_checkpoint, is_extension, read_appended
+from profiling import timed
+
+schema = '''
+    CREATE TABLE IF NOT EXISTS offsets (
+        product TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (product, position)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS checkpoint (
+        data TEXT NOT NULL
+    );
+'''
+
+
+# Returns the file path of the product index for a ledger.
+def index_link(ledger_link):
+    return ledger_link + '.products.db'
+
+
+# Opens the product index of a ledger, starting over when the file is not a readable index. The index can always be rebuilt from the ledger, so it uses write-ahead logging without an fsync per commit.
+def open_index(ledger_link):
+    import sqlite3
+    connection = sqlite3.connect(index_link(ledger_link), isolation_level=None)
+    try:
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.executescript(schema)
+        return connection
+    except sqlite3.DatabaseError:
+        connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(index_link(ledger_link) + suffix):
+                os.remove(index_link(ledger_link) + suffix)
+        return open_index(ledger_link)
+
+
+# Returns the checkpoint stored in an open product index, or None when there is none.
+def load_checkpoint(connection):
+    row = connection.execute('SELECT data FROM checkpoint').fetchone()
+    return json.loads(row[0]) if row else None
+
+
+# Adds the offsets of the complete lines appended to the ledger since the checkpoint.
+def extend_index(connection, ledger, checkpoint, product_column):
+    position = []
+
+    def offsets():
+        for offset, fieldnames, row in read_appended(ledger, checkpoint):
+            if not position:
+                position.append(fieldnames.index(product_column))
+            yield row[position[0]], offset
+
+    connection.executemany('INSERT OR IGNORE INTO offsets VALUES (?, ?)', offsets())
+
+
+# Brings the product index of a ledger, opened in binary mode, up to date in one transaction, catching up on appended rows and starting over when the ledger was replaced, rewritten or truncated.
+@timed('product index')
+def update_index(connection, ledger, product_column):
+    header = ledger.readline().decode('utf-8-sig').strip()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        checkpoint = load_checkpoint(connection)
+        if not is_extension(checkpoint, ledger, header):
+            checkpoint = empty_checkpoint(header, os.fstat(ledger.fileno()).st_ino)
+            connection.execute('DELETE FROM offsets')
+        elif checkpoint['size'] == os.fstat(ledger.fileno()).st_size:
+            connection.execute('COMMIT')
+            return checkpoint
+        extend_index(connection, ledger, checkpoint, product_column)
+        connection.execute('DELETE FROM checkpoint')
+        connection.execute('INSERT INTO checkpoint VALUES (?)', (json.dumps(checkpoint),))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    return checkpoint
+
+
+# Yields the rows of one product as dicts of strings, like csv.DictReader, in ledger order, reading only the lines of that product.
+def iter_product_rows(ledger_link, product_name, product_column='product_name'):
+    if not os.path.isfile(ledger_link):
+        return
+    with open(ledger_link, 'rb') as ledger, closing(open_index(ledger_link)) as connection:
+        checkpoint = update_index(connection, ledger, product_column)
+        offsets = [offset for offset, in connection.execute(
+            'SELECT position FROM offsets WHERE product = ? ORDER BY position', (product_name,))]
+        if not offsets:
+            return
+        fieldnames = next(csv.reader([checkpoint['header']], delimiter='|'))
+
+        def lines():
+            for offset in offsets:
+                ledger.seek(offset)
+                yield ledger.readline().decode('utf-8')
+
+        for row in csv.reader(lines(), delimiter='|'):
+            yield dict(zip(fieldnames, row))
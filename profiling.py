@@ -0,0 +1,124 @@
+# profiling.py
+# Lightweight phase timers and counters for finding where a command spends its time. Everything is switched off by default: phase() then returns a shared no-op context manager and count() returns immediately, so the instrumented code paths pay one flag check. Enable it with the --stats or --profile flags of main.py.
+# Phases can nest (a ledger read may include building its cache), so their times overlap and do not add up to the total.
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+enabled = False
+started = time.perf_counter()
+phases = {}
+counters = {}
+_disabled = nullcontext()
+
+
+# Switches the timers and counters on, and starts timing imports of modules that were not loaded yet.
+def enable():
+    global enabled
+    if not enabled:
+        enabled = True
+        track_imports()
+
+
+# Adds seconds to a phase.
+def add_time(name, seconds):
+    phase_stats = phases.setdefault(name, [0, 0.0])
+    phase_stats[0] += 1
+    phase_stats[1] += seconds
+
+
+# Adds to a counter, like 'rows parsed' or 'bytes written'.
+def count(name, value=1):
+    if enabled and value:
+        counters[name] = counters.get(name, 0) + value
+
+
+@contextmanager
+def _timer(name):
+    phase_started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - phase_started)
+
+
+# Times the block as the named phase.
+def phase(name):
+    return _timer(name) if enabled else _disabled
+
+
+# Decorator that times every call of a function as the named phase.
+def timed(name):
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Counts the items of an iterable as they are consumed, under the given counter name.
+def counted(iterable, name):
+    if not enabled:
+        return iterable
+    return _counting(iterable, name)
+
+
+def _counting(iterable, name):
+    items = 0
+    try:
+        for item in iterable:
+            items += 1
+            yield item
+    finally:
+        count(name, items)
+
+
+# Times top-level imports of modules that are not loaded yet as the 'import' phase. Imports done while loading a module are part of that module's time. Relative imports can't be checked against sys.modules by name, so they only count when they loaded a module.
+def track_imports():
+    import builtins
+    original_import = builtins.__import__
+    depth = [0]
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if depth[0] or (level == 0 and name in sys.modules):
+            return original_import(name, globals, locals, fromlist, level)
+        depth[0] += 1
+        loaded = len(sys.modules)
+        import_started = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            depth[0] -= 1
+            if len(sys.modules) > loaded:
+                add_time('import', time.perf_counter() - import_started)
+
+    builtins.__import__ = timed_import
+
+
+# Returns the collected timings and counters as a dict.
+def summary():
+    return {'total_seconds': time.perf_counter() - started,
+            'phases': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in phases.items()},
+            'counters': dict(counters)}
+
+
+# Writes the summary to a stream: a readable table, or JSON when as_json is set.
+def write_summary(stream=None, as_json=False):
+    stream = stream or sys.stderr
+    result = summary()
+    if as_json:
+        import json
+        json.dump(result, stream, indent=4)
+        stream.write('\n')
+        return
+    stream.write(f"{'phase':32} {'calls':>7} {'seconds':>10}\n")
+    for name, stats in sorted(result['phases'].items(), key=lambda item: -item[1]['seconds']):
+        stream.write(f"{name:32} {stats['calls']:7d} {stats['seconds']:10.4f}\n")
+    stream.write(f"{'total':32} {'':7} {result['total_seconds']:10.4f}\n")
+    for name, value in sorted(result['counters'].items()):
+        stream.write(f"{name:32} {value:18d}\n")
@@ -0,0 +1,113 @@
+# rankings.py
+# Top-N product rankings over a date range. 'top' sums the per-product totals of the daily rollup (see rollup.py) over the days of the range, archived days included, and keeps the best N products with a bounded heap (heapq.nlargest), so a ranking takes time proportional to the days and products in the range, never the number of ledger rows, and never sorts every product.
+# The measures:
+#   revenue      total earnings of the sales in the range
+#   units        units sold in the range
+#   net          revenue minus the cost of the purchases in the range, like 'dateprofit'
+#   margin       revenue minus the cost of the goods sold in the range, like 'product' shows: the lot allocations (see lots.py) grouped by product with the columns of analytics.py, plus the archived cost of goods sold per day and product
+#   sellthrough  units sold / (stock at the start of the range + units bought in the range)
+import heapq
+from datetime import date, timedelta
+from output import get_console
+from profiling import count, phase, timed
+
+measures = ('revenue', 'units', 'net', 'margin', 'sellthrough')
+
+
+# Sums cost, revenue and units bought/sold per product over the days between first_date and last_date (inclusive) of the rollup. Returns {product: [cost cents, revenue cents, units bought, units sold]}.
+def product_totals(first_date, last_date):
+    from rollup import days_between, get_rollup
+    totals = {}
+    days = 0
+    for _, day in days_between(get_rollup(), first_date, last_date):
+        days += 1
+        for product, (cost, revenue, units_bought, units_sold) in day['products'].items():
+            product_total = totals.get(product)
+            if product_total is None:
+                product_total = totals[product] = [0, 0, 0, 0]
+            product_total[0] += round(cost * 100)
+            product_total[1] += round(revenue * 100)
+            product_total[2] += units_bought
+            product_total[3] += units_sold
+    count('rollup days', days)
+    return totals
+
+
+# Sums the cost of goods sold per product over the sales between first_date and last_date (inclusive), archived sales included. Returns {product: cents}.
+def product_cogs(first_date, last_date):
+    from analytics import group_by_product, load_columns
+    from archive import get_daily_product_cogs
+    from lots import refresh_lots
+    from storage import get_storage
+    refresh_lots()
+    with phase('cogs'):
+        cogs = {product: cents for product, (_, cents)
+                in group_by_product(load_columns('allocations'), first_date, last_date).items()}
+    summary = get_storage().get_archive_summary()
+    if summary:
+        for day, products in get_daily_product_cogs(summary).items():
+            if first_date <= day <= last_date:
+                for product, cents in products.items():
+                    cogs[product] = cogs.get(product, 0) + cents
+    return cogs
+
+
+# Returns the top products by a measure between first_date and last_date (inclusive, open-ended when None) as a list of dicts with the product, its rank and every measure (money in cents, sell-through as a fraction), best first; ties go to the higher revenue. Raises ValueError for a number below 1, an unknown measure or an invalid date.
+@timed('aggregate')
+def top_products(number, measure='revenue', first_date=None, last_date=None):
+    if number < 1:
+        raise ValueError(f"The number of products must be 1 or more, got {number}.")
+    if measure not in measures:
+        raise ValueError(f"Unknown measure {measure}, choose from {', '.join(measures)}.")
+    for value in (first_date, last_date):
+        if value is not None:
+            date.fromisoformat(value)
+    totals = product_totals(first_date or '0000-00-00', last_date or '9999-99-99')
+    cogs = product_cogs(first_date or '0000-00-00', last_date or '9999-99-99') if measure == 'margin' else {}
+
+    opening = {}
+    if first_date and date.fromisoformat(first_date) > date.min:
+        from snapshots import get_inventory_as_of
+        opening = get_inventory_as_of((date.fromisoformat(first_date) - timedelta(days=1)).isoformat())
+
+    def rows():
+        for product, (cost, revenue, units_bought, units_sold) in totals.items():
+            available = opening.get(product, 0) + units_bought
+            yield {'product': product, 'revenue': revenue, 'units': units_sold, 'cost': cost,
+                   'net': revenue - cost, 'margin': revenue - cogs.get(product, 0), 'sellthrough': units_sold / available if available > 0 else None}
+
+    def key(row):
+        value = row[measure]
+        return value is not None, value or 0, row['revenue']
+
+    with phase('rank'):
+        ranked = heapq.nlargest(number, rows(), key=key)
+    for rank, row in enumerate(ranked, 1):
+        row['rank'] = rank
+    return ranked
+
+
+# Displays the top products by a measure in a table. The dates must be valid.
+def display_top(number, measure='revenue', first_date=None, last_date=None):
+    ranked = top_products(number, measure, first_date, last_date)
+    period = (f" from {first_date}" if first_date else '') + (f" to {last_date}" if last_date else '')
+    if not ranked:
+        get_console().print(f"There are no purchases or sales{period}.")
+        return
+
+    from rich.table import Table
+    table = Table(title=f"Top {len(ranked)} products by {measure}{period}", show_header=True,
+                  header_style="bold magenta")
+    columns = ['#', 'Product', 'Revenue', 'Units sold', 'Net', 'Sell-through']
+    if measure == 'margin':
+        columns.insert(5, 'Margin')
+    for column in columns:
+        table.add_column(column)
+    for row in ranked:
+        values = [str(row['rank']), row['product'], f"${row['revenue'] / 100:.2f}", str(row['units']),
+                  f"${row['net'] / 100:.2f}", '-' if row['sellthrough'] is None else f"{row['sellthrough']:.1%}"]
+        if measure == 'margin':
+            values.insert(5, f"${row['margin'] / 100:.2f}")
+        table.add_row(*values)
+    with phase('render'):
+        get_console().print(table)
@@ -0,0 +1,102 @@
+# records.py
+# Compact typed records for the ledger rows. Values are parsed once when a ledger is read: IDs and amounts become ints, dates become day ordinals (date.toordinal()) and the row totals become integer cents, so loops over the ledgers compare and add plain ints instead of converting strings on every pass. The classes use __slots__, which makes a record a fraction of the size of a dict of strings.
+# Unit prices stay floats, because they are stored as entered and may have more than two decimals.
+import sys
+from datetime import date
+from functools import lru_cache
+
+
+# Returns the day ordinal of a YYYY-MM-DD date.
+@lru_cache(maxsize=None)
+def day_ordinal(text):
+    return date.fromisoformat(text).toordinal()
+
+
+# Returns the YYYY-MM-DD text of a day ordinal.
+@lru_cache(maxsize=None)
+def day_text(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+# Returns an amount of money (text or number) in integer cents.
+def to_cents(value):
+    return round(float(value) * 100)
+
+
+# Base class: a record type lists its fields and the converters from ledger values in ledger column order.
+class Record:
+    __slots__ = ()
+    fields = ()
+    converters = ()
+
+    # Parses one ledger row (strings, or the typed values a backend returns) in ledger column order.
+    @classmethod
+    def from_values(cls, values):
+        return cls(*[convert(value) for convert, value in zip(cls.converters, values)])
+
+    # Builds records from columns that were already converted, one list per field.
+    @classmethod
+    def from_columns(cls, columns):
+        return [cls(*values) for values in zip(*columns)]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={value!r}' for name, value in zip(self.fields, self.values()))})"
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.fields)
+
+
+# One row of 'bought.csv'. purchase_day and expiration_day are day ordinals, cost_cents is the total cost in cents.
+class Purchase(Record):
+    __slots__ = ('id', 'amount', 'product_name', 'purchase_day', 'price', 'expiration_day', 'cost_cents')
+    fields = __slots__
+    converters = (int, int, sys.intern, day_ordinal, float, day_ordinal, to_cents)
+
+    def __init__(self, id, amount, product_name, purchase_day, price, expiration_day, cost_cents):
+        self.id = id
+        self.amount = amount
+        self.product_name = product_name
+        self.purchase_day = purchase_day
+        self.price = price
+        self.expiration_day = expiration_day
+        self.cost_cents = cost_cents
+
+    @property
+    def purchase_date(self):
+        return day_text(self.purchase_day)
+
+    @property
+    def expiration_date(self):
+        return day_text(self.expiration_day)
+
+    # Returns the row in ledger column order with the dates as text and the total cost in currency units, as register_purchases writes it.
+    def to_row(self):
+        return [self.id, self.amount, self.product_name, self.purchase_date,
+                self.price, self.expiration_date, self.cost_cents / 100]
+
+
+# One row of 'sold.csv'. sell_day is a day ordinal, earnings_cents the total earnings in cents.
+class Sale(Record):
+    __slots__ = ('id', 'product_name', 'amount', 'sell_day', 'price', 'earnings_cents')
+    fields = __slots__
+    converters = (int, sys.intern, int, day_ordinal, float, to_cents)
+
+    def __init__(self, id, product_name, amount, sell_day, price, earnings_cents):
+        self.id = id
+        self.product_name = product_name
+        self.amount = amount
+        self.sell_day = sell_day
+        self.price = price
+        self.earnings_cents = earnings_cents
+
+    @property
+    def sell_date(self):
+        return day_text(self.sell_day)
+
+    # Returns the row in ledger column order with the date as text and the total earnings in currency units, as register_sales writes it.
+    def to_row(self):
+        return [self.id, self.product_name, self.amount, self.sell_date,
+                self.price, self.earnings_cents / 100]
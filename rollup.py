@@ -0,0 +1,192 @@
+# rollup.py
+# Keeps a persisted per-day rollup of cost, revenue and units bought/sold (also per product) for the day-by-day and per-product views: 'series', 'top', 'export daily' and the shell. Range totals of the date metrics come from the storage backend instead (date index and partitions, or SQL sums).
+# The rollup is stored as a base file, 'rollup.json', and an append-only journal, 'rollup.journal', with one JSON line per registered batch: the ledger rows and the last IDs they bring the rollup to. A write only appends its line, so its cost does not grow with the history. Reads load the base and replay the journal; once the journal is larger than journal_limit bytes, a read folds it into a new base and starts an empty journal.
+import copy
+import json
+import os
+from datetime import date, timedelta
+from ledgertail import read_last_line
+from locking import atomic_write, ledger_lock, note_append
+from profiling import count, timed
+from storage import get_storage
+
+rollup_link = './files/rollup.json'
+journal_link = './files/rollup.journal'
+journal_limit = 1024 * 1024
+
+
+# Returns an empty rollup tied to the selected storage backend.
+def empty_rollup():
+    return {'backend': get_storage().name, 'last_bought_id': 0, 'last_sold_id': 0, 'days': {}}
+
+
+# Loads the rollup base file and replays the journal on it, returning None when the base is missing or unreadable. Journal rows the base already covers are skipped; replay stops at a line that is unreadable, such as one cut off by a crash, and the ID check in get_rollup then rebuilds the rollup.
+def load_rollup():
+    if not os.path.exists(rollup_link):
+        return None
+    with open(rollup_link, 'r') as jsonfile:
+        try:
+            rollup = json.load(jsonfile)
+        except json.JSONDecodeError:
+            return None
+    if not os.path.exists(journal_link):
+        return rollup
+    replayed = 0
+    with open(journal_link, 'r') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if entry.get('backend') != rollup.get('backend'):
+                break
+            apply_purchases(rollup, [row for row in entry.get('purchases', ()) if row[0] > rollup['last_bought_id']])
+            apply_sales(rollup, [row for row in entry.get('sales', ()) if row[0] > rollup['last_sold_id']])
+            replayed += 1
+    count('journal lines replayed', replayed)
+    return rollup
+
+
+# Writes the rollup as the new base file and starts an empty journal: a single line with the backend and last IDs of the base.
+def save_rollup(rollup):
+    with atomic_write(rollup_link) as jsonfile:
+        json.dump(rollup, jsonfile)
+    with atomic_write(journal_link) as journal:
+        journal.write(json.dumps(journal_entry(rollup)) + '\n')
+
+
+# Returns a journal line for the rollup state after a batch: the backend and last IDs, with the purchase or sale rows of the batch.
+def journal_entry(rollup, purchases=None, sales=None):
+    entry = {'backend': rollup['backend'], 'last_bought_id': rollup['last_bought_id'],
+             'last_sold_id': rollup['last_sold_id']}
+    if purchases:
+        entry['purchases'] = purchases
+    if sales:
+        entry['sales'] = sales
+    return entry
+
+
+# Returns the last line of the journal, which holds the backend and last IDs the whole rollup covers, or None when the journal is missing or its last line is unreadable. Reads only the end of the file.
+def journal_state():
+    if not os.path.isfile(journal_link):
+        return None
+    line = read_last_line(journal_link)
+    try:
+        return json.loads(line) if line else None
+    except json.JSONDecodeError:
+        return None
+
+
+# Appends one line to the journal.
+def append_journal(entry):
+    with open(journal_link, 'a') as journal:
+        journal.write(json.dumps(entry) + '\n')
+    note_append(journal_link, os.path.getsize(journal_link))
+
+
+# Returns the totals for one day in the rollup, creating them when needed.
+def get_day(rollup, day):
+    return rollup['days'].setdefault(day, {'cost': 0.0, 'revenue': 0.0, 'units_bought': 0, 'units_sold': 0, 'products': {}})
+
+
+# Adds purchase rows (id, amount, product, purchase date, price, expiration date, total cost) to the rollup in memory.
+def apply_purchases(rollup, rows):
+    for row in rows:
+        day = get_day(rollup, row[3])
+        product = day['products'].setdefault(row[2], [0.0, 0.0, 0, 0])
+        day['cost'] = round(day['cost'] + float(row[6]), 2)
+        day['units_bought'] += int(row[1])
+        product[0] = round(product[0] + float(row[6]), 2)
+        product[2] += int(row[1])
+        rollup['last_bought_id'] = max(rollup['last_bought_id'], int(row[0]))
+
+
+# Adds sale rows (id, product, amount, sell date, price, total earnings) to the rollup in memory.
+def apply_sales(rollup, rows):
+    for row in rows:
+        day = get_day(rollup, row[3])
+        product = day['products'].setdefault(row[1], [0.0, 0.0, 0, 0])
+        day['revenue'] = round(day['revenue'] + float(row[5]), 2)
+        day['units_sold'] += int(row[2])
+        product[1] = round(product[1] + float(row[5]), 2)
+        product[3] += int(row[2])
+        rollup['last_sold_id'] = max(rollup['last_sold_id'], int(row[0]))
+
+
+# Builds the whole rollup in memory from the ledgers of the selected storage backend, starting from the days of the archive summary.
+def build_rollup():
+    storage = get_storage()
+    rollup = empty_rollup()
+    summary = storage.get_archive_summary()
+    if summary:
+        rollup.update(days=copy.deepcopy(summary['days']), last_bought_id=summary['last_bought_id'],
+                      last_sold_id=summary['last_sold_id'])
+    apply_purchases(rollup, (item.to_row() for item in storage.get_bought_items()))
+    apply_sales(rollup, (item.to_row() for item in storage.get_sold_items()))
+    return rollup
+
+
+# Rebuilds the whole rollup from the ledgers and saves it.
+@timed('rollup rebuild')
+def rebuild_rollup():
+    rollup = build_rollup()
+    save_rollup(rollup)
+    return rollup
+
+
+# Returns the rollup, rebuilding it when it is missing or does not match the last ledger IDs of the selected backend, and compacting the journal when it has grown past journal_limit.
+def get_rollup():
+    storage = get_storage()
+    with ledger_lock():
+        rollup = load_rollup()
+        if (rollup is None or rollup.get('backend') != storage.name
+                or rollup.get('last_bought_id') != storage.next_bought_id() - 1
+                or rollup.get('last_sold_id') != storage.next_sold_id() - 1):
+            return rebuild_rollup()
+        if os.path.isfile(journal_link) and os.path.getsize(journal_link) > journal_limit:
+            save_rollup(rollup)
+    return rollup
+
+
+# Journals a batch of rows that was just appended to a ledger. A rollup that missed earlier rows is rebuilt instead.
+def record_rows(purchases=None, sales=None):
+    rows = purchases or sales
+    state = journal_state()
+    id_name = 'last_bought_id' if purchases else 'last_sold_id'
+    if state is None or state.get('backend') != get_storage().name or state.get(id_name) != int(rows[0][0]) - 1:
+        rebuild_rollup()
+        return
+    state[id_name] = int(rows[-1][0])
+    append_journal(journal_entry(state, purchases, sales))
+
+
+# Updates the rollup with purchase rows that were just appended to the ledger.
+def record_purchases(rows):
+    record_rows(purchases=rows)
+
+
+# Updates the rollup with sale rows that were just appended to the ledger.
+def record_sales(rows):
+    record_rows(sales=rows)
+
+
+# Yields the rollup entries for the days between start_date and end_date (inclusive), walking whichever is shorter: the calendar days of the range or the recorded days.
+def days_between(rollup, start_date, end_date):
+    days = rollup['days']
+    try:
+        first = date.fromisoformat(start_date)
+        last = date.fromisoformat(end_date)
+    except ValueError:
+        first, last = None, None
+    if first and (last - first).days + 1 <= len(days):
+        current = first
+        while current <= last:
+            day = days.get(current.isoformat())
+            if day:
+                yield current.isoformat(), day
+            current += timedelta(days=1)
+    else:
+        for day in sorted(days):
+            if start_date <= day <= end_date:
+                yield day, days[day]
+
@@ -1,66 +1,26 @@
 # sell.py
-import csv
-from datetime import datetime
-from inventory import decrease_inventory, get_inventory, update_inventory
-from rich import print
-import os
+from date import get_date
+from inventory import get_inventory, read_records, update_inventory
+from lots import record_sale_lots
+from locking import ledger_lock
+from rollup import record_sales
+from profiling import timed
+from storage import get_storage
+from output import print
 
-sold_link = './files/sold.csv'
-total_revenue_file = './files/total_revenue.txt'
 
-headers = ['id', 'product_name', 'amount',
-           'sell_date', 'price', 'total_earnings']
-
-
-# Checks if a file exists at the specified path and returns True if it does, False otherwise.
-def file_exists(file_path):
-    return os.path.isfile(file_path)
-
-
-# Creates the CSV file header with specified column names if the file does not exist.
-def create_csv_header():
-    if not file_exists(sold_link):
-        with open(sold_link, 'w', newline='') as file:
-            writer = csv.writer(file, delimiter='|')
-            writer.writerow(headers)
-
-
-# Generates a new unique ID for a record in the CSV file based on existing IDs.
-def get_new_id(file_path):
-    if not file_path:
-        return 1
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        if not lines:
-            return 1
-        for line in reversed(lines):
-            line = line.strip()
-            if line and not line.startswith('id|'):
-                last_id = int(line.split('|')[0])
-                return last_id + 1
-    return 1
-
-
-# Reads and returns the total revenue from the 'total_revenue.txt' file, handling file not found or invalid data errors.
+# Reads and returns the total revenue from the storage backend, returning 0.0 when none was stored yet.
 def get_total_revenue():
-    try:
-        with open(total_revenue_file, 'r') as revenue_file:
-            total_revenue = revenue_file.readline().strip()
-            if total_revenue:
-                return float(total_revenue)
-            else:
-                return 0.0
-    except (FileNotFoundError, ValueError):
-        print("Error: Total revenue file not found or contains invalid data.")
-        return 0.0
+    total_revenue = get_storage().get_total('revenue')
+    return 0.0 if total_revenue is None else total_revenue
 
 
-# Manages accurate revenue tracking by updating and storing total earnings in 'total_revenue.txt'.
+# Manages accurate revenue tracking by updating and storing total earnings in the storage backend.
 def update_total_revenue(amount):
     try:
-        total_revenue = get_total_revenue() + amount
-        with open(total_revenue_file, 'w') as revenue_file:
-            revenue_file.write(str(total_revenue))
+        with ledger_lock():
+            total_revenue = get_total_revenue() + amount
+            get_storage().save_total('revenue', total_revenue)
     except Exception as e:
         print(f"Error updating total revenue: {str(e)}")
 
@@ -95,23 +55,94 @@ def sell_item():
             print('Please try again with the correct format, example: 1.25')
 
     total_earnings = round(amount * sell_price, 2)
-
-    create_csv_header()
-    id = get_new_id(sold_link)
-    today = datetime.today().strftime('%Y-%m-%d')
-    with open(sold_link, 'a', newline='') as file:
-        csv_writer = csv.writer(file, delimiter='|')
-        csv_writer.writerow(
-            [id, product_name, amount, today, sell_price, total_earnings])
-
-    decrease_inventory(product_name, amount)
+    if not register_sales([(product_name, amount, sell_price)]):
+        return
 
     formatted_text = f"You have sold [bold light_red]{amount}[/bold light_red] {product_name} at a selling price of [bold light_red]${sell_price:.2f}[/bold light_red] each. Total Earnings = [bold light_red]${total_earnings:.2f}[/bold light_red]"
     print(formatted_text)
 
-    update_inventory(get_inventory())
 
-    update_total_revenue(total_earnings)
+# Writes a batch of validated sales (product name, amount, price) to the sold ledger in a single buffered append, then applies the stored inventory, reread under the ledger lock so changes by other processes are kept, and the running total revenue once for the whole batch. Sales that exceed the remaining stock are reported and left out.
+@timed('register sales')
+def register_sales(sales):
+    if not sales:
+        return []
+
+    with ledger_lock():
+        inventory = get_inventory()
+        storage = get_storage()
+        id = storage.next_sold_id()
+        today = get_date()
+        rows = []
+        batch_earnings = 0.0
+        for product_name, amount, sell_price in sales:
+            available_stock = inventory.get(product_name, 0)
+            if available_stock < amount:
+                print(
+                    f"Error: Not enough stock for {product_name} to sell {amount}. Available stock: {available_stock}")
+                continue
+            total_earnings = round(amount * sell_price, 2)
+            rows.append([id, product_name, amount,
+                        today, sell_price, total_earnings])
+            batch_earnings += total_earnings
+            inventory[product_name] = available_stock - amount
+            id += 1
+
+        if not rows:
+            return rows
+
+        storage.append_sold(rows)
+        record_sales(rows)
+        record_sale_lots(rows)
+
+        update_inventory(inventory)
+        update_total_revenue(round(batch_earnings, 2))
+        return rows
+
+
+# Validates a single bulk record and returns it as a sale tuple, or an error message when a field is missing or malformed.
+def parse_sale_record(record):
+    if not isinstance(record, dict):
+        return None, 'not a valid record'
+    product_name = str(record.get('product_name') or record.get('product') or '').strip()
+    if not product_name:
+        return None, 'missing product_name'
+    try:
+        amount = int(record.get('amount'))
+        if amount <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, f"invalid amount {record.get('amount')!r}"
+    try:
+        sell_price = float(record.get('price'))
+        if sell_price < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, f"invalid price {record.get('price')!r}"
+    return (product_name, amount, sell_price), None
+
+
+# Registers sales in bulk from a CSV or JSON Lines file (or stdin with '-'). Invalid lines are reported and skipped, all valid lines are written in one batch.
+def sell_items_from_file(source):
+    sales = []
+    skipped = 0
+    try:
+        for line_number, record in read_records(source):
+            sale, error = parse_sale_record(record)
+            if error:
+                skipped += 1
+                print(f"Skipping line {line_number}: {error}")
+            else:
+                sales.append(sale)
+    except OSError as e:
+        print(f"Error reading {source}: {str(e)}")
+        return
+
+    rows = register_sales(sales)
+    skipped += len(sales) - len(rows)
+    batch_earnings = sum(row[5] for row in rows)
+    print(
+        f"Registered [bold light_red]{len(rows)}[/bold light_red] sales, skipped {skipped}. Total Earnings = [bold light_red]${batch_earnings:.2f}[/bold light_red]")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+# series.py
+# Time-bucketed cost, revenue, profit and units for charting. 'series' walks the days of the daily rollup (see rollup.py) between two dates once and adds them up per day, ISO week or month, so a series of any length costs one pass over the recorded days instead of one 'daterevenue'/'datecost'/'dateprofit' call per bucket, and nothing is appended to the cost, revenue and profit logs. Buckets without purchases or sales are included with zeros, so a chart shows the gaps; the first and last bucket are cut off at the range.
+# Profit is revenue minus the purchases in the bucket, like 'dateprofit'.
+import csv
+import json
+from datetime import date, timedelta
+from output import get_console
+from profiling import count, phase, timed
+
+periods = ('day', 'week', 'month')
+series_formats = ('table', 'csv', 'json')
+series_fields = ['period', 'first_date', 'last_date', 'cost', 'revenue', 'profit', 'units_bought', 'units_sold']
+
+
+# Returns the label of the bucket a date falls in: YYYY-MM-DD for a day, YYYY-Www for an ISO week, YYYY-MM for a month.
+def bucket_label(day, period):
+    if period == 'day':
+        return day.isoformat()
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return day.isoformat()[:7]
+
+
+# Returns the first day of the bucket after the one a date falls in.
+def next_bucket(day, period):
+    if period == 'day':
+        return day + timedelta(days=1)
+    if period == 'week':
+        return day + timedelta(days=7 - day.weekday())
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+# Returns the series between first_date and last_date (inclusive; by default the first and last recorded day) as a list of rows with the fields in series_fields, money in currency units. Raises ValueError for an unknown period or an invalid date.
+@timed('aggregate')
+def get_series(period='day', first_date=None, last_date=None, product_name=None):
+    if period not in periods:
+        raise ValueError(f"Unknown period {period!r}, choose one of: {', '.join(periods)}")
+    for value in (first_date, last_date):
+        if value is not None:
+            date.fromisoformat(value)
+    from export import daily_rows
+
+    buckets = {}
+    recorded = []
+    for row in daily_rows(product_name, first_date, last_date):
+        label = bucket_label(date.fromisoformat(row['date']), period)
+        totals = buckets.get(label)
+        if totals is None:
+            totals = buckets[label] = [0, 0, 0, 0]
+        totals[0] += round(row['cost'] * 100)
+        totals[1] += round(row['revenue'] * 100)
+        totals[2] += row['units_bought']
+        totals[3] += row['units_sold']
+        recorded.append(row['date'])
+    count('rollup days', len(recorded))
+    if not recorded and not (first_date and last_date):
+        return []
+
+    first = date.fromisoformat(first_date or recorded[0])
+    last = date.fromisoformat(last_date or recorded[-1])
+    series = []
+    with phase('bucket'):
+        current = first
+        while current <= last:
+            following = next_bucket(current, period)
+            label = bucket_label(current, period)
+            cost, revenue, units_bought, units_sold = buckets.get(label, (0, 0, 0, 0))
+            series.append({'period': label, 'first_date': current.isoformat(),
+                           'last_date': min(following - timedelta(days=1), last).isoformat(),
+                           'cost': cost / 100, 'revenue': revenue / 100, 'profit': (revenue - cost) / 100,
+                           'units_bought': units_bought, 'units_sold': units_sold})
+            current = following
+    return series
+
+
+# Writes the series as a table with a total row, as pipe-delimited CSV like the ledgers, or as a JSON array, to a file or stdout. The dates must be valid.
+def display_series(period='day', first_date=None, last_date=None, product_name=None, series_format='table',
+                   file_path=None):
+    series = get_series(period, first_date, last_date, product_name)
+    if series_format != 'table':
+        from export import open_output
+        with open_output(file_path) as output:
+            if series_format == 'csv':
+                writer = csv.DictWriter(output, fieldnames=series_fields, delimiter='|', lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(series)
+            else:
+                json.dump(series, output)
+                output.write('\n')
+        return
+    if not series:
+        get_console().print("There are no purchases or sales to show.")
+        return
+
+    from rich.table import Table
+    title = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}[period] + ' totals'
+    if product_name:
+        title += f" for {product_name}"
+    table = Table(title=f"{title} from {series[0]['first_date']} to {series[-1]['last_date']}",
+                  show_header=True, header_style="bold magenta", show_footer=True)
+    totals = {name: sum(row[name] for row in series) for name in series_fields[3:]}
+    table.add_column(period.capitalize(), footer='Total')
+    for name, heading in (('cost', 'Cost'), ('revenue', 'Revenue'), ('profit', 'Profit')):
+        table.add_column(heading, footer=f"${totals[name]:.2f}", justify='right')
+    table.add_column('Bought', footer=str(totals['units_bought']), justify='right')
+    table.add_column('Sold', footer=str(totals['units_sold']), justify='right')
+    for row in series:
+        table.add_row(row['period'], f"${row['cost']:.2f}", f"${row['revenue']:.2f}", f"${row['profit']:.2f}",
+                      str(row['units_bought']), str(row['units_sold']))
+    with phase('render'):
+        get_console().print(table)
@@ -0,0 +1,236 @@
+# shell.py
+# Interactive shell and local daemon that load the ledgers once and keep the inventory, running totals and per-date totals in memory. Purchases and sales are still appended to the files, reads are answered from memory.
+# Other processes may write to the ledgers while the shell runs, so every command first catches up under the ledger lock: the stored inventory and totals are reread and the ledger rows added after the ones in memory are applied to the rollup. Use 'reload' after the ledgers were rewritten, e.g. by 'archive'.
+import os
+import shlex
+import socket
+import socketserver
+import sys
+import threading
+from buy import get_total_cost, register_purchases
+from date import get_date
+from locking import ledger_lock
+from rollup import apply_purchases, apply_sales, build_rollup, days_between
+from sell import get_total_revenue, register_sales
+from storage import get_storage
+
+socket_link = './files/superpy.sock'
+
+usage = {
+    'buy': 'buy <product> <amount> <price> <expiration days>',
+    'sell': 'sell <product> <amount> <price>',
+    'inventory': 'inventory',
+    'totalcost': 'totalcost',
+    'totalrevenue': 'totalrevenue',
+    'totalprofit': 'totalprofit',
+    'datecost': 'datecost <start date> [end date]',
+    'daterevenue': 'daterevenue <start date> [end date]',
+    'dateprofit': 'dateprofit <start date> [end date]',
+    'today': 'today',
+    'reload': 'reload',
+    'help': 'help',
+}
+
+
+# In-memory copy of the ledgers: the inventory, the running totals and the daily rollup.
+class LedgerState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load()
+
+    # (Re)loads everything from the selected storage backend.
+    def load(self):
+        self.inventory = get_storage().get_inventory()
+        self.rollup = build_rollup()
+        self.total_cost = get_total_cost()
+        self.total_revenue = get_total_revenue()
+
+    # Catches up with what was written since the state was loaded, by this process or another: rereads the inventory and the running totals and applies the ledger rows after the last ones in the rollup. Call it with the ledger lock held. Returns the dates of the applied rows.
+    def refresh(self):
+        storage = get_storage()
+        self.inventory = storage.get_inventory()
+        self.total_cost = get_total_cost()
+        self.total_revenue = get_total_revenue()
+        purchases = [item.to_row() for item in storage.get_bought_items_after(self.rollup['last_bought_id'])]
+        sales = [item.to_row() for item in storage.get_sold_items_after(self.rollup['last_sold_id'])]
+        apply_purchases(self.rollup, purchases)
+        apply_sales(self.rollup, sales)
+        return {row[3] for row in purchases + sales}
+
+    # Runs one command line and returns its output as text.
+    def execute(self, line):
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            return f"Error: {str(e)}"
+        if not words:
+            return ''
+        command, arguments = words[0], words[1:]
+        handler = getattr(self, 'do_' + command, None)
+        if command not in usage or handler is None:
+            return f"Unknown command {command!r}. Type 'help' for a list of commands."
+        try:
+            with self.lock, ledger_lock():
+                self.refresh()
+                return handler(*arguments)
+        except (TypeError, ValueError):
+            return f"Usage: {usage[command]}"
+
+    # Registers validated purchases in the ledger and in memory, returning the new ledger rows.
+    def buy(self, purchases):
+        with ledger_lock():
+            rows = register_purchases(purchases)
+            self.refresh()
+        return rows
+
+    # Registers validated sales in the ledger and in memory, returning the new ledger rows. Callers check the stock first, with the ledger lock held since the last refresh.
+    def sell(self, sales):
+        with ledger_lock():
+            rows = register_sales(sales)
+            self.refresh()
+        return rows
+
+    # Sums one rollup field over a date range (inclusive).
+    def sum_between(self, name, start_date, end_date=None):
+        return round(sum(day[name] for _, day in days_between(self.rollup, start_date, end_date or start_date)), 2)
+
+    def do_help(self):
+        return '\n'.join(usage.values())
+
+    def do_today(self):
+        return f'The current system date is: {get_date()}'
+
+    def do_reload(self):
+        self.load()
+        return 'Ledgers reloaded.'
+
+    def do_buy(self, product_name, amount, price, expiration_days):
+        amount, price, expiration_days = int(amount), float(price), int(expiration_days)
+        if amount <= 0 or price < 0:
+            raise ValueError
+        rows = self.buy([(product_name, amount, price, expiration_days)])
+        return f"You have purchased {amount} {product_name} at a cost price of ${price:.2f} each. They will expire on {rows[0][5]}. Total Cost = ${rows[0][6]:.2f}"
+
+    def do_sell(self, product_name, amount, price):
+        amount, price = int(amount), float(price)
+        if amount <= 0 or price < 0:
+            raise ValueError
+        available_stock = self.inventory.get(product_name)
+        if available_stock is None:
+            return f"Error: {product_name} not found in inventory."
+        if available_stock < amount:
+            return f"Error: Not enough stock for {product_name}. Available stock: {available_stock}"
+        rows = self.sell([(product_name, amount, price)])
+        return f"You have sold {amount} {product_name} at a selling price of ${price:.2f} each. Total Earnings = ${rows[0][5]:.2f}"
+
+    def do_inventory(self):
+        return '\n'.join(f'{product}|{stock}' for product, stock in self.inventory.items()) or 'The inventory is empty.'
+
+    def do_totalcost(self):
+        return f"Total cost of all items bought: ${self.total_cost:.2f}"
+
+    def do_totalrevenue(self):
+        return f"Total revenue from sales: ${self.total_revenue:.2f}"
+
+    def do_totalprofit(self):
+        return f"Total profit: ${self.total_revenue - self.total_cost:.2f}"
+
+    def do_datecost(self, start_date, end_date=None):
+        return f"Total cost{date_label(start_date, end_date)}: ${self.sum_between('cost', start_date, end_date):.2f}"
+
+    def do_daterevenue(self, start_date, end_date=None):
+        return f"Total revenue{date_label(start_date, end_date)}: ${self.sum_between('revenue', start_date, end_date):.2f}"
+
+    def do_dateprofit(self, start_date, end_date=None):
+        total_profit = self.sum_between('revenue', start_date, end_date) - \
+            self.sum_between('cost', start_date, end_date)
+        return f"Total profit{date_label(start_date, end_date)}: ${total_profit:.2f}"
+
+
+# Formats the date part of a metric message the same way as metrics.py.
+def date_label(start_date, end_date):
+    return f" for {start_date}" if not end_date else f" between {start_date} and {end_date}"
+
+
+# Reads command lines from stdin until 'quit' or end of input, passing each one to run_line and printing the result.
+def read_lines(run_line):
+    prompt = 'superpy> ' if sys.stdin.isatty() else ''
+    while True:
+        try:
+            line = input(prompt)
+        except (EOFError, KeyboardInterrupt):
+            break
+        if line.strip() in ('quit', 'exit'):
+            break
+        output = run_line(line)
+        if output:
+            print(output)
+
+
+# Starts the interactive shell in this process.
+def run_shell():
+    state = LedgerState()
+    read_lines(state.execute)
+
+
+# Answers command lines from one daemon client. Each response is terminated by an empty line.
+class ShellRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            output = self.server.state.execute(line.decode('utf-8').strip())
+            lines = [text + '\n' for text in output.splitlines() if text.strip()]
+            self.wfile.write((''.join(lines) + '\n').encode('utf-8'))
+
+
+# Runs the shell as a daemon on a local Unix socket, serving several clients against the same in-memory state. Refuses to start while another daemon answers on the socket; a socket file left behind by a daemon that stopped is replaced.
+def serve(file_path=socket_link):
+    if not hasattr(socket, 'AF_UNIX'):
+        print('Error: Unix sockets are not supported on this system.')
+        return
+    if os.path.exists(file_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(file_path)
+        except OSError:
+            os.remove(file_path)
+        else:
+            print(f'Error: a daemon is already serving on {file_path}.')
+            return
+        finally:
+            probe.close()
+    with socketserver.ThreadingUnixStreamServer(file_path, ShellRequestHandler) as server:
+        server.state = LedgerState()
+        print(f'Serving on {file_path}. Press Ctrl+C to stop.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(file_path)
+
+
+# Connects to a running daemon and forwards command lines from stdin to it.
+def connect(file_path=socket_link):
+    if not hasattr(socket, 'AF_UNIX'):
+        print('Error: Unix sockets are not supported on this system.')
+        return
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(file_path)
+    except OSError as e:
+        print(f"Error connecting to {file_path}: {str(e)}")
+        return
+    with client, client.makefile('rwb') as stream:
+        def run_line(line):
+            if not line.strip():
+                return ''
+            stream.write((line.strip() + '\n').encode('utf-8'))
+            stream.flush()
+            lines = []
+            for response in stream:
+                response = response.decode('utf-8').rstrip('\n')
+                if not response:
+                    break
+                lines.append(response)
+            return '\n'.join(lines)
+        read_lines(run_line)
@@ -0,0 +1,111 @@
+# snapshots.py
+# Point-in-time inventory. 'snapshots.json' keeps the stock per product at the end of past months; the inventory at the end of a date is the nearest snapshot on or before it plus the ledger rows dated after the snapshot, read through the date index (CSV) or an indexed query (SQLite). Archived rows (see archive.py) are replayed from the per-product units of the archive summary. A replay records the month ends it passes, so later queries only replay the rows since the last month end. Snapshots are only taken for dates before today, and rows registered later with an earlier date (with the virtual clock) drop the snapshots they change.
+import json
+from datetime import date, timedelta
+from date import get_date
+from locking import atomic_write, ledger_lock
+from profiling import timed
+from storage import get_storage
+
+snapshots_link = './files/snapshots.json'
+
+
+# Returns an empty snapshot store tied to the selected storage backend.
+def empty_snapshots():
+    return {'backend': get_storage().name, 'last_bought_id': 0, 'last_sold_id': 0, 'snapshots': {}}
+
+
+# Loads the snapshot store, returning None when it is missing or unreadable.
+def load_snapshots():
+    try:
+        with open(snapshots_link, 'r') as jsonfile:
+            return json.load(jsonfile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Writes the snapshot store.
+def save_snapshots(store):
+    with atomic_write(snapshots_link) as jsonfile:
+        json.dump(store, jsonfile)
+
+
+# Brings the snapshot store up to date with the rows registered since it was saved: snapshots dated on or after the earliest new row are dropped. The new rows are read backwards from the end of the ledgers.
+def refresh_snapshots(store):
+    storage = get_storage()
+    last_bought_id = storage.next_bought_id() - 1
+    last_sold_id = storage.next_sold_id() - 1
+    if (store is None or store.get('backend') != storage.name
+            or store['last_bought_id'] > last_bought_id or store['last_sold_id'] > last_sold_id):
+        store = empty_snapshots()
+
+    new_dates = [item.purchase_date for item in storage.get_bought_items_after(store['last_bought_id'])]
+    new_dates += [item.sell_date for item in storage.get_sold_items_after(store['last_sold_id'])]
+    if new_dates:
+        earliest = min(new_dates)
+        store['snapshots'] = {day: stock for day, stock in store['snapshots'].items() if day < earliest}
+    store['last_bought_id'] = last_bought_id
+    store['last_sold_id'] = last_sold_id
+    return store
+
+
+# Returns the last day of the month of a date.
+def month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+# Returns the month-end dates from start to stop (both inclusive), as YYYY-MM-DD.
+def month_ends(start, stop):
+    ends = []
+    current = month_end(date.fromisoformat(start))
+    while current.isoformat() <= stop:
+        ends.append(current.isoformat())
+        current = month_end(current + timedelta(days=1))
+    return ends
+
+
+# Returns the stock per product at the end of a date (YYYY-MM-DD), from the nearest snapshot and the ledger rows after it. Products without stock are left out. Raises ValueError for an invalid date.
+@timed('inventory as of')
+def get_inventory_as_of(as_of):
+    date.fromisoformat(as_of)
+    with ledger_lock():
+        store = refresh_snapshots(load_snapshots())
+        earlier = [day for day in store['snapshots'] if day <= as_of]
+        base_day = max(earlier) if earlier else None
+        stock = dict(store['snapshots'][base_day]) if base_day else {}
+        if base_day == as_of:
+            save_snapshots(store)
+            return stock
+
+        storage = get_storage()
+        first_date = (date.fromisoformat(base_day) + timedelta(days=1)).isoformat() if base_day else None
+        changes = {}
+        for item in storage.iter_bought_items(first_date=first_date, last_date=as_of):
+            day = changes.setdefault(item['purchase_date'], {})
+            day[item['product_name']] = day.get(item['product_name'], 0) + int(item['amount'])
+        for item in storage.iter_sold_items(first_date=first_date, last_date=as_of):
+            day = changes.setdefault(item['sell_date'], {})
+            day[item['product_name']] = day.get(item['product_name'], 0) - int(item['amount'])
+        summary = storage.get_archive_summary()
+        for day_date, totals in (summary['days'].items() if summary else ()):
+            if (first_date is None or day_date >= first_date) and day_date <= as_of:
+                day = changes.setdefault(day_date, {})
+                for product, (_, _, units_bought, units_sold) in totals['products'].items():
+                    day[product] = day.get(product, 0) + units_bought - units_sold
+
+        yesterday = (date.fromisoformat(get_date()) - timedelta(days=1)).isoformat()
+        start = first_date or min(changes, default=None)
+        ends = month_ends(start, min(as_of, yesterday)) if start else []
+        position = 0
+        for day in sorted(changes):
+            while position < len(ends) and ends[position] < day:
+                store['snapshots'][ends[position]] = dict(stock)
+                position += 1
+            for product, change in changes[day].items():
+                stock[product] = stock.get(product, 0) + change
+                if not stock[product]:
+                    del stock[product]
+        for end in ends[position:]:
+            store['snapshots'][end] = dict(stock)
+        save_snapshots(store)
+    return stock
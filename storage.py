@@ -0,0 +1,401 @@
+# storage.py
+# Repository layer for the ledgers, the inventory and the running totals of cost and revenue. The CSV files in ./files are one backend, a local SQLite database is the other. Select the backend with the --backend flag or the SUPERPY_BACKEND environment variable.
+import csv
+import json
+import os
+from itertools import islice
+from locking import atomic_write, ledger_lock, note_append
+from profiling import count, counted, phase
+from ledgertail import last_id, read_rows_after
+from dateindex import get_date_index, range_offset, range_sum
+from records import Purchase, Sale
+
+bought_link = './files/bought.csv'
+sold_link = './files/sold.csv'
+inventory_link = './files/inventory.csv'
+database_link = './files/superpy.db'
+archive_link = './files/archive'
+summary_link = './files/archive/summary.json'
+pending_link = './files/archive/pending.json'
+total_links = {'cost': './files/total_cost.txt', 'revenue': './files/total_revenue.txt'}
+
+bought_headers = ['id', 'amount', 'product_name',
+                  'purchase_date', 'price', 'expiration_date', 'total_cost']
+sold_headers = ['id', 'product_name', 'amount',
+                'sell_date', 'price', 'total_earnings']
+inventory_headers = ['Product', 'Current stock']
+
+backends = ('csv', 'sqlite')
+selected_backend = os.environ.get('SUPERPY_BACKEND', 'csv')
+_storage = None
+
+
+# Stores the ledgers in pipe-delimited CSV files. Whole-ledger reads return typed records (see records.py) decoded from the binary ledger cache when NumPy is available (see ledgercache.py) and parsed from the whole file otherwise, new IDs come from the last line read backwards from the end of the file, date queries use the sidecar date index (see dateindex.py) to seek straight to the first matching row, product queries read only the rows listed in the product index (see productindex.py), and fall back to the monthly partitions (see partitions.py) when a ledger is not in date order. Rows moved out by the 'archive' command (see archive.py) live on as the archive summary, which the ID and range-sum methods add to the live ledgers.
+class CsvStorage:
+    name = 'csv'
+
+    def __init__(self):
+        self._summary = None
+
+    def _read_rows(self, file_path):
+        rows = []
+        if os.path.isfile(file_path):
+            with phase('csv parse'), open(file_path, 'r', encoding='utf-8-sig') as file:
+                reader = csv.DictReader(file, delimiter='|')
+                for row in reader:
+                    rows.append(row)
+                count('bytes read', os.fstat(file.fileno()).st_size)
+            count('rows parsed', len(rows))
+        return rows
+
+    def _read_records(self, file_path, record_type, headers):
+        with phase('ledger read'):
+            from ledgercache import get_cached_records
+            records = get_cached_records(file_path, record_type, headers)
+            if records is None:
+                return [record_type.from_values([row[name] for name in headers])
+                        for row in self._read_rows(file_path)]
+            count('rows read', len(records))
+            return records
+
+    def _append_rows(self, file_path, headers, rows):
+        with phase('ledger append'):
+            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                with open(file_path, 'w', newline='') as file:
+                    csv.writer(file, delimiter='|').writerow(headers)
+            with open(file_path, 'a', newline='') as file:
+                start = file.tell()
+                csv.writer(file, delimiter='|').writerows(rows)
+                count('bytes written', file.tell() - start)
+            note_append(file_path, os.path.getsize(file_path))
+
+    def get_bought_items(self):
+        return self._read_records(bought_link, Purchase, bought_headers)
+
+    def get_sold_items(self):
+        return self._read_records(sold_link, Sale, sold_headers)
+
+    def _stream_rows(self, file_path, date_column, total_column, first_date, last_date):
+        if not os.path.isfile(file_path):
+            return
+        start = None
+        is_sorted = False
+        if first_date or last_date:
+            index = get_date_index(file_path, date_column, total_column)
+            is_sorted = index['sorted']
+            if is_sorted and first_date:
+                start = range_offset(index, first_date)
+                if start is None:
+                    return
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
+            fieldnames = next(csv.reader(file, delimiter='|'), None)
+            if fieldnames is None:
+                return
+            if start is not None:
+                file.seek(start)
+            for row in csv.DictReader(file, fieldnames=fieldnames, delimiter='|'):
+                if last_date and row[date_column] > last_date:
+                    if is_sorted:
+                        return
+                    continue
+                if first_date and row[date_column] < first_date:
+                    continue
+                yield row
+
+    def _product_rows(self, file_path, date_column, product_name, first_date, last_date):
+        from productindex import iter_product_rows
+        for row in iter_product_rows(file_path, product_name):
+            if (first_date is None or row[date_column] >= first_date) and (last_date is None or row[date_column] <= last_date):
+                yield row
+
+    def _iter_rows(self, file_path, date_column, total_column, product_name, first_date, last_date, limit, offset):
+        if product_name is not None:
+            rows = self._product_rows(file_path, date_column, product_name, first_date, last_date)
+        else:
+            rows = self._stream_rows(file_path, date_column, total_column, first_date, last_date)
+        return islice(counted(rows, 'rows read'), offset, None if limit is None else offset + limit)
+
+    def iter_bought_items(self, product_name=None, first_date=None, last_date=None, limit=None, offset=0):
+        return self._iter_rows(bought_link, 'purchase_date', 'total_cost',
+                               product_name, first_date, last_date, limit, offset)
+
+    def iter_sold_items(self, product_name=None, first_date=None, last_date=None, limit=None, offset=0):
+        return self._iter_rows(sold_link, 'sell_date', 'total_earnings',
+                               product_name, first_date, last_date, limit, offset)
+
+    def get_sold_between_dates(self, first_date, second_date):
+        return [Sale.from_values([item[name] for name in sold_headers])
+                for item in self.iter_sold_items(first_date=first_date, last_date=second_date)]
+
+    def get_bought_items_after(self, after_id):
+        return [Purchase.from_values(row) for row in read_rows_after(bought_link, after_id)]
+
+    def get_sold_items_after(self, after_id):
+        return [Sale.from_values(row) for row in read_rows_after(sold_link, after_id)]
+
+    def find_bought_id(self, product_name, amount):
+        for item in self.iter_bought_items(product_name):
+            if int(item['amount']) == amount:
+                return item['id']
+        return None
+
+    def _sum_between(self, file_path, date_column, total_column, summary_name, start_date, end_date):
+        index = get_date_index(file_path, date_column, total_column)
+        if not index['sorted']:
+            from partitions import range_totals
+            cents = range_totals(file_path, date_column, total_column, start_date, end_date)['total']
+        else:
+            cents = range_sum(index, start_date, end_date)
+        summary = self.get_archive_summary()
+        if summary:
+            cents += sum(round(day[summary_name] * 100) for day_date, day in summary['days'].items()
+                         if start_date <= day_date <= end_date)
+        return cents / 100
+
+    def sum_cost(self, start_date, end_date):
+        return self._sum_between(bought_link, 'purchase_date', 'total_cost', 'cost', start_date, end_date)
+
+    def sum_revenue(self, start_date, end_date):
+        return self._sum_between(sold_link, 'sell_date', 'total_earnings', 'revenue', start_date, end_date)
+
+    # Returns the summary of the archived ledger rows (see archive.py), or None when nothing was archived. Callers must not change it.
+    def get_archive_summary(self):
+        try:
+            status = os.stat(summary_link)
+        except FileNotFoundError:
+            return None
+        key = status.st_size, status.st_mtime_ns
+        if self._summary is None or self._summary[0] != key:
+            with open(summary_link, 'r') as jsonfile:
+                self._summary = key, json.load(jsonfile)
+        return self._summary[1]
+
+    def _next_id(self, file_path, summary_name):
+        summary = self.get_archive_summary()
+        return max(last_id(file_path), summary[summary_name] if summary else 0) + 1
+
+    def next_bought_id(self):
+        return self._next_id(bought_link, 'last_bought_id')
+
+    def next_sold_id(self):
+        return self._next_id(sold_link, 'last_sold_id')
+
+    def append_bought(self, rows):
+        self._append_rows(bought_link, bought_headers, rows)
+
+    def append_sold(self, rows):
+        self._append_rows(sold_link, sold_headers, rows)
+
+    def get_inventory(self):
+        inventory = {}
+        for row in self._read_rows(inventory_link):
+            inventory[row['Product']] = int(row['Current stock'])
+        return inventory
+
+    def save_inventory(self, inventory):
+        with atomic_write(inventory_link, newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(
+                csvfile, fieldnames=inventory_headers, delimiter='|')
+            writer.writeheader()
+            for product, stock in inventory.items():
+                writer.writerow({'Product': product, 'Current stock': stock})
+
+    # Returns the running total 'cost' or 'revenue' from its text file, or None when it is missing or unreadable.
+    def get_total(self, name):
+        try:
+            with open(total_links[name], 'r') as total_file:
+                return float(total_file.readline().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_total(self, name, value):
+        with atomic_write(total_links[name]) as total_file:
+            total_file.write(str(value))
+
+
+# Stores the ledgers in a local SQLite database with indexes on the date and product columns, so date ranges and product lookups are indexed queries. Rows are returned like the CSV backend does: typed records from the get_* methods, dicts of strings from the iter_* methods. The running totals live in the 'totals' table, so each backend keeps its own.
+class SqliteStorage:
+    name = 'sqlite'
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS bought (
+            id INTEGER PRIMARY KEY,
+            amount INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            purchase_date TEXT NOT NULL,
+            price REAL NOT NULL,
+            expiration_date TEXT NOT NULL,
+            total_cost REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sold (
+            id INTEGER PRIMARY KEY,
+            product_name TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            sell_date TEXT NOT NULL,
+            price REAL NOT NULL,
+            total_earnings REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS inventory (
+            product_name TEXT PRIMARY KEY,
+            stock INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS totals (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS bought_purchase_date ON bought (purchase_date);
+        CREATE INDEX IF NOT EXISTS bought_expiration_date ON bought (expiration_date);
+        CREATE INDEX IF NOT EXISTS bought_product_name ON bought (product_name);
+        CREATE INDEX IF NOT EXISTS sold_sell_date ON sold (sell_date);
+        CREATE INDEX IF NOT EXISTS sold_product_name ON sold (product_name);
+    '''
+
+    def __init__(self, file_path=database_link):
+        import sqlite3
+        self.connection = sqlite3.connect(file_path)
+        self.connection.executescript(self.schema)
+
+    def _select_records(self, record_type, query, parameters=()):
+        return [record_type.from_values(row) for row in self.connection.execute(query, parameters)]
+
+    def get_bought_items(self):
+        return self._select_records(Purchase, f"SELECT {', '.join(bought_headers)} FROM bought ORDER BY id")
+
+    def get_sold_items(self):
+        return self._select_records(Sale, f"SELECT {', '.join(sold_headers)} FROM sold ORDER BY id")
+
+    def _iter_rows(self, table, headers, date_column, product_name, first_date, last_date, limit, offset):
+        conditions, parameters = [], []
+        for condition, value in (('product_name = ?', product_name), (f'{date_column} >= ?', first_date),
+                                 (f'{date_column} <= ?', last_date)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(headers)} FROM {table}{where} ORDER BY id LIMIT ? OFFSET ?",
+            parameters + [-1 if limit is None else limit, offset])
+        for row in cursor:
+            yield dict(zip(headers, (str(value) for value in row)))
+
+    def iter_bought_items(self, product_name=None, first_date=None, last_date=None, limit=None, offset=0):
+        return self._iter_rows('bought', bought_headers, 'purchase_date',
+                               product_name, first_date, last_date, limit, offset)
+
+    def iter_sold_items(self, product_name=None, first_date=None, last_date=None, limit=None, offset=0):
+        return self._iter_rows('sold', sold_headers, 'sell_date',
+                               product_name, first_date, last_date, limit, offset)
+
+    def get_bought_items_after(self, after_id):
+        return self._select_records(
+            Purchase, f"SELECT {', '.join(bought_headers)} FROM bought WHERE id > ? ORDER BY id", (after_id,))
+
+    def get_sold_items_after(self, after_id):
+        return self._select_records(
+            Sale, f"SELECT {', '.join(sold_headers)} FROM sold WHERE id > ? ORDER BY id", (after_id,))
+
+    def get_sold_between_dates(self, first_date, second_date):
+        return self._select_records(
+            Sale, f"SELECT {', '.join(sold_headers)} FROM sold WHERE sell_date BETWEEN ? AND ? ORDER BY id",
+            (first_date, second_date))
+
+    def find_bought_id(self, product_name, amount):
+        row = self.connection.execute(
+            'SELECT id FROM bought WHERE product_name = ? AND amount = ? ORDER BY id LIMIT 1',
+            (product_name, amount)).fetchone()
+        return str(row[0]) if row else None
+
+    def sum_cost(self, start_date, end_date):
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(total_cost), 0) FROM bought WHERE purchase_date BETWEEN ? AND ?',
+            (start_date, end_date)).fetchone()[0]
+
+    def sum_revenue(self, start_date, end_date):
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(total_earnings), 0) FROM sold WHERE sell_date BETWEEN ? AND ?',
+            (start_date, end_date)).fetchone()[0]
+
+    def get_archive_summary(self):
+        return None
+
+    def next_bought_id(self):
+        return self.connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM bought').fetchone()[0]
+
+    def next_sold_id(self):
+        return self.connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM sold').fetchone()[0]
+
+    def append_bought(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO bought VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def append_sold(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO sold VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def get_inventory(self):
+        return dict(self.connection.execute(
+            'SELECT product_name, stock FROM inventory ORDER BY rowid'))
+
+    def save_inventory(self, inventory):
+        with self.connection:
+            self.connection.execute('DELETE FROM inventory')
+            self.connection.executemany(
+                'INSERT INTO inventory VALUES (?, ?)', inventory.items())
+
+    def get_total(self, name):
+        row = self.connection.execute('SELECT value FROM totals WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def save_total(self, name, value):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO totals VALUES (?, ?)', (name, value))
+
+
+# Selects the storage backend for the rest of the process.
+def set_backend(name):
+    global selected_backend, _storage
+    if name not in backends:
+        raise ValueError(
+            f"Unknown storage backend {name!r}, choose one of: {', '.join(backends)}")
+    if name != selected_backend:
+        selected_backend = name
+        _storage = None
+
+
+# Returns the storage object for the selected backend, opening it on first use. Opening the CSV backend first finishes an archive run that was interrupted (see archive.py).
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = SqliteStorage() if selected_backend == 'sqlite' else CsvStorage()
+        if _storage.name == 'csv' and os.path.exists(pending_link):
+            from archive import recover_archive
+            recover_archive()
+    return _storage
+
+
+# One-shot migration of the existing CSV ledgers, inventory and running totals into the SQLite database. Existing rows in the database are replaced.
+def migrate_csv_to_sqlite(file_path=database_link):
+    with ledger_lock():
+        return copy_csv_to_sqlite(file_path)
+
+
+# Copies the CSV ledgers, inventory and running totals into the SQLite database, replacing its rows.
+def copy_csv_to_sqlite(file_path):
+    source = CsvStorage()
+    target = SqliteStorage(file_path)
+    bought = [item.to_row() for item in source.get_bought_items()]
+    sold = [item.to_row() for item in source.get_sold_items()]
+    with target.connection:
+        target.connection.execute('DELETE FROM bought')
+        target.connection.execute('DELETE FROM sold')
+    target.append_bought(bought)
+    target.append_sold(sold)
+    target.save_inventory(source.get_inventory())
+    for name in total_links:
+        total = source.get_total(name)
+        if total is not None:
+            target.save_total(name, total)
+    target.connection.close()
+    return len(bought), len(sold)
@@ -0,0 +1,175 @@
+# verify.py
+# Integrity check of the stored state against the ledgers. 'verify' recomputes the total cost, the total revenue and the stock per product from the ledger rows and compares them with the running totals and the inventory stored by the backend, and checks every row (well-formed, increasing IDs, positive amounts, totals that match amount × price, expiration after purchase). The ledgers are read in chunks, in a process pool when they are large (see partitions.py): byte ranges of the CSV files or ID ranges of the SQLite tables. Row problems are reported per chunk with their row and ID range; with --repair the totals and the inventory are rewritten from the ledgers (the ledgers themselves are never changed).
+# Rows moved out by 'archive' count through the archive summary.
+import csv
+import os
+from datetime import date
+from locking import ledger_lock
+from output import print
+from partitions import read_lines, run_tasks, split_range
+from profiling import timed
+from storage import bought_headers, bought_link, database_link, get_storage, sold_headers, sold_link
+
+chunk_rows = 100000
+row_bytes = 50
+
+ledgers = {
+    'bought': (bought_link, bought_headers, 'purchase_date', 'total_cost', 'cost'),
+    'sold': (sold_link, sold_headers, 'sell_date', 'total_earnings', 'revenue'),
+}
+
+
+# Checks ledger rows and returns the chunk's row count, first and last ID, total in cents, units per product and problems as {message: [count, first row number in the chunk]}.
+def check_rows(rows, fieldnames, date_column, total_column):
+    positions = {name: fieldnames.index(name) for name in ('id', 'amount', 'product_name', 'price', date_column, total_column)}
+    expiration = fieldnames.index('expiration_date') if 'expiration_date' in fieldnames else None
+    result = {'rows': 0, 'first_id': None, 'last_id': None, 'total': 0, 'units': {}, 'problems': {}}
+    valid_dates = set()
+
+    def problem(message):
+        found = result['problems'].setdefault(message, [0, result['rows']])
+        found[0] += 1
+
+    def check_date(text):
+        if text not in valid_dates:
+            date.fromisoformat(text)
+            valid_dates.add(text)
+
+    for row in rows:
+        if not row:
+            continue
+        result['rows'] += 1
+        try:
+            if len(row) != len(fieldnames):
+                raise ValueError
+            row_id = int(row[positions['id']])
+            amount = int(row[positions['amount']])
+            price = float(row[positions['price']])
+            cents = round(float(row[positions[total_column]]) * 100)
+            check_date(str(row[positions[date_column]]))
+            if expiration is not None:
+                check_date(str(row[expiration]))
+        except (ValueError, TypeError):
+            problem('malformed rows')
+            continue
+        if result['last_id'] is not None and row_id <= result['last_id']:
+            problem('IDs that do not increase')
+        if amount <= 0:
+            problem('amounts that are not positive')
+        if cents != round(round(amount * price, 2) * 100):
+            problem('totals that do not match amount × price')
+        if expiration is not None and str(row[expiration]) < str(row[positions[date_column]]):
+            problem('expiration dates before the purchase date')
+        if result['first_id'] is None:
+            result['first_id'] = row_id
+        result['last_id'] = row_id
+        result['total'] += cents
+        product = str(row[positions['product_name']])
+        result['units'][product] = result['units'].get(product, 0) + amount
+    return result
+
+
+# Checks one chunk of a ledger: a byte range [start, end) of a CSV file or an ID range [start, end) of a SQLite table. Runs in the worker processes, so it only takes plain arguments.
+def check_chunk(backend, kind, fieldnames, start, end):
+    file_path, headers, date_column, total_column = ledgers[kind][:4]
+    if backend == 'csv':
+        with open(file_path, 'rb') as ledger:
+            return check_rows(csv.reader(read_lines(ledger, start, end), delimiter='|'),
+                              fieldnames, date_column, total_column)
+    import sqlite3
+    connection = sqlite3.connect(database_link)
+    try:
+        return check_rows(connection.execute(
+            f"SELECT {', '.join(headers)} FROM {kind} WHERE id >= ? AND id < ? ORDER BY id", (start, end)),
+            headers, date_column, total_column)
+    finally:
+        connection.close()
+
+
+# Returns the chunk tasks of a ledger for check_chunk and the number of bytes they cover (estimated from the row count for SQLite).
+def ledger_tasks(storage, kind):
+    file_path, headers = ledgers[kind][:2]
+    if storage.name == 'csv':
+        if not os.path.isfile(file_path):
+            return [], 0
+        with open(file_path, 'rb') as ledger:
+            header = ledger.readline()
+            size = os.fstat(ledger.fileno()).st_size
+        fieldnames = next(csv.reader([header.decode('utf-8-sig').strip()], delimiter='|'), [])
+        return [(storage.name, kind, fieldnames, start, end)
+                for start, end in split_range(len(header), size)], size - len(header)
+    last = storage.next_bought_id() if kind == 'bought' else storage.next_sold_id()
+    return [(storage.name, kind, headers, start, min(start + chunk_rows, last))
+            for start in range(1, last, chunk_rows)], (last - 1) * row_bytes
+
+
+# Checks the ledgers and the stored totals and inventory, repairing the totals and the inventory when asked. Returns a report: per ledger the row count, chunk count and row problems, and the totals and stock that differ as (name, stored, recomputed).
+@timed('verify')
+def verify(repair=False):
+    with ledger_lock():
+        storage = get_storage()
+        summary = storage.get_archive_summary()
+        stock = dict(summary['inventory']) if summary else {}
+        report = {'ledgers': {}, 'totals': [], 'stock': [], 'repaired': False}
+        for kind, (_, _, _, _, summary_name) in ledgers.items():
+            tasks, size = ledger_tasks(storage, kind)
+            chunks = run_tasks(check_chunk, tasks, size) if tasks else []
+            expected = sum(round(day[summary_name] * 100) for day in summary['days'].values()) if summary else 0
+            problems = []
+            first_row = 1
+            previous_id = None
+            for chunk in chunks:
+                if chunk['rows']:
+                    last_row = first_row + chunk['rows'] - 1
+                    if previous_id is not None and chunk['first_id'] is not None and chunk['first_id'] <= previous_id:
+                        chunk['problems'].setdefault('IDs that do not increase', [0, 1])[0] += 1
+                    for message, (found, first_at) in chunk['problems'].items():
+                        problems.append({'rows': (first_row, last_row), 'ids': (chunk['first_id'], chunk['last_id']),
+                                         'message': message, 'count': found, 'first_row': first_row + first_at - 1})
+                    first_row = last_row + 1
+                    previous_id = chunk['last_id'] if chunk['last_id'] is not None else previous_id
+                expected += chunk['total']
+                sign = 1 if kind == 'bought' else -1
+                for product, units in chunk['units'].items():
+                    stock[product] = stock.get(product, 0) + sign * units
+            report['ledgers'][kind] = {'rows': first_row - 1, 'chunks': len(chunks), 'problems': problems}
+            stored = storage.get_total(summary_name)
+            stored = None if stored is None else round(stored * 100)
+            if stored != expected:
+                report['totals'].append((summary_name, stored, expected))
+
+        stored_stock = storage.get_inventory()
+        for product in sorted(set(stored_stock) | set(stock)):
+            if stored_stock.get(product, 0) != stock.get(product, 0):
+                report['stock'].append((product, stored_stock.get(product), stock.get(product, 0)))
+
+        if repair and (report['totals'] or report['stock']):
+            for name, _, expected in report['totals']:
+                storage.save_total(name, round(expected / 100, 2))
+            inventory = {product: stock.get(product, 0) for product in stored_stock}
+            inventory.update((product, units) for product, units in stock.items()
+                             if product not in inventory and units)
+            storage.save_inventory(inventory)
+            report['repaired'] = True
+    return report
+
+
+# Runs the check and prints what differs.
+def display_verify(repair=False):
+    report = verify(repair)
+    for kind, checked in report['ledgers'].items():
+        print(f"Checked {checked['rows']} rows of the {kind} ledger in {checked['chunks']} chunks.")
+        for problem in checked['problems']:
+            print(f"  rows {problem['rows'][0]}-{problem['rows'][1]} (IDs {problem['ids'][0]}-{problem['ids'][1]}): "
+                  f"{problem['count']} {problem['message']}, first at row {problem['first_row']}")
+    for name, stored, expected in report['totals']:
+        stored_text = 'missing' if stored is None else f"${stored / 100:.2f}"
+        print(f"Total {name} differs: stored {stored_text}, ledgers ${expected / 100:.2f}")
+    for product, stored, expected in report['stock']:
+        print(f"Stock of {product} differs: stored {'missing' if stored is None else stored}, ledgers {expected}")
+    if not report['totals'] and not report['stock']:
+        print("The totals and the inventory match the ledgers.")
+    elif report['repaired']:
+        print(f"Repaired {len(report['totals'])} totals and the stock of {len(report['stock'])} products.")
+    else:
+        print("Run 'verify --repair' to rewrite the totals and the inventory from the ledgers.")